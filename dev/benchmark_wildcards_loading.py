@@ -0,0 +1,112 @@
+"""
+Benchmarks the loading of the wildcard files with a large generated library.
+
+It compares the time to decode the files with the previous approach (a new ruamel safe loader for every file, reading
+the file again with windows-1252 on any error) against the current loaders, and then the time of a complete cold
+load of the library with PPPWildcards.
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from ppp_logging import DEBUG_LEVEL  # pylint: disable=wrong-import-position
+from ppp_utils import decode_text, load_structured_text  # pylint: disable=wrong-import-position
+from ppp_wildcards import PPPWildcards  # pylint: disable=wrong-import-position
+
+WORDS = ["red", "blue", "green", "tall", "small", "cat", "dog", "forest", "city", "night", "day", "soft", "light"]
+
+
+def random_choice(rng: random.Random) -> str:
+    """Generate a random choice text."""
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+
+
+def generate_library(folder: Path, files: int, choices: int, seed: int):
+    """Generate a library of wildcard files, a third of each format."""
+    rng = random.Random(seed)
+    for i in range(files):
+        subfolder = folder / f"group{i % 20}"
+        subfolder.mkdir(exist_ok=True)
+        # the name of a structured file is not part of the keys, so the content has its own top level key
+        content = {f"file{i}": {f"wc{j}": [random_choice(rng) for _ in range(choices)] for j in range(5)}}
+        if i % 3 == 0:
+            (subfolder / f"file{i}.txt").write_text("\n".join(content[f"file{i}"]["wc0"]), encoding="utf-8")
+        elif i % 3 == 1:
+            (subfolder / f"file{i}.json").write_text(json.dumps(content, indent=2), encoding="utf-8")
+        else:
+            with open(subfolder / f"file{i}.yaml", "w", encoding="utf-8") as f:
+                YAML(typ="safe", pure=True).dump(content, f)
+
+
+def load_previous(path: Path):
+    """Decode a file like the previous version did."""
+    if path.suffix == ".txt":
+        with open(path, "r", encoding="utf-8") as file:
+            return [x.strip("\n\r") for x in file.readlines()]
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return YAML(typ="safe").load(file)
+    except Exception:  # pylint: disable=broad-except
+        with open(path, "r", encoding="windows-1252") as file:
+            return YAML(typ="safe").load(file)
+
+
+def load_current(path: Path):
+    """Decode a file with the current loaders."""
+    text, _ = decode_text(path.read_bytes())
+    if path.suffix == ".txt":
+        return text.splitlines()
+    return load_structured_text(text, path.suffix == ".json")
+
+
+def measure(name: str, files: list[Path], loader, repeat: int) -> float:
+    """Measure the best time of loading all the files."""
+    best = None
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        for f in files:
+            loader(f)
+        elapsed = time.perf_counter() - t1
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<30} {best:8.3f} s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the loading of wildcard files.")
+    parser.add_argument("--files", type=int, default=1500, help="number of files to generate")
+    parser.add_argument("--choices", type=int, default=40, help="number of choices in each wildcard")
+    parser.add_argument("--repeat", type=int, default=3, help="number of repetitions of each measurement")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the generated library")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        root = Path(folder)
+        generate_library(root, args.files, args.choices, args.seed)
+        files = sorted(f for f in root.rglob("*") if f.is_file())
+        print(f"Library: {len(files)} files in {folder}")
+        for suffix in (".txt", ".json", ".yaml"):
+            subset = [f for f in files if f.suffix == suffix]
+            print(f"-- {suffix} ({len(subset)} files)")
+            previous = measure("previous loader", subset, load_previous, args.repeat)
+            current = measure("current loader", subset, load_current, args.repeat)
+            print(f"{'speedup':<30} {previous / current:8.2f} x")
+        print("-- cold load of the library")
+        t1 = time.perf_counter()
+        wildcards = PPPWildcards(None, None)
+        wildcards.refresh_wildcards(DEBUG_LEVEL.none, [root])
+        elapsed = time.perf_counter() - t1
+        print(f"{'refresh_wildcards':<30} {elapsed:8.3f} s ({len(wildcards.wildcards)} wildcards)")
+
+
+if __name__ == "__main__":
+    main()
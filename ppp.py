@@ -23,6 +23,7 @@ from ppp_classes import (
     VariantConfig,
     PPPConfig,
     IFWILDCARDS_CHOICES,
+    ONWARNING_CHOICES,
     SUPPORTED_APPS,
     PPPInterrupt,
     PPPState,
@@ -33,10 +34,19 @@ from ppp_variables import VariableRepository, VariableEntry, VariableValue
 from ppp_logging import DEBUG_LEVEL, log
 from ppp_tree import TreeProcessor
 from ppp_utils import escape_single_quotes, get_version_from_pyproject
-from ppp_common import get_model_class_from_filename, load_grammar, parse_prompt, preprocess_grammar, warn_or_stop
-from ppp_wildcards import PPPWildcards
+from ppp_common import (
+    PPPParsers,
+    get_model_class_from_filename,
+    load_grammar,
+    parse_prompt,
+    warn_or_stop,
+)
+from ppp_wildcards import PPPWildcard, PPPWildcards
 from ppp_enmappings import PPPExtraNetworkMappings
 
+# the default grammar is read once and shared by all the instances
+_DEFAULT_GRAMMAR = load_grammar()
+
 
 class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
     """
@@ -46,6 +56,14 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
     NAME = "Prompt Post-Processor"
     VERSION = get_version_from_pyproject()
 
+    # Finds the features of a prompt in a single pass (zero-width matches, so they can overlap)
+    PROMPT_FEATURES_SCANNER = re.compile(
+        r"(?=(?P<wildcards>(?<!\\)__)"
+        r"|(?P<choices>(?<!\$\\)\{|\})"
+        r"|(?P<commvars>(?<!\\)(?:<ppp:|\$\{))"
+        r"|(?P<constructs>[()\[\]<\\$]|AND|BREAK))"
+    )
+
     defopt = {f.name: f.default for f in dataclasses.fields(PPPStateOptions)}
     DEFAULT_DEBUG_LEVEL = defopt["debug_level"].value
     DEFAULT_ON_WARNING = defopt["on_warning"].value
@@ -108,19 +126,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
         host_config = self.__load_config_and_detect(env_info)
 
         if grammar_content is None:
-            grammar_content = load_grammar()
-        # Preprocess grammar content for conditional compilation
-        grammar_content_full = preprocess_grammar(
-            grammar_content,
-            {
-                "ALLOW_NEW_CONTENT": True,
-                "ALLOW_WILDCARDS": True,
-                "ALLOW_CHOICES": True,
-                "ALLOW_COMMVARS": True,
-            },
-            self.logger,
-            self.debug_level,
-        )
+            grammar_content = _DEFAULT_GRAMMAR
 
         self.state = PPPState(
             logger=self.logger,
@@ -131,145 +137,16 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             variables=VariableRepository(),
             wildcards_obj=wildcards_obj,
             extranetwork_mappings_obj=extranetwork_mappings_obj,
-            parsers={
-                "full": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                ),
-                "wc_ch": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": True,
-                            "ALLOW_CHOICES": True,
-                            "ALLOW_COMMVARS": False,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "wc_cv": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": True,
-                            "ALLOW_CHOICES": False,
-                            "ALLOW_COMMVARS": True,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "ch_cv": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": False,
-                            "ALLOW_CHOICES": True,
-                            "ALLOW_COMMVARS": True,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "wc": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": True,
-                            "ALLOW_CHOICES": False,
-                            "ALLOW_COMMVARS": False,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "ch": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": False,
-                            "ALLOW_CHOICES": True,
-                            "ALLOW_COMMVARS": False,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "cv": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": True,
-                            "ALLOW_WILDCARDS": False,
-                            "ALLOW_CHOICES": False,
-                            "ALLOW_COMMVARS": True,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                "only_old": lark.Lark(
-                    preprocess_grammar(
-                        grammar_content,
-                        {
-                            "ALLOW_NEW_CONTENT": False,
-                            "ALLOW_WILDCARDS": False,
-                            "ALLOW_CHOICES": False,
-                            "ALLOW_COMMVARS": False,
-                        },
-                        self.logger,
-                        self.debug_level,
-                    ),
-                    propagate_positions=True,
-                ),
-                # Partial parsers
-                "content": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="content",
-                ),
-                "choice": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="choice",
-                ),
-                "wcdefoptions": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="wcdefoptions",
-                ),
-                "condition": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="condition",
-                ),
-                "choicevalue": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="choicevalue",
-                ),
-                "wc_filter_or": lark.Lark(
-                    grammar_content_full,
-                    propagate_positions=True,
-                    start="wc_filter_or",
-                ),
-            },
+            # the parsers are compiled or loaded when they are first needed
+            parsers=PPPParsers(
+                grammar_content, self.logger, self.debug_level, use_fallback=grammar_content == _DEFAULT_GRAMMAR
+            ),
         )
         self.__init_sysvars()
+        if wildcards_obj is not None:
+            wildcards_obj.set_warmup_initializer(self.__get_warmed_wildcard)
 
-    def log(self, kind, message: str, min_level: DEBUG_LEVEL | None = None, exc_info=None):
+    def log(self, kind, message: str | Callable[[], str], min_level: DEBUG_LEVEL | None = None, exc_info=None):
         log(self.logger, self.debug_level, kind, message, min_level, exc_info=exc_info)
 
     def __load_config_and_detect(self, env_info: dict[str, Any]) -> HostConfig:
@@ -326,7 +203,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                     if missing_hosts:
                         self.log(
                             logging.INFO,
-                            f"Adding missing host(s) from default to user configuration: {', '.join(sorted(missing_hosts))}",
+                            lambda: f"Adding missing host(s) from default to user configuration: {', '.join(sorted(missing_hosts))}",
                         )
                         if not user_raw.get("hosts"):
                             user_raw["hosts"] = {}
@@ -336,7 +213,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                     if missing_models:
                         self.log(
                             logging.INFO,
-                            f"Adding missing model(s) from default to user configuration: {', '.join(sorted(missing_models))}",
+                            lambda: f"Adding missing model(s) from default to user configuration: {', '.join(sorted(missing_models))}",
                         )
                         if not user_raw.get("models"):
                             user_raw["models"] = {}
@@ -349,7 +226,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                         user_cfg, _ = self.__parse_configuration(user_raw, "user configuration")
                         self.log(
                             logging.INFO,
-                            f"Saved updated user configuration to '{escape_single_quotes(user_config_file)}'.",
+                            lambda: f"Saved updated user configuration to '{escape_single_quotes(user_config_file)}'.",
                         )
                     except Exception as exc:  # pylint: disable=broad-exception-caught
                         self.log(logging.WARNING, f"Failed to save updated user configuration: {exc}")
@@ -394,7 +271,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                     )
         self.log(
             logging.DEBUG,
-            f"Host configuration ({escape_single_quotes(app)}): {host_config}",
+            lambda: f"Host configuration ({escape_single_quotes(app)}): {host_config}",
             min_level=DEBUG_LEVEL.minimal,
         )
 
@@ -412,7 +289,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                 env_info["model_class"] = model_class
                 self.log(
                     logging.DEBUG,
-                    f"Detected model class '{model_class}' from filename '{model_name}'",
+                    lambda: f"Detected model class '{model_class}' from filename '{model_name}'",
                     min_level=DEBUG_LEVEL.minimal,
                 )
         for m in self.known_models:
@@ -434,7 +311,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
         """Called when _modelfullname or _modelclass are set via a prompt command."""
         self.__run_model_detection(self.state.env_info)
         self.__init_sysvars()
-        self.log(logging.DEBUG, f"Updated system variables: {self.state.variables.all_system}")
+        self.log(logging.DEBUG, lambda: f"Updated system variables: {self.state.variables.all_system}")
 
     def update(
         self,
@@ -459,6 +336,8 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             cyclical_state=self.state.cyclical_state,
         )
         self.__init_sysvars()
+        if wildcards_obj is not None:
+            wildcards_obj.set_warmup_initializer(self.__get_warmed_wildcard)
 
     def __merge_configuration(self, user_config: PPPConfig):
         """
@@ -758,7 +637,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             text2 = re.sub(r"\b\s*BREAK\s*\b", break_replacements[break_processing][1], text)
             if text2 != text:
                 text = text2
-                self.log(logging.DEBUG, f"BREAK construct {break_replacements[break_processing][0]}")
+                self.log(logging.DEBUG, lambda: f"BREAK construct {break_replacements[break_processing][0]}")
         elif break_processing == "error":
             if re.search(r"\bBREAK\b", text):
                 warn_or_stop(self.state, where == -1, "BREAK constructs are not allowed!")
@@ -841,7 +720,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
 
         return text
 
-    def __get_best_parser(self, prompt: str) -> tuple[lark.Lark, str]:
+    def __get_best_parser(self, prompt: str) -> tuple[lark.Lark | None, str]:
         """
         Checks the prompt and returns the best parser to use based on its content.
 
@@ -849,12 +728,16 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             prompt (str): The prompt to check.
 
         Returns:
-            tuple[lark.Lark, str]: The best parser and its description.
+            tuple[lark.Lark|None, str]: The best parser (None if the prompt is plain text) and its description.
         """
+        features = {m.lastgroup for m in self.PROMPT_FEATURES_SCANNER.finditer(prompt)}
+        if not features and prompt.count("\x1d") == 1:
+            # nothing to parse or process
+            return (None, "no parser for plain text")
         tests = {
-            "ALLOW_WILDCARDS": re.search(r"(?<!\\)__", prompt) is not None,
-            "ALLOW_CHOICES": re.search(r"(?<!\$\\)\{|\}", prompt) is not None,
-            "ALLOW_COMMVARS": re.search(r"(?<!\\)(?:<ppp:|\$\{)", prompt) is not None,
+            "ALLOW_WILDCARDS": "wildcards" in features,
+            "ALLOW_CHOICES": "choices" in features,
+            "ALLOW_COMMVARS": "commvars" in features,
         }
         if tests["ALLOW_WILDCARDS"] and tests["ALLOW_CHOICES"] and tests["ALLOW_COMMVARS"]:
             return (
@@ -913,8 +796,8 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
         prompt = self.__cleanup(prompt, 1)
         negative_prompt = self.__cleanup(negative_prompt, -1)
 
-        self.log(logging.INFO, f"Result prompt: {prompt}")
-        self.log(logging.INFO, f"Result negative_prompt: {negative_prompt}")
+        self.log(logging.INFO, lambda: f"Result prompt: {prompt}")
+        self.log(logging.INFO, lambda: f"Result negative_prompt: {negative_prompt}")
         try:
             # Get and clean variables - prefer the explicitly echoed value; fall back to the evaluated value.
             var_keys = sorted(variables_snapshot.keys())
@@ -928,12 +811,12 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                         ev = self.__cleanup(ev, 0)
                     all_variables[k] = ev
 
-            self.log(logging.INFO, f"Result variables: {all_variables}")
+            self.log(logging.INFO, lambda: f"Result variables: {all_variables}")
             if unechoed_variables:
                 unechoed_values = {k: v for k, v in all_variables.items() if k in unechoed_variables}
                 self.log(
                     logging.INFO,
-                    f"Variables that were never echoed: {unechoed_values}",
+                    lambda: f"Variables that were never echoed: {unechoed_values}",
                 )
 
             # Result checks
@@ -1058,28 +941,37 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                     f"Input '{input_name}' has an unsupported type {type(input_value).__name__} for a system variable and will be skipped.",
                 )
 
-        filtered_sysvars_inputs = {k: v for k, v in self.state.variables.all_system.items() if k.startswith("_input_")}
-        self.log(logging.INFO, f"Inputs: {filtered_sysvars_inputs}")
+        self.log(
+            logging.INFO,
+            lambda: "Inputs: "
+            + str({k: v for k, v in self.state.variables.all_system.items() if k.startswith("_input_")}),
+        )
 
         rng = np.random.default_rng(self.state.inputs.seed)
 
-        # Parse both prompts
-        processor = TreeProcessor(self.state, rng, on_model_info_update=self.__on_model_info_update)
         # We use the ASCII Group Separator character between prompt and negative prompt since it's unlikely to appear in prompts
         unified_prompt = prompt + "\x1d" + negative_prompt
         prompt_parser, parser_description = self.__get_best_parser(unified_prompt)
-        self.log(logging.DEBUG, f"Using {parser_description} for prompt")
-        parsed = parse_prompt(
-            self.state,
-            "prompt",
-            unified_prompt,
-            prompt_parser,
-        )
+        self.log(logging.DEBUG, lambda: f"Using {parser_description} for prompt")
+
+        if prompt_parser is not None:
+            # Parse both prompts
+            processor = TreeProcessor(self.state, rng, on_model_info_update=self.__on_model_info_update)
+            parsed = parse_prompt(
+                self.state,
+                "prompt",
+                unified_prompt,
+                prompt_parser,
+            )
 
         # Process the unified prompt
         t1 = time.monotonic_ns()
         try:
-            results = processor.start_visit(parsed)
+            if prompt_parser is None:
+                # plain text is processed as is
+                results = [(unified_prompt, [], self.state.variables.backup_user())]
+            else:
+                results = processor.start_visit(parsed)
         except PPPInterrupt as e:
             results = []
             self.log(logging.ERROR, e.message)
@@ -1090,15 +982,15 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             self.log(logging.ERROR, "Interrupting!")
             self.interrupt()
         t2 = time.monotonic_ns()
-        self.log(logging.INFO, f"Visit time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
+        self.log(logging.INFO, lambda: f"Visit time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
 
         final_results: list[tuple[str, str, dict[str, Any]]] = []
         for i, r in enumerate(results):
             if self.state.options.do_combinatorial:
-                self.log(logging.INFO, f"Combination {i + 1}:")
+                self.log(logging.INFO, lambda: f"Combination {i + 1}:")
             final_results.append(self.__postprocess_result(r))
         if self.state.options.do_combinatorial:
-            self.log(logging.INFO, f"Total combinations: {len(final_results)}")
+            self.log(logging.INFO, lambda: f"Total combinations: {len(final_results)}")
             if self.state.options.combinatorial_shuffle:
                 rng.shuffle(final_results)
                 self.log(logging.INFO, "Combinations shuffled")
@@ -1106,9 +998,12 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
 
     def process_prompts_group_start(self):
         """Start of a prompt processing group."""
-        filtered_sysvars = {k: v for k, v in self.state.variables.all_system.items() if not k.startswith("_input_")}
-        self.log(logging.DEBUG, f"System variables: {filtered_sysvars}")
-        self.log(logging.INFO, f"Combinatorial: {self.state.options.do_combinatorial}")
+        self.log(
+            logging.DEBUG,
+            lambda: "System variables: "
+            + str({k: v for k, v in self.state.variables.all_system.items() if not k.startswith("_input_")}),
+        )
+        self.log(logging.INFO, lambda: f"Combinatorial: {self.state.options.do_combinatorial}")
 
     def _expand_filename(self) -> Path:
         """Expand %...% tokens in a filename template and resolve relative paths against the extension logs folder."""
@@ -1133,7 +1028,7 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             return
         try:
             filepath = self._expand_filename()
-            self.log(logging.INFO, f"Saving results to file: {filepath}")
+            self.log(logging.INFO, lambda: f"Saving results to file: {filepath}")
             ext = filepath.suffix.lower()
             records = []
             for result_prompt, result_neg_prompt, all_variables in results:
@@ -1243,8 +1138,8 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
                 self.state.cyclical_state.last_prompt_pair = (original_prompt, original_negative_prompt)
             results = self.__processprompts(prompt, negative_prompt, seed, jobinfo)
             t2 = time.monotonic_ns()
-            self.log(logging.INFO, f"Process prompt pair time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
-            # self.log(logging.DEBUG,f"Wildcards memory usage: {self.state.wildcards_obj.__sizeof__()}")
+            self.log(logging.INFO, lambda: f"Process prompt pair time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
+            # self.log(logging.DEBUG,f"Wildcards memory usage: {self.state.wildcards_obj.get_memory_usage()}")
             self.__save_results(results)
             return results
         except PPPInterrupt as e:
@@ -1260,5 +1155,54 @@ class PromptPostProcessor:  # pylint: disable=too-few-public-methods,too-many-in
             self.log(logging.ERROR, "Unexpected error", exc_info=e)
             return [(original_prompt, original_negative_prompt, {})]
 
+    def warm_up_wildcards(self, max_workers: int = 2, progress_callback: Optional[Callable[[int, int], None]] = None):
+        """
+        Starts initializing in the background the wildcards that have not been used yet.
+
+        Args:
+            max_workers (int): The number of threads to use.
+            progress_callback (Optional[Callable[[int, int], None]]): Function called with the number of processed
+                wildcards and the total after each one.
+
+        Returns:
+            Optional[PPPWildcardsWarmup]: The current warm-up, if any.
+        """
+        if self.state.wildcards_obj is None:
+            return None
+        return self.state.wildcards_obj.start_warmup(self.__get_warmed_wildcard, max_workers, progress_callback)
+
+    def __get_warmed_wildcard(self, wildcard: PPPWildcard) -> Optional[PPPWildcard]:
+        """
+        Initializes a copy of a wildcard, for the warm-up.
+
+        The warnings are not shown, since the wildcard is initialized again when it is used if there are any.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+
+        Returns:
+            Optional[PPPWildcard]: The initialized copy, or None if it could not be initialized.
+        """
+        choices = wildcard.unprocessed_choices
+        if choices is None:
+            return None
+        state = dataclasses.replace(
+            self.state,
+            options=dataclasses.replace(
+                self.state.options, debug_level=DEBUG_LEVEL.none, on_warning=ONWARNING_CHOICES.stop
+            ),
+        )
+        warmed = PPPWildcard(wildcard.file, wildcard.key, choices)
+        try:
+            TreeProcessor(state, np.random.default_rng()).initialize_wildcard(warmed)
+        except PPPInterrupt:
+            return None
+        return warmed
+
     def process_prompts_group_end(self):
         """End of a prompt processing group."""
+        if self.state.wildcards_obj is not None:
+            # store the newly parsed wildcard choices so they can be reused after a restart
+            self.state.wildcards_obj.save_parsed_choices()
+            # and keep in memory only the ones of the most recently used files, if limited
+            self.state.wildcards_obj.trim_parsed_choices()
@@ -1,5 +1,6 @@
 from collections import OrderedDict
 from logging import Logger
+import threading
 from typing import Tuple
 
 from ppp_logging import DEBUG_LEVEL
@@ -13,19 +14,26 @@ class PPPLRUCache:
     def __init__(self, capacity: int, logger: Logger = None, debug_level: DEBUG_LEVEL = DEBUG_LEVEL.none):
         self.cache = OrderedDict()
         self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
         self._logger = logger
         self._debug_level = debug_level
+        self._lock = threading.Lock()
 
     def get(self, key: ProcessInput) -> ProcessResult:
-        if key not in self.cache:
-            return None
-        self.cache.move_to_end(key)
-        return self.cache[key]
+        with self._lock:
+            if key not in self.cache:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
 
     def put(self, key: ProcessInput, value: ProcessResult) -> None:
-        self.cache[key] = value
-        self.cache.move_to_end(key)
-        if len(self.cache) > self.capacity:
-            self.cache.popitem(last=False)
+        with self._lock:
+            self.cache[key] = value
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
         # if self._logger is not None and self._debug_level != DEBUG_LEVEL.none:
         #     self._logger.debug(f"Cache size: {self.cache.__sizeof__()}")
@@ -1,5 +1,6 @@
 """Pydantic models for the PPP configuration file structure (ppp_config.yaml)."""
 
+from collections.abc import Mapping
 from dataclasses import dataclass, field
 from logging import Logger
 import re
@@ -284,7 +285,7 @@ class PPPState:
     variables: VariableRepository = field(default_factory=VariableRepository)
     wildcards_obj: PPPWildcards = field(default_factory=PPPWildcards)
     extranetwork_mappings_obj: PPPExtraNetworkMappings = field(default_factory=PPPExtraNetworkMappings)
-    parsers: dict[str, Lark] = field(default_factory=dict)
+    parsers: Mapping[str, Lark] = field(default_factory=dict)
     cyclical_state: CyclicalSamplerState = field(default_factory=CyclicalSamplerState)
 
 
@@ -68,8 +68,20 @@ class PromptPostProcessorComfyUINode:
         lf = PromptPostProcessorLogFactory()
         self.logger = lf.log
         self.grammar_content = load_grammar()
-        self.wildcards_obj = PPPWildcards(lf.log)
-        self.extranetwork_mappings_obj = PPPExtraNetworkMappings(lf.log)
+        watch_folders = os.getenv("PPP_WATCH_FOLDERS", "") == "1"
+        load_processes = os.getenv("PPP_WILDCARDS_LOAD_PROCESSES", "")
+        max_parsed_files = os.getenv("PPP_WILDCARDS_MAX_PARSED_FILES", "")
+        warmup_threads = os.getenv("PPP_WILDCARDS_WARMUP", "")
+        self.wildcards_obj = PPPWildcards(
+            lf.log,
+            watch_folders=watch_folders,
+            load_processes=int(load_processes) if load_processes.isdigit() else 0,
+            max_parsed_files=int(max_parsed_files) if max_parsed_files.isdigit() else 0,
+            lazy_load=os.getenv("PPP_WILDCARDS_LAZY_LOAD", "") == "1",
+            lines_index=os.getenv("PPP_WILDCARDS_LINES_INDEX", "") == "1",
+            warmup_threads=int(warmup_threads) if warmup_threads.isdigit() else 0,
+        )
+        self.extranetwork_mappings_obj = PPPExtraNetworkMappings(lf.log, watch_folders=watch_folders)
         self.ppp: PromptPostProcessor | None = None
         log(
             self.logger,
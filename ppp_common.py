@@ -1,17 +1,33 @@
 import ast
+from collections.abc import Mapping
+import copyreg
 import csv
 from functools import reduce
+import hashlib
+import importlib
+import io
 import logging
 from pathlib import Path
+import pickle
 import re
+import sys
 import textwrap
+import threading
 import time
+import types
+from typing import Optional
 import lark
 from ruamel.yaml import YAML as _YAML
 
+from ppp_cache import PPPLRUCache
 from ppp_logging import log
 from ppp_classes import ONWARNING_CHOICES, PPPInterrupt, PPPState
-from ppp_utils import escape_single_quotes, format_output
+from ppp_utils import CACHE_FOLDER, escape_single_quotes, format_output, write_file_atomically
+
+
+# Parsing is deterministic, so the trees of recently parsed prompts are reused (keyed by parser and prompt)
+PARSE_CACHE_SIZE = 256
+_parse_cache = PPPLRUCache(PARSE_CACHE_SIZE)
 
 
 def parse_prompt(
@@ -20,6 +36,7 @@ def parse_prompt(
     prompt: str,
     parser: lark.Lark,
     raise_parsing_error: bool = False,
+    use_cache: bool = True,
 ):
     """
     Parses a prompt using the specified parser.
@@ -29,28 +46,37 @@ def parse_prompt(
         prompt (str): The prompt to be parsed.
         parser (lark.Lark): The parser to be used.
         raise_parsing_error (bool): Whether to raise a parsing error.
+        use_cache (bool): Whether to use the cache of recently parsed prompts. Texts that are cached elsewhere (like
+            the choices of the wildcards) should not use it, so they don't push the prompts out of it.
 
     Returns:
-        Tree: The parsed prompt.
+        Tree: The parsed prompt. It is shared with other calls with the same prompt and parser, so it must not be modified.
     """
+    cache_key = (parser, prompt)
+    parsed_prompt = _parse_cache.get(cache_key) if use_cache else None
+    if parsed_prompt is not None:
+        log(
+            state.logger,
+            state.options.debug_level,
+            logging.DEBUG,
+            lambda: f"Parsing {prompt_description} (cached, {_parse_cache.hits} hits / {_parse_cache.misses} misses): '{escape_single_quotes(prompt)}'",
+        )
+        return parsed_prompt
     t1 = time.monotonic_ns()
-    parsed_prompt = None
     try:
         log(
             state.logger,
             state.options.debug_level,
             logging.DEBUG,
-            f"Parsing {prompt_description}: '{escape_single_quotes(prompt)}'",
+            lambda: f"Parsing {prompt_description}: '{escape_single_quotes(prompt)}'",
         )
         parsed_prompt = parser.parse(prompt)
-        # we store the contents so we can use them later even if the meta position is not valid anymore
+        # we keep a reference to the source so the contents can be obtained later (see get_node_content)
         if isinstance(parsed_prompt, lark.Tree):
-            for n in parsed_prompt.iter_subtrees():
-                if isinstance(n, lark.Tree):
-                    if n.meta.empty:
-                        n.meta.content = ""
-                    else:
-                        n.meta.content = prompt[n.meta.start_pos : n.meta.end_pos]
+            for n in parsed_prompt.iter_subtrees_topdown():
+                n.meta.source = prompt
+        if use_cache:
+            _parse_cache.put(cache_key, parsed_prompt)
     except lark.exceptions.UnexpectedInput:
         if raise_parsing_error:
             raise
@@ -65,14 +91,14 @@ def parse_prompt(
         state.logger,
         state.options.debug_level,
         logging.DEBUG,
-        f"Parse {prompt_description} time: {(t2 - t1) / 1_000_000_000:.3f} seconds",
+        lambda: f"Parse {prompt_description} time: {(t2 - t1) / 1_000_000_000:.3f} seconds",
     )
     if parsed_prompt:
         log(
             state.logger,
             state.options.debug_level,
             logging.DEBUG,
-            "Tree:\n"
+            lambda: "Tree:\n"
             + textwrap.indent(
                 re.sub(r"\n$", "", (parsed_prompt.pretty() if isinstance(parsed_prompt, lark.Tree) else parsed_prompt)),
                 "    ",
@@ -82,6 +108,24 @@ def parse_prompt(
     return parsed_prompt
 
 
+def get_node_content(node: lark.Tree | lark.Token, default: Optional[str] = None) -> Optional[str]:
+    """
+    Gets the original content of a parsed node from the source prompt.
+
+    Args:
+        node (Tree|Token): The node.
+        default (Optional[str]): The value to return if the node has no position in a source prompt.
+
+    Returns:
+        Optional[str]: The original content of the node.
+    """
+    meta = node.meta if isinstance(node, lark.Tree) else None
+    if meta is None or meta.empty:
+        return default
+    source = getattr(meta, "source", None)
+    return source[meta.start_pos : meta.end_pos] if source is not None else default
+
+
 def warn_or_stop(state: PPPState, is_negative: bool, message: str, e: Exception = None):
     INVALID_CONTENT_STOP = "INVALID CONTENT! {0}\nBREAK "
     if state.options.on_warning == ONWARNING_CHOICES.stop:
@@ -93,9 +137,9 @@ def warn_or_stop(state: PPPState, is_negative: bool, message: str, e: Exception
     log(state.logger, state.options.debug_level, logging.WARNING, format_output(message))
 
 
-def load_grammar() -> str:
+def load_grammar(filename: str = "grammar.lark") -> str:
     # Process with lark (debug with https://www.lark-parser.org/ide/)
-    grammar_filename = Path(__file__).resolve().parent / "grammar.lark"
+    grammar_filename = Path(__file__).resolve().parent / filename
     with open(grammar_filename, "r", encoding="utf-8") as file:
         grammar_content = file.read()
     return grammar_content
@@ -203,6 +247,417 @@ def preprocess_grammar(grammar_content: str, options: dict[str, bool], logger: l
     return "\n".join(result_lines)
 
 
+def _grammar_flags(wildcards: bool, choices: bool, commvars: bool, new_content: bool = True) -> dict[str, bool]:
+    return {
+        "ALLOW_NEW_CONTENT": new_content,
+        "ALLOW_WILDCARDS": wildcards,
+        "ALLOW_CHOICES": choices,
+        "ALLOW_COMMVARS": commvars,
+    }
+
+
+# Parser definitions: name -> (grammar preprocessing flags, start rule)
+PARSERS_DEFINITIONS: dict[str, tuple[dict[str, bool], str]] = {
+    "full": (_grammar_flags(True, True, True), "start"),
+    "wc_ch": (_grammar_flags(True, True, False), "start"),
+    "wc_cv": (_grammar_flags(True, False, True), "start"),
+    "ch_cv": (_grammar_flags(False, True, True), "start"),
+    "wc": (_grammar_flags(True, False, False), "start"),
+    "ch": (_grammar_flags(False, True, False), "start"),
+    "cv": (_grammar_flags(False, False, True), "start"),
+    "only_old": (_grammar_flags(False, False, False, False), "start"),
+    # Partial parsers
+    "content": (_grammar_flags(True, True, True), "content"),
+    "choice": (_grammar_flags(True, True, True), "choice"),
+    "wcdefoptions": (_grammar_flags(True, True, True), "wcdefoptions"),
+    "condition": (_grammar_flags(True, True, True), "condition"),
+    "choicevalue": (_grammar_flags(True, True, True), "choicevalue"),
+    "wc_filter_or": (_grammar_flags(True, True, True), "wc_filter_or"),
+}
+
+# Process-wide registry of compiled parsers, shared by all PromptPostProcessor instances
+_parsers_registry: dict[tuple[str, tuple[tuple[str, bool], ...], str, str], lark.Lark] = {}
+_parsers_registry_lock = threading.Lock()
+
+# Persistent cache of compiled parsers, so restarts do not need to compile them again
+PARSERS_CACHE_FOLDER = CACHE_FOLDER / "parsers"
+
+
+class _ParserPickler(pickle.Pickler):
+    """Pickler that stores modules (the lexer keeps a reference to the regex module) by name."""
+
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[types.ModuleType] = lambda m: (importlib.import_module, (m.__name__,))
+
+
+def _get_parser_cache_info(grammar_hash: str, options: dict[str, bool], start: str, parser_type: str) -> dict:
+    return {
+        "grammar": grammar_hash,
+        "options": ",".join(f"{k}={v}" for k, v in sorted(options.items())),
+        "start": start,
+        "parser": parser_type,
+        "lark": lark.__version__,
+        "python": f"{sys.version_info[0]}.{sys.version_info[1]}",
+    }
+
+
+def _get_parser_cache_file(cache_folder: Path, info: dict) -> Path:
+    key = "|".join(info.values())
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return cache_folder / f"{info['parser']}_{info['start']}_{digest}.pickle"
+
+
+def _load_cached_parser(cache_file: Path, info: dict, logger: logging.Logger, debug_level: int) -> Optional[lark.Lark]:
+    if not cache_file.is_file():
+        return None
+    try:
+        with open(cache_file, "rb") as f:
+            data = pickle.load(f)
+        if data.get("info") != info:
+            log(
+                logger,
+                debug_level,
+                logging.DEBUG,
+                lambda: f"Cached parser in '{escape_single_quotes(str(cache_file))}' is not valid anymore",
+            )
+            return None
+        if "lalr" in data:
+            return lark.Lark.load(io.BytesIO(data["lalr"]))
+        parser = data["parser"]
+        if isinstance(parser, lark.Lark):
+            return parser
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        log(
+            logger,
+            debug_level,
+            logging.WARNING,
+            f"Failed to load cached parser from '{escape_single_quotes(str(cache_file))}': {e}",
+        )
+    return None
+
+
+def _save_cached_parser(
+    cache_file: Path, info: dict, grammar: str, parser: lark.Lark, logger: logging.Logger, debug_level: int
+) -> None:
+    try:
+        data = io.BytesIO()
+        if parser.options.parser == "lalr":
+            # the LALR parsers have their own serialization
+            lalr_data = io.BytesIO()
+            parser.save(lalr_data)
+            pickle.dump(
+                {"info": info, "grammar": grammar, "lalr": lalr_data.getvalue()}, data, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        else:
+            _ParserPickler(data, protocol=pickle.HIGHEST_PROTOCOL).dump(
+                {"info": info, "grammar": grammar, "parser": parser}
+            )
+        write_file_atomically(cache_file, data.getvalue())
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        log(
+            logger,
+            debug_level,
+            logging.WARNING,
+            f"Failed to save parser to cache '{escape_single_quotes(str(cache_file))}': {e}",
+        )
+
+
+def get_parser(
+    grammar_content: str,
+    options: dict[str, bool],
+    start: str,
+    logger: logging.Logger,
+    debug_level: int,
+    cache_folder: Optional[Path] = PARSERS_CACHE_FOLDER,
+    parser_type: str = "earley",
+) -> lark.Lark:
+    """
+    Returns a compiled parser for the grammar, compiling it only the first time it is requested in the process.
+
+    The compiled parser (and the preprocessed grammar) is also stored in the cache folder, keyed by the grammar
+    content hash and the Lark version, so it can be loaded instead of compiled on the next start.
+
+    Args:
+        grammar_content (str): The raw grammar content.
+        options (dict[str,bool]): Options for preprocessing.
+        start (str): The start rule of the parser.
+        logger (logging.Logger): The logger object.
+        debug_level (int): The debug level for logging.
+        cache_folder (Optional[Path]): The folder of the persistent cache. None to disable it.
+        parser_type (str): The Lark parser algorithm, "earley" or "lalr" (with the contextual lexer).
+
+    Returns:
+        lark.Lark: The compiled parser.
+    """
+    grammar_hash = hashlib.sha256(grammar_content.encode("utf-8")).hexdigest()
+    key = (grammar_hash, tuple(sorted(options.items())), start, parser_type)
+    with _parsers_registry_lock:
+        parser = _parsers_registry.get(key)
+        if parser is None:
+            t1 = time.monotonic_ns()
+            info = _get_parser_cache_info(grammar_hash, options, start, parser_type)
+            cache_file = _get_parser_cache_file(cache_folder, info) if cache_folder is not None else None
+            if cache_file is not None:
+                parser = _load_cached_parser(cache_file, info, logger, debug_level)
+            action = "Loaded cached"
+            if parser is None:
+                action = "Compiled"
+                grammar = preprocess_grammar(grammar_content, options, logger, debug_level)
+                if parser_type == "lalr":
+                    parser = lark.Lark(grammar, parser="lalr", lexer="contextual", propagate_positions=True, start=start)
+                else:
+                    parser = lark.Lark(grammar, propagate_positions=True, start=start)
+                if cache_file is not None:
+                    _save_cached_parser(cache_file, info, grammar, parser, logger, debug_level)
+            _parsers_registry[key] = parser
+            t2 = time.monotonic_ns()
+            log(
+                logger,
+                debug_level,
+                logging.DEBUG,
+                lambda: f"{action} {parser_type} parser for start rule '{start}' with {dict(options)} in {(t2 - t1) / 1_000_000_000:.3f} seconds",
+            )
+    return parser
+
+
+class PPPParserWithFallback:
+    """
+    Parser that tries a LALR parser first and uses an Earley parser for the prompts that it rejects.
+
+    The LALR grammar (grammar_lalr.lark) only covers the prompts without the new constructs, and its trees are
+    converted to the trees that the Earley grammar produces for the same prompt (same rules, token types and positions).
+    """
+
+    class _Rejected(Exception):
+        pass
+
+    def __init__(self, lalr_parser: lark.Lark, earley_parser: lark.Lark):
+        """
+        Initializes the parser.
+
+        Args:
+            lalr_parser (lark.Lark): The LALR parser for grammar_lalr.lark.
+            earley_parser (lark.Lark): The Earley parser for the prompts without the new constructs.
+        """
+        self.lalr_parser = lalr_parser
+        self.earley_parser = earley_parser
+        # the Earley terminals are anonymous, so we get them from the rules that define them
+        rule_terminals = {}
+        for rule in earley_parser.rules:
+            kept = [t.name for t in rule.expansion if isinstance(t, lark.grammar.Terminal) and not t.filter_out]
+            if kept:
+                rule_terminals.setdefault(rule.origin.name, kept[0])
+        self.__plain = rule_terminals["plain"]
+        self.__terminal_types = {
+            # (LALR terminal, inside an alternation option) -> Earley terminal
+            ("PLAIN", False): rule_terminals["plain"],
+            ("PLAIN", True): rule_terminals["plain_alternate"],
+            ("SPECIAL", False): rule_terminals["specialchars"],
+            ("SPECIAL", True): rule_terminals["specialchars_alternate"],
+            ("SPECIAL_COLON", False): rule_terminals["specialchars"],
+            ("SPECIAL_EN", False): rule_terminals["specialchars"],
+            ("EN_NAME", False): rule_terminals["extranetworktag"],
+            ("NEGATIVE_SEP", False): rule_terminals["negative_sep"],
+            ("SIGNED_NUMBER", False): "SIGNED_NUMBER",
+        }
+
+    def parse(self, text: str) -> lark.Tree:
+        """
+        Parses the text.
+
+        Args:
+            text (str): The text to parse.
+
+        Returns:
+            Tree: The parsed text, as the Earley parser would return it.
+        """
+        try:
+            return self.__convert(self.lalr_parser.parse(text), False, text)
+        except (lark.exceptions.LarkError, PPPParserWithFallback._Rejected):
+            return self.earley_parser.parse(text)
+
+    @staticmethod
+    def __fix_end(node, text: str):
+        # the Earley parser ends a node at the line and column of its last character even when it is a newline
+        if node.end_pos > 0 and text[node.end_pos - 1] == "\n":
+            last = node.end_pos - 1
+            node.end_line = text.count("\n", 0, last) + 1
+            node.end_column = last - text.rfind("\n", 0, last) + 1
+        return node
+
+    def __token(self, token_type: str, value: str, first: lark.Token, last: lark.Token, text: str) -> lark.Token:
+        token = lark.Token(token_type, value)
+        token.line, token.column, token.start_pos = first.line, first.column, first.start_pos
+        token.end_line, token.end_column, token.end_pos = last.end_line, last.end_column, last.end_pos
+        return self.__fix_end(token, text)
+
+    def __tree(self, name: str, children: list, meta: lark.tree.Meta, text: str) -> lark.Tree:
+        if not meta.empty:
+            self.__fix_end(meta, text)
+        return lark.Tree(lark.Token("RULE", name), children, meta)
+
+    def __convert_content(self, node, name: str, in_alternation: bool, text: str):
+        children = node.children if isinstance(node, lark.Tree) and node.data.startswith("content_") else [node]
+        converted = []
+        for c in children:
+            if isinstance(c, lark.Token) and c.type in ("PLAIN", "PIPE") and not in_alternation:
+                # the Earley plain text includes the "|" characters outside of alternation
+                if converted and isinstance(converted[-1], lark.Token) and converted[-1].type == self.__plain:
+                    previous = converted.pop()
+                    converted.append(self.__token(self.__plain, previous.value + c.value, previous, c, text))
+                else:
+                    converted.append(self.__token(self.__plain, c.value, c, c, text))
+            else:
+                converted.append(self.__convert(c, in_alternation, text))
+        if len(converted) == 1:  # inlined rule
+            return converted[0]
+        return self.__tree(name, converted, node.meta, text)
+
+    def __convert(self, node, in_alternation: bool, text: str):
+        if node is None:
+            return None
+        if isinstance(node, lark.Token):
+            earley_type = self.__terminal_types.get((node.type, in_alternation)) or self.__terminal_types.get(
+                (node.type, False)
+            )
+            if earley_type is None:
+                raise PPPParserWithFallback._Rejected(node.type)
+            return self.__token(earley_type, node.value, node, node, text)
+        match node.data:
+            case "start":
+                children = [
+                    self.__convert_content(node.children[0], "content", False, text),
+                    self.__convert(node.children[1], False, text),
+                    self.__convert_content(node.children[2], "content", False, text),
+                ]
+            case "negative_sep":
+                children = [self.__convert(node.children[0], False, text)]
+            case "attention":
+                children = [
+                    self.__convert_content(node.children[0], "content", False, text),
+                    self.__convert(node.children[1], False, text),
+                ]
+            case "bracket" if len(node.children) == 1:
+                children = [self.__convert_content(node.children[0], "content", False, text)]
+                return self.__tree("attention", children, node.meta, text)
+            case "bracket":
+                options = []
+                for c in node.children:
+                    meta = lark.tree.Meta()
+                    if isinstance(c, lark.Token):
+                        meta.empty = False
+                        meta.line, meta.column, meta.start_pos = c.line, c.column, c.start_pos
+                        meta.end_line, meta.end_column, meta.end_pos = c.end_line, c.end_column, c.end_pos
+                    elif not c.meta.empty:
+                        meta.__dict__.update(c.meta.__dict__)
+                    option = self.__convert_content(c, "content_alternate", True, text)
+                    options.append(self.__tree("alternateoption", [option], meta, text))
+                return self.__tree("alternate", options, node.meta, text)
+            case "scheduled":
+                children = [
+                    self.__convert_content(node.children[0], "content", False, text),
+                    self.__convert_content(node.children[1], "content", False, text),
+                    self.__convert(node.children[2], False, text),
+                ]
+            case "extranetworktag":
+                children = [
+                    self.__convert(node.children[0], False, text),
+                    self.__convert_content(node.children[1], "content_en", False, text),
+                ]
+            case _:
+                raise PPPParserWithFallback._Rejected(node.data)
+        return self.__tree(node.data, children, node.meta, text)
+
+
+_fallback_parsers: dict[tuple[lark.Lark, lark.Lark], PPPParserWithFallback] = {}
+
+
+def get_parser_with_fallback(
+    earley_parser: lark.Lark,
+    logger: logging.Logger,
+    debug_level: int,
+    cache_folder: Optional[Path] = PARSERS_CACHE_FOLDER,
+) -> PPPParserWithFallback:
+    """
+    Gets the shared parser that uses the LALR grammar and falls back to the specified Earley parser.
+
+    Args:
+        earley_parser (lark.Lark): The Earley parser for the prompts without the new constructs.
+        logger (logging.Logger): The logger object.
+        debug_level (int): The debug level for logging.
+        cache_folder (Optional[Path]): The folder of the persistent cache. None to disable it.
+
+    Returns:
+        PPPParserWithFallback: The parser.
+    """
+    lalr_parser = get_parser(
+        load_grammar("grammar_lalr.lark"), {}, "start", logger, debug_level, cache_folder, parser_type="lalr"
+    )
+    with _parsers_registry_lock:
+        parser = _fallback_parsers.get((lalr_parser, earley_parser))
+        if parser is None:
+            parser = PPPParserWithFallback(lalr_parser, earley_parser)
+            _fallback_parsers[(lalr_parser, earley_parser)] = parser
+    return parser
+
+
+class PPPParsers(Mapping):
+    """
+    Read-only mapping of the parsers in PARSERS_DEFINITIONS.
+
+    Each parser is obtained (from the registry, the persistent cache or by compiling it) the first time it is requested.
+    """
+
+    def __init__(
+        self,
+        grammar_content: str,
+        logger: logging.Logger,
+        debug_level: int,
+        use_fallback: bool = True,
+    ):
+        """
+        Initializes the mapping.
+
+        Args:
+            grammar_content (str): The raw grammar content.
+            logger (logging.Logger): The logger object.
+            debug_level (int): The debug level for logging.
+            use_fallback (bool): Whether the "only_old" parser tries the LALR grammar first (default grammar only).
+        """
+        self.grammar_content = grammar_content
+        self.grammar_hash = hashlib.sha256(grammar_content.encode("utf-8")).hexdigest()
+        self.logger = logger
+        self.debug_level = debug_level
+        self.use_fallback = use_fallback
+        self.__parsers: dict[str, lark.Lark | PPPParserWithFallback] = {}
+
+    def __getitem__(self, name: str) -> lark.Lark | PPPParserWithFallback:
+        parser = self.__parsers.get(name)
+        if parser is None:
+            flags, start = PARSERS_DEFINITIONS[name]
+            parser = get_parser(self.grammar_content, flags, start, self.logger, self.debug_level)
+            if name == "only_old" and self.use_fallback:
+                # the prompts without new constructs are parsed faster with the LALR grammar when possible
+                parser = get_parser_with_fallback(parser, self.logger, self.debug_level)
+            self.__parsers[name] = parser
+        return parser
+
+    def __iter__(self):
+        return iter(PARSERS_DEFINITIONS)
+
+    def __len__(self) -> int:
+        return len(PARSERS_DEFINITIONS)
+
+    def get_loaded(self) -> list[str]:
+        """
+        Gets the names of the parsers that have already been requested.
+
+        Returns:
+            list[str]: The names of the parsers.
+        """
+        return list(self.__parsers.keys())
+
+
 def get_model_class_from_filename(filename: str) -> str:
     try:
         import folder_paths  # type: ignore
@@ -1,11 +1,12 @@
 from pathlib import Path
+import threading
 from typing import Optional
 import logging
-from ruamel.yaml import YAML as _YAML
 from ruamel.yaml.error import YAMLError as _YAMLError
 
 from ppp_logging import DEBUG_LEVEL, log
-from ppp_utils import deep_freeze, escape_single_quotes
+from ppp_utils import PPPFolderScanner, decode_text, deep_freeze, escape_single_quotes, load_structured_text
+from ppp_watcher import PPPFolderWatcher
 
 
 class PPPENMappingVariant:
@@ -27,6 +28,9 @@ class PPPENMappingVariant:
         self.triggers: list[str] = triggers
         self.weight: float = weight
 
+    def __hash__(self) -> int:
+        return hash(deep_freeze([self.condition, self.name, self.parameters, self.triggers, self.weight]))
+
 
 class PPPENMapping:
     """
@@ -73,17 +77,25 @@ class PPPExtraNetworkMappings:
 
     DEFAULT_ENMAPPINGS_FOLDER = "extranetworkmappings"
 
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, watch_folders: bool = False):
         self.__logger: logging.Logger = logger
         self.__debug_level = DEBUG_LEVEL.none
         self.__enmappings_folders: list[Path] = []
         self.__enmappings_files: dict[Path, float] = {}
+        self.__folder_scanner = PPPFolderScanner()
+        self.__watch_folders = watch_folders
+        self.__folder_watcher: Optional[PPPFolderWatcher] = None
+        self.__prefetched_files: dict[Path, tuple[float, object]] = {}
+        self.__prefetched_files_lock = threading.Lock()
         self.__local_enmappings_input_hash: int | None = None
+        self.__keys_by_file: dict[Path | None, set[str]] = {}
+        # sum (modulo 2**64) of the hashes of the loaded mappings, updated as they are added or removed
+        self.__content_digest = 0
         self.extranetwork_mappings: dict[str, PPPENMapping] = {}
         self.cached_mappings = {}
 
     def __hash__(self) -> int:
-        return hash(deep_freeze(self.extranetwork_mappings))
+        return self.__content_digest
 
     def __sizeof__(self):
         return (
@@ -121,26 +133,93 @@ class PPPExtraNetworkMappings:
         # log(self.__logger, self.__debug_level, logging.INFO, "Refreshing extra network mappings...")
         # t1 = time.monotonic_ns()
         self.cached_mappings = {}
-        for fullpath in list(self.__enmappings_files.keys()):
-            if not fullpath.exists() or not any(
-                fullpath.parent.is_relative_to(folder) for folder in self.__enmappings_folders
-            ):
-                self.__remove_extranetwork_mappings_from_path(fullpath)
+        scanned_paths = None
+        changed_files = self.__check_folder_watcher()
+        if changed_files is None or changed_files:
+            if changed_files is None:
+                scanned_paths = self.__folder_scanner.scan(self.__enmappings_folders)
+                checked_files = list(self.__enmappings_files.keys())
+            else:
+                # only the files changed since the previous refresh are checked
+                scanned_paths = self.__folder_scanner.scan_changes(self.__enmappings_folders, changed_files)
+                checked_files = changed_files
+            found_files = set()
+            for _, files in scanned_paths:
+                found_files.update(files or ())
+            for fullpath in checked_files:
+                if fullpath not in found_files and fullpath in self.__enmappings_files:
+                    self.__remove_extranetwork_mappings_from_path(fullpath)
         if enmappings_input is None and self.__local_enmappings_input_hash is not None:
             self.__remove_extranetwork_mappings_from_input()
         if enmappings_folders is not None or enmappings_input is not None:
-            if enmappings_folders is not None:
-                for f in self.__enmappings_folders:
-                    self.__get_extranetwork_mappings_in_path(f)
+            if scanned_paths is not None:
+                for path, files in scanned_paths:
+                    self.__get_extranetwork_mappings_in_path(path, files)
+                with self.__prefetched_files_lock:
+                    self.__prefetched_files.clear()
             if enmappings_input is not None:
                 self.__get_extranetwork_mappings_in_input(enmappings_input)
         else:
             self.extranetwork_mappings = {}
+            self.__content_digest = 0
+            self.__keys_by_file = {}
             self.__enmappings_files = {}
             self.__local_enmappings_input_hash = None
         # t2 = time.monotonic_ns()
         # log(self.__logger, self.__debug_level, logging.INFO, f"Extra network mappings refresh time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
 
+    def __check_folder_watcher(self) -> Optional[set[Path]]:
+        """
+        Start, restart or stop the folder watcher as needed, and check what must be scanned.
+
+        Returns:
+            Optional[set[Path]]: The files changed since the previous refresh, or None if the folders must be scanned.
+        """
+        if not self.__watch_folders or not self.__enmappings_folders:
+            if self.__folder_watcher is not None:
+                self.__folder_watcher.stop()
+                self.__folder_watcher = None
+            return None
+        if self.__folder_watcher is not None and self.__folder_watcher.is_watching(self.__enmappings_folders):
+            return self.__folder_watcher.take_changes()
+        if self.__folder_watcher is not None:
+            self.__folder_watcher.stop()
+        self.__folder_watcher = PPPFolderWatcher(self.__enmappings_folders, self.__prefetch_files)
+        log(
+            self.__logger,
+            self.__debug_level,
+            logging.DEBUG,
+            lambda: f"Watching extra network mappings folders with {self.__folder_watcher.backend}",
+        )
+        return None
+
+    def __prefetch_files(self, changed_files: Optional[set[Path]]):
+        """
+        Read the changed extra network mappings files in the background, so the next refresh does not have to.
+
+        Args:
+            changed_files (Optional[set[Path]]): The changed files, or None if they are not known.
+        """
+        for full_path in changed_files or ():
+            if full_path.suffix not in (".yaml", ".yml", ".json"):
+                continue
+            try:
+                last_modified = full_path.stat().st_mtime
+                content = self.__read_structured_file(full_path)
+            except Exception:  # pylint: disable=broad-except
+                continue  # the error will be reported by the refresh
+            with self.__prefetched_files_lock:
+                self.__prefetched_files[full_path] = (last_modified, content)
+
+    def stop_watching(self):
+        """
+        Stop watching the extra network mappings folders.
+        """
+        self.__watch_folders = False
+        if self.__folder_watcher is not None:
+            self.__folder_watcher.stop()
+            self.__folder_watcher = None
+
     def __remove_extranetwork_mappings_from_path(self, full_path: Path, debug=True):
         """
         Clear all extra network mappings from a file.
@@ -154,13 +233,12 @@ class PPPExtraNetworkMappings:
                 self.__logger,
                 self.__debug_level,
                 logging.DEBUG,
-                f"Removing extra network mappings from file: {full_path}",
+                lambda: f"Removing extra network mappings from file: {full_path}",
             )
         if full_path in self.__enmappings_files:
             del self.__enmappings_files[full_path]
-        for key in list(self.extranetwork_mappings.keys()):
-            if self.extranetwork_mappings[key].file == full_path:
-                del self.extranetwork_mappings[key]
+        for key in self.__keys_by_file.pop(full_path, ()):
+            self.__discard_extranetwork_mapping(key)
 
     def __remove_extranetwork_mappings_from_input(self, debug=True):
         """
@@ -172,18 +250,17 @@ class PPPExtraNetworkMappings:
         if debug and self.__local_enmappings_input_hash is not None:
             log(self.__logger, self.__debug_level, logging.DEBUG, "Removing extra network mappings from input")
         self.__local_enmappings_input_hash = None
-        for key in list(self.extranetwork_mappings.keys()):
-            if self.extranetwork_mappings[key].file is None:
-                del self.extranetwork_mappings[key]
+        for key in self.__keys_by_file.pop(None, ()):
+            self.__discard_extranetwork_mapping(key)
 
-    def __get_extranetwork_mappings_in_file(self, full_path: Path):
+    def __get_extranetwork_mappings_in_file(self, full_path: Path, last_modified: float):
         """
         Get all extra network mappings in a file.
 
         Args:
             full_path (Path): The path to the file.
+            last_modified (float): The modification time of the file.
         """
-        last_modified = full_path.stat().st_mtime
         last_modified_cached = self.__enmappings_files.get(full_path, None)
         if last_modified_cached is not None and last_modified == self.__enmappings_files[full_path]:
             return
@@ -196,9 +273,13 @@ class PPPExtraNetworkMappings:
                 self.__logger,
                 self.__debug_level,
                 logging.DEBUG,
-                f"Updating extra network mappings from file: {full_path}",
+                lambda: f"Updating extra network mappings from file: {full_path}",
             )
-        self.__get_extranetwork_mappings_in_structured_file(full_path)
+        with self.__prefetched_files_lock:
+            prefetched = self.__prefetched_files.pop(full_path, None)
+        self.__get_extranetwork_mappings_in_structured_file(
+            full_path, prefetched[1] if prefetched is not None and prefetched[0] == last_modified else None
+        )
         self.__enmappings_files[full_path] = last_modified
 
     def __get_extranetwork_mappings_in_input(self, enmappings_input: str):
@@ -218,7 +299,7 @@ class PPPExtraNetworkMappings:
         enmappings_input = enmappings_input.strip()
         if enmappings_input != "":
             try:
-                content = _YAML(typ='safe').load(enmappings_input)
+                content = load_structured_text(enmappings_input)
             except _YAMLError as e:
                 log(
                     self.__logger,
@@ -286,28 +367,72 @@ class PPPExtraNetworkMappings:
                             f"Invalid extra network mapping definition for '{escape_single_quotes(key)}' in file '{escape_single_quotes(file_str)}'!",
                         )
                     else:
-                        self.extranetwork_mappings[key] = PPPENMapping(full_path, kind, name, variants)
+                        self.__store_extranetwork_mapping(key, PPPENMapping(full_path, kind, name, variants))
+
+    def __store_extranetwork_mapping(self, key: str, mapping: PPPENMapping):
+        """
+        Store a new extra network mapping.
 
-    def __get_extranetwork_mappings_in_structured_file(self, full_path: Path):
+        Args:
+            key (str): The key of the extra network mapping in the format "kind:name".
+            mapping (PPPENMapping): The extra network mapping.
+        """
+        self.extranetwork_mappings[key] = mapping
+        self.__keys_by_file.setdefault(mapping.file, set()).add(key)
+        self.__update_content_digest(hash(mapping), True)
+
+    def __update_content_digest(self, value: int, added: bool):
+        """
+        Add or subtract the hash of a mapping to the digest of the content.
+
+        Args:
+            value (int): The hash of the mapping.
+            added (bool): Whether the mapping was added or removed.
+        """
+        self.__content_digest = (self.__content_digest + (value if added else -value)) % (1 << 64)
+
+    def __discard_extranetwork_mapping(self, key: str):
+        """
+        Remove an extra network mapping if it exists.
+
+        Args:
+            key (str): The key of the extra network mapping.
+        """
+        mapping = self.extranetwork_mappings.pop(key, None)
+        if mapping is not None:
+            self.__update_content_digest(hash(mapping), False)
+
+    def __read_structured_file(self, full_path: Path) -> object:
+        """
+        Read the content of a structured file.
+
+        Args:
+            full_path (Path): The path to the file.
+
+        Returns:
+            object: The content of the file.
+        """
+        text, not_utf8 = decode_text(full_path.read_bytes())
+        if not_utf8:
+            log(
+                self.__logger,
+                self.__debug_level,
+                logging.WARNING,
+                f"Could not read file '{escape_single_quotes(str(full_path))}' with utf-8 encoding, trying windows-1252...",
+            )
+        return load_structured_text(text, full_path.suffix == ".json")
+
+    def __get_extranetwork_mappings_in_structured_file(self, full_path: Path, content: object = None):
         """
         Get all extra network mappings in a structured file.
 
         Args:
             full_path (Path): The path to the file.
+            content (object): The content of the file, if it has already been read.
         """
         try:
-            try:
-                with open(full_path, "r", encoding="utf-8") as file:
-                    content = _YAML(typ='safe').load(file)
-            except:  # pylint: disable=bare-except
-                log(
-                    self.__logger,
-                    self.__debug_level,
-                    logging.WARNING,
-                    f"Could not read file '{escape_single_quotes(str(full_path))}' with utf-8 encoding, trying windows-1252...",
-                )
-                with open(full_path, "r", encoding="windows-1252") as file:
-                    content = _YAML(typ='safe').load(file)
+            if content is None:
+                content = self.__read_structured_file(full_path)
             self.__add_extranetwork_mapping(content, full_path)
         except Exception as e:  # pylint: disable=broad-except
             log(
@@ -317,14 +442,16 @@ class PPPExtraNetworkMappings:
                 f"Error reading extra network mappings from file '{escape_single_quotes(str(full_path))}': {e}",
             )
 
-    def __get_extranetwork_mappings_in_path(self, path: Path):
+    def __get_extranetwork_mappings_in_path(self, path: Path, files: dict[Path, float] | None):
         """
         Get all extra network mappings in a path.
 
         Args:
             path (Path): The path (folder or file).
+            files (dict[Path, float] | None): The files found in the path with their modification time, or None if
+                the path does not exist.
         """
-        if not path.exists():
+        if files is None:
             log(
                 self.__logger,
                 self.__debug_level,
@@ -332,10 +459,5 @@ class PPPExtraNetworkMappings:
                 f"Extra network mappings path '{escape_single_quotes(str(path))}' does not exist!",
             )
             return
-        if path.is_file():
-            self.__get_extranetwork_mappings_in_file(path)
-            return
-        for child in path.iterdir():
-            if child.name.startswith("."):
-                continue
-            self.__get_extranetwork_mappings_in_path(child)
+        for full_path, last_modified in files.items():
+            self.__get_extranetwork_mappings_in_file(full_path, last_modified)
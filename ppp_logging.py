@@ -2,6 +2,7 @@ from enum import Enum
 import logging
 import sys
 import copy
+from typing import Callable
 
 from ppp_utils import format_output
 
@@ -98,24 +99,52 @@ class PromptPostProcessorLogCustomAdapter(logging.LoggerAdapter):
         return f"[PPP] {msg}", kwargs
 
 
+# Integer values of the debug levels and the default minimum level of each kind of message, so checking is cheap
+_DEBUG_LEVEL_VALUES = {level: i for i, level in enumerate(DEBUG_LEVEL)}
+_DEFAULT_MIN_LEVELS = {
+    logging.DEBUG: _DEBUG_LEVEL_VALUES[DEBUG_LEVEL.full],
+    logging.INFO: _DEBUG_LEVEL_VALUES[DEBUG_LEVEL.minimal],
+}
+
+
+def is_logged(debug_level: DEBUG_LEVEL, kind: int, min_level: DEBUG_LEVEL | None = None) -> bool:
+    """
+    Checks if a message would be logged with the debug level.
+
+    Args:
+        debug_level (DEBUG_LEVEL): The current debug level.
+        kind (int): The logging level of the message.
+        min_level (DEBUG_LEVEL|None): The minimum debug level for the message (default depends on the kind).
+
+    Returns:
+        bool: True if the message would be logged.
+    """
+    i_min_level = _DEFAULT_MIN_LEVELS.get(kind, 0) if min_level is None else _DEBUG_LEVEL_VALUES[min_level]
+    return _DEBUG_LEVEL_VALUES[debug_level] >= i_min_level
+
+
 def log(
     logger: logging.Logger,
     debug_level: DEBUG_LEVEL,
     kind: int,
-    message: str,
+    message: str | Callable[[], str],
     min_level: DEBUG_LEVEL | None = None,
     formatted: bool = True,
     exc_info=None,
 ):
-    if logger:
-        if min_level is None:
-            if kind == logging.DEBUG:
-                min_level = DEBUG_LEVEL.full
-            elif kind == logging.INFO:
-                min_level = DEBUG_LEVEL.minimal
-            else:
-                min_level = DEBUG_LEVEL.none
-        i_debug_level = list(DEBUG_LEVEL).index(debug_level)
-        i_min_level = list(DEBUG_LEVEL).index(min_level)
-        if i_debug_level >= i_min_level:
-            logger.log(kind, format_output(message) if formatted else message, exc_info=exc_info)
+    """
+    Logs a message if the debug level allows it.
+
+    Args:
+        logger (logging.Logger): The logger object.
+        debug_level (DEBUG_LEVEL): The current debug level.
+        kind (int): The logging level of the message.
+        message (str|Callable[[], str]): The message, or a function that builds it (only called if it is logged).
+        min_level (DEBUG_LEVEL|None): The minimum debug level for the message (default depends on the kind).
+        formatted (bool): Whether to format the message for the output.
+        exc_info: The exception information to log.
+    """
+    if logger and is_logged(debug_level, kind, min_level):
+        if callable(message):
+            message = message()
+        logger.log(kind, format_output(message) if formatted else message, exc_info=exc_info)
@@ -1,7 +1,6 @@
 from collections import namedtuple
 from enum import Enum
 from functools import reduce
-from itertools import combinations, combinations_with_replacement, permutations, product
 import logging
 import math
 import re
@@ -14,10 +13,10 @@ import numpy as np
 from ppp_classes import IFWILDCARDS_CHOICES, SUPPORTED_APPS, PPPState
 from ppp_enmappings import PPPENMappingVariant
 from ppp_logging import DEBUG_LEVEL, log
-from ppp_utils import escape_single_quotes, repr_value
-from ppp_common import parse_prompt, warn_or_stop
+from ppp_utils import count_selections, escape_single_quotes, repr_value, unrank_selection
+from ppp_common import get_node_content, parse_prompt, warn_or_stop
 from ppp_variables import ScalarValue, VariableEntry
-from ppp_wildcards import PPPWildcard
+from ppp_wildcards import PPPWildcard, PPPWildcardLines, is_plain_choice_text
 
 
 class TreeProcessor(lark.visitors.Interpreter):
@@ -42,6 +41,8 @@ class TreeProcessor(lark.visitors.Interpreter):
     ShellTypeScheduler = namedtuple("ShellTypeScheduler", ["position"])
     # ShellTypeAlternation = namedtuple("ShellTypeAlternation", ["count"])
     ShellTypeAlternationOption = namedtuple("ShellTypeAlternationOption", ["index", "count"])
+    SamplingTable = namedtuple("SamplingTable", ["choices", "p", "cdf", "conditional"])
+    LabelsIndex = namedtuple("LabelsIndex", ["positions", "texts"])
 
     class ShellType(Enum):
         Attention = "at"
@@ -77,7 +78,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         self.__cycl_forced_path: list[int] = []
         self.__cycl_trace: list[int] = []
 
-    def log(self, kind, message: str, min_level: DEBUG_LEVEL | None = None):
+    def log(self, kind, message: str | Callable[[], str], min_level: DEBUG_LEVEL | None = None):
         log(self.state.logger, self.state.options.debug_level, kind, message, min_level)
 
     def warn_or_stop(self, message: str, e: Exception = None):
@@ -140,7 +141,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         limit = self.state.options.combinatorial_limit
 
         def _run(forced_path: tuple[int, ...]) -> tuple[int, ...]:
-            self.log(logging.DEBUG, f"Running combinatorial path: {forced_path}")
+            self.log(logging.DEBUG, lambda: f"Running combinatorial path: {forced_path}")
             self.__comb_forced_path = list(forced_path)
             self.__comb_trace = []
             self.__reset_run_state()
@@ -150,8 +151,8 @@ class TreeProcessor(lark.visitors.Interpreter):
             results.append((self.__result, self.__detectedWildcards.copy(), self.state.variables.backup_user()))
             if len(results) == 1:
                 first_run_estimate = reduce(lambda x, y: x * y, self.__comb_trace, 1)
-                self.log(logging.INFO, f"Estimated combinations (lower bound): {first_run_estimate}")
-            self.log(logging.INFO, f"Added combination {len(results)}")
+                self.log(logging.INFO, lambda: f"Estimated combinations (lower bound): {first_run_estimate}")
+            self.log(logging.INFO, lambda: f"Added combination {len(results)}")
             return tuple(self.__comb_trace)
 
         limit_reached = False
@@ -194,7 +195,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             if self.state.variables.get_echoed_value(k) is None and not isinstance(
                 self.state.variables.get_user(k), ScalarValue
             ):
-                self.log(logging.DEBUG, f"Finalizing variable: {k}")
+                self.log(logging.DEBUG, lambda: f"Finalizing variable: {k}")
                 name, specifier = self.__separate_arrayref(k)
                 value = self.get_final_scalar_variable(name, specifier)
                 self.state.variables.set_user(k, value)
@@ -217,7 +218,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             str: The result of the visit.
         """
         backup_result = self.__result
-        # self.log(logging.DEBUG, f"Visiting node {node}.")
+        # self.log(logging.DEBUG, lambda: f"Visiting node {node}.")
         if restore_state:
             # self.log(logging.DEBUG, "Backing up state before visiting.")
             backup_shell = self.__shell.copy()
@@ -265,7 +266,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         Returns:
             str: The original content of the node.
         """
-        return node.meta.content if hasattr(node, "meta") and node.meta is not None and not node.meta.empty else default
+        return get_node_content(node, default)
 
     def __parse_array_specifier(self, specifier: str | None) -> tuple[Optional[int], Optional[str], Optional[bool]]:
         """
@@ -417,7 +418,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             output = self.__result[len(start_result) :]
             if output != "":
                 output = f" >> '{escape_single_quotes(output)}'"
-            self.log(logging.DEBUG, f"TreeProcessor.{construct} {info}({duration / 1_000_000_000:.3f} seconds){output}")
+            self.log(logging.DEBUG, lambda: f"TreeProcessor.{construct} {info}({duration / 1_000_000_000:.3f} seconds){output}")
 
     @staticmethod
     def __coerce_value(s: str) -> str | int | float | bool:
@@ -769,7 +770,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         Returns:
             bool: The result of the if condition evaluation.
         """
-        # self.log(logging.DEBUG, f"__eval_condition {condition.data}")
+        # self.log(logging.DEBUG, lambda: f"__eval_condition {condition.data}")
         if condition.data == "operation_and":
             cond_result = True
             for c in condition.children:
@@ -850,7 +851,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                         + and_replacements[and_processing][1]
                         + self.__visit(tree.children[i + 1], False, True).lstrip()
                     )
-                    self.log(logging.DEBUG, f"AND construct {and_replacements[and_processing][0]}")
+                    self.log(logging.DEBUG, lambda: f"AND construct {and_replacements[and_processing][0]}")
                 elif and_processing == "error":
                     self.warn_or_stop("AND constructs are not allowed!")
                 else:  # and_processing == "ok":
@@ -907,7 +908,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             # self.__shell.append(TreeProcessor.AccumulatedShell(TreeProcessor.ShellType.Scheduler, TreeProcessor.ShellTypeScheduler(position=pos)))
             self.__result += "["
             if before is not None:
-                self.log(logging.DEBUG, f"Shell scheduled before with position {pos}")
+                self.log(logging.DEBUG, lambda: f"Shell scheduled before with position {pos}")
                 self.__shell.append(
                     TreeProcessor.AccumulatedShell(
                         TreeProcessor.ShellType.SchedulerBefore,
@@ -916,7 +917,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                 )
                 self.__visit(before)
                 self.__shell.pop()
-            self.log(logging.DEBUG, f"Shell scheduled after with position {pos}")
+            self.log(logging.DEBUG, lambda: f"Shell scheduled after with position {pos}")
             self.__shell.append(
                 TreeProcessor.AccumulatedShell(
                     TreeProcessor.ShellType.SchedulerAfter,
@@ -954,7 +955,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             # self.__shell.append(TreeProcessor.AccumulatedShell(TreeProcessor.ShellType.Alternation, TreeProcessor.ShellTypeAlternation(count=len(tree.children))))
             self.__result += "["
             for i, opt in enumerate(tree.children):
-                self.log(logging.DEBUG, f"Shell alternate option {i+1}")
+                self.log(logging.DEBUG, lambda: f"Shell alternate option {i+1}")
                 self.__shell.append(
                     TreeProcessor.AccumulatedShell(
                         TreeProcessor.ShellType.AlternationOption,
@@ -1074,7 +1075,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             weight_kind = 1  # decrease attention
             weight = 0.9
             weight_str = "0.9"
-        self.log(logging.DEBUG, f"Shell attention with weight {weight}")
+        self.log(logging.DEBUG, lambda: f"Shell attention with weight {weight}")
         current_tree = tree.children[0]
         if self.state.options.cup_merge_attention:
             # we check while the children are attentions, in which case we merge the weights
@@ -1091,7 +1092,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                 weight *= inner_weight
                 self.log(
                     logging.DEBUG,
-                    f"Merging nested attention with weight {inner_weight}, cumulative weight now {weight}",
+                    lambda: f"Merging nested attention with weight {inner_weight}, cumulative weight now {weight}",
                 )
                 current_tree = current_tree.children[0]
             weight = math.floor(weight * 100) / 100  # we round to 2 decimals
@@ -1157,7 +1158,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                     weight = math.floor(weight * inner_weight * 100) / 100
                     self.log(
                         logging.DEBUG,
-                        f"Merging nested attention with weight {inner_weight}, cumulative weight now {weight}",
+                        lambda: f"Merging nested attention with weight {inner_weight}, cumulative weight now {weight}",
                     )
                     weight_str = f"{weight:.2f}".rstrip("0").rstrip(".")
                     if weight_str == "1.1":
@@ -1471,11 +1472,14 @@ class TreeProcessor(lark.visitors.Interpreter):
         """
         Process a DP set variable command in the tree and add it to the dictionary of variables.
         """
-        modifiers = tree.children[1] or lark.Tree(lark.Token("RULE", "variablesetmodifiers"), [])
+        modifiers = tree.children[1]
         immediate = tree.children[2]
-        if immediate is not None:
-            modifiers.children = modifiers.children.copy()
-            modifiers.children.append(immediate)
+        if modifiers is None or immediate is not None:
+            # the parsed trees are shared (cached), so we build a new node instead of modifying the existing one
+            modifiers = lark.Tree(
+                lark.Token("RULE", "variablesetmodifiers"),
+                (modifiers.children if modifiers is not None else []) + ([immediate] if immediate is not None else []),
+            )
         vardescriptor_name, vardescriptor_specifier = self.__separate_vardescriptor(tree.children[0])
         self.__varset("variableset", vardescriptor_name, vardescriptor_specifier, modifiers, tree.children[3])
 
@@ -1505,7 +1509,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         evaluated_value = self.get_final_scalar_variable(variable_name, variable_specifier)
         if evaluated_value is None:
             if default is not None:
-                self.log(logging.DEBUG, f"Variable '{escape_single_quotes(vname)}' not found, using default value")
+                self.log(logging.DEBUG, lambda: f"Variable '{escape_single_quotes(vname)}' not found, using default value")
                 value = default
                 evaluated_value = self.__visit(default, False, True)
                 self.__result += evaluated_value
@@ -1670,7 +1674,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                             if not found_in_cache:
                                 self.log(
                                     logging.INFO,
-                                    f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to '{escape_single_quotes(extnet_type)}:{escape_single_quotes(found.name)}'",
+                                    lambda: f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to '{escape_single_quotes(extnet_type)}:{escape_single_quotes(found.name)}'",
                                 )
                             extnet_id = f"{extnet_type}:{found.name}"
                             f_parameters = found.parameters
@@ -1689,13 +1693,13 @@ class TreeProcessor(lark.visitors.Interpreter):
                             if not found_in_cache:
                                 self.log(
                                     logging.INFO,
-                                    f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to just triggers",
+                                    lambda: f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to just triggers",
                                 )
                             extnet_id = None
                         else:
                             if not found_in_cache:
                                 self.log(
-                                    logging.INFO, f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to nothing"
+                                    logging.INFO, lambda: f"Mapping extranetwork '{escape_single_quotes(extnet_id)}' to nothing"
                                 )
                             extnet_id = None
                         if found.triggers:
@@ -1748,12 +1752,12 @@ class TreeProcessor(lark.visitors.Interpreter):
             filter_object = tree.children[1].children[1] if tree.children[1] is not None else None
             if filter_object is None:
                 for wc in selected_wildcards:
-                    self.log(logging.DEBUG, f"Removed default filter for wildcard '{escape_single_quotes(wc)}'")
+                    self.log(logging.DEBUG, lambda: f"Removed default filter for wildcard '{escape_single_quotes(wc)}'")
                     self.state.wildcards_obj.set_wildcard_default_filter(wc, None)
             else:
                 filter_specifier = self.__extract_filter_specifiers(filter_object)
                 for wc in selected_wildcards:
-                    self.log(logging.DEBUG, f"Set default filter for wildcard '{escape_single_quotes(wc)}'")
+                    self.log(logging.DEBUG, lambda: f"Set default filter for wildcard '{escape_single_quotes(wc)}'")
                     self.state.wildcards_obj.set_wildcard_default_filter(wc, filter_specifier)
         t2 = time.monotonic_ns()
         self.__debug_end("commandsetwcdeffilter", start_result, t2 - t1)
@@ -1776,36 +1780,17 @@ class TreeProcessor(lark.visitors.Interpreter):
         choice_values: list[dict],
         filter_specifier: Optional[list[list[str]]] = None,
         wildcard_key: str = None,
+        source_wildcard: Optional[PPPWildcard] = None,
     ) -> list[dict]:
         msg_where = f"wildcard '{escape_single_quotes(wildcard_key)}'" if wildcard_key else "choices"
+        if filter_specifier is None and source_wildcard is not None:
+            flattened_choice_values = self.__get_flattened_choices(source_wildcard)
+            if flattened_choice_values is not None:
+                return flattened_choice_values
         if filter_specifier is not None:
-            filtered_choice_values = []
-            for i, c in enumerate(choice_values):
-                passes = False
-                for or_ in filter_specifier:
-                    tmp_pass = True
-                    for and_ in or_:
-                        if and_.isdecimal():
-                            if int(and_) != i:
-                                tmp_pass = False
-                                break
-                        elif re.match(r"^\d+-\d+$", and_):
-                            try:
-                                start, end = map(int, and_.split("-", 1))
-                                if not start <= i <= end:
-                                    tmp_pass = False
-                                    break
-                            except ValueError:
-                                tmp_pass = False
-                                break
-                        elif and_.lower() not in c.get("labels", []):
-                            tmp_pass = False
-                            break
-                    if tmp_pass:
-                        passes = True
-                        break
-                if passes:
-                    filtered_choice_values.append(c)
+            filtered_choice_values = [
+                choice_values[i] for i in self.__get_filtered_indexes(choice_values, filter_specifier, source_wildcard)
+            ]
             if not filtered_choice_values:
                 self.warn_or_stop(
                     f"Wildcard filter specifier '{escape_single_quotes(','.join(['+'.join(y for y in x) for x in filter_specifier]))}' found no matches in choices for wildcard '{escape_single_quotes(wildcard_key)}'!"
@@ -1831,8 +1816,8 @@ class TreeProcessor(lark.visitors.Interpreter):
                             )
                             continue
                         self.__seen_wildcards.append(wc.key)
-                        self.log(logging.DEBUG, f"Seen wildcard '{escape_single_quotes(wc.key)}'")
-                        self.log(logging.DEBUG, f"Including choices from wildcard '{escape_single_quotes(wc.key)}'")
+                        self.log(logging.DEBUG, lambda: f"Seen wildcard '{escape_single_quotes(wc.key)}'")
+                        self.log(logging.DEBUG, lambda: f"Including choices from wildcard '{escape_single_quotes(wc.key)}'")
                         _, choice_values = self.__check_wildcard_initialization(wc)
                         if choice_values is not None:
                             ch_values = self.__get_choices_internal_get(choice_values, None, wc.key)
@@ -1849,12 +1834,134 @@ class TreeProcessor(lark.visitors.Interpreter):
                 expanded_choice_values.append(c)
         return expanded_choice_values
 
+    def __get_flattened_choices(self, wildcard: PPPWildcard) -> Optional[list[dict]]:
+        """
+        Get the processed choices of a wildcard with all its included choices, which are obtained only once for each
+        content of the wildcards.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard, already initialized.
+
+        Returns:
+            Optional[list[dict]]: The choices, or None if they have to be obtained each time.
+        """
+        digest = hash(self.state.wildcards_obj)
+        if wildcard.included is None or wildcard.included[0] != digest:
+            seen_wildcards = [wildcard.key]
+            choice_values = self.__flatten_choices(wildcard.choices, seen_wildcards)
+            # including other wildcards can load them, so the digest is taken again
+            wildcard.included = (hash(self.state.wildcards_obj), seen_wildcards[1:], choice_values)
+        _, included_keys, choice_values = wildcard.included
+        if choice_values is None or any(k in self.__seen_wildcards for k in included_keys):
+            return None  # the warnings are given when they are included
+        # they are seen until the end of the selection, as if they were included now
+        self.__seen_wildcards.extend(included_keys)
+        return choice_values
+
+    def __flatten_choices(self, choice_values: list[dict], seen_wildcards: list[str]) -> Optional[list[dict]]:
+        """
+        Replace the include commands in some choices with the choices of the included wildcards, recursively.
+
+        Args:
+            choice_values (list[dict]): A list of choice objects.
+            seen_wildcards (list[str]): The keys of the wildcards being included, which is updated.
+
+        Returns:
+            Optional[list[dict]]: The choices, or None if a warning would be given when including them.
+        """
+        if not any(c.get("command", False) for c in choice_values):
+            return choice_values
+        flattened_choice_values = []
+        for c in choice_values:
+            if not c.get("command", False):
+                flattened_choice_values.append(c)
+                continue
+            content = c.get("content", "")
+            if isinstance(content, lark.Tree) and any(
+                t.data not in ("choicevalue", "content") for t in content.iter_subtrees()
+            ):
+                return None  # the included wildcard can change
+            command = self.__visit(content, False, True).split()
+            if len(command) != 2 or command[0] != "include":
+                return None
+            wcs = self.state.wildcards_obj.get_wildcards(command[1])
+            if not wcs:
+                return None
+            c_weight = float(c.get("weight", 1.0))
+            for wc in wcs:
+                if wc.key in seen_wildcards:
+                    return None
+                seen_wildcards.append(wc.key)
+                _, wc_choice_values = self.__check_wildcard_initialization(wc)
+                wc_choice_values = self.__flatten_choices(wc_choice_values, seen_wildcards)
+                if wc_choice_values is None:
+                    return None
+                flattened_choice_values.extend(
+                    {**cv, "weight": float(cv.get("weight", 1.0) * c_weight)} for cv in wc_choice_values
+                )
+        return flattened_choice_values
+
+    def __get_filtered_indexes(
+        self,
+        choice_values: list[dict],
+        filter_specifier: list[list[str]],
+        source_wildcard: Optional[PPPWildcard] = None,
+    ) -> tuple[int, ...]:
+        """
+        Get the positions of the choices that pass a filter.
+
+        Args:
+            choice_values (list[dict]): A list of choice objects.
+            filter_specifier (list[list[str]]): The filter specifier.
+            source_wildcard (Optional[PPPWildcard]): The wildcard whose choices are the choice objects, to use its
+                labels index and store the result.
+
+        Returns:
+            tuple[int, ...]: The positions of the choices, in order.
+        """
+        filters = source_wildcard.filters if source_wildcard is not None else None
+        filter_key = tuple(tuple(x) for x in filter_specifier)
+        if filters is not None and filter_key in filters:
+            return filters[filter_key]
+        labels_index = (
+            source_wildcard.labels if filters is not None else self.__get_wildcard_labels_index(choice_values)
+        )
+        n = len(choice_values)
+        passed: set[int] = set()
+        for or_ in filter_specifier:
+            and_passed: Optional[set[int]] = None  # None means all the choices
+            for and_ in or_:
+                if and_.isdecimal():
+                    i = int(and_)
+                    term = (i,) if i < n else ()
+                elif re.match(r"^\d+-\d+$", and_):
+                    try:
+                        start, end = map(int, and_.split("-", 1))
+                        term = range(start, min(end + 1, n))
+                    except ValueError:
+                        term = ()
+                else:
+                    label = and_.lower()
+                    term = labels_index.positions.get(label, ())
+                    if labels_index.texts:  # a text as labels matches any part of it
+                        term = set(term).union(i for i, text in labels_index.texts if label in text)
+                and_passed = set(term) if and_passed is None else and_passed.intersection(term)
+                if not and_passed:
+                    break
+            passed.update(range(n) if and_passed is None else and_passed)
+        indexes = tuple(sorted(passed))
+        if filters is not None:
+            filters[filter_key] = indexes
+        return indexes
+
     def __get_choices_select(
         self,
         options: dict | None,
         choice_values: list[dict],
         filter_specifier: Optional[list[list[str]]] = None,
         wildcard_key: str = None,
+        lines_wildcard: Optional[PPPWildcard] = None,
+        source_wildcard: Optional[PPPWildcard] = None,
     ) -> tuple[lark.Tree, list[str]]:
         """
         Select choices based on the options.
@@ -1864,6 +1971,10 @@ class TreeProcessor(lark.visitors.Interpreter):
             choice_values (list[dict]): A list of choice objects.
             filter_specifier (list[list[str]]): The filter specifier.
             wildcard_key (str): The wildcard key if it is a wildcard.
+            lines_wildcard (Optional[PPPWildcard]): A wildcard of a large text file to select its lines directly
+                instead of the choice objects.
+            source_wildcard (Optional[PPPWildcard]): The wildcard whose choices are the choice objects, to use its
+                sampling table and labels index.
 
         Returns:
             tuple[lark.Tree,list[str]]: The resulting container and list of chosen choices.
@@ -1885,28 +1996,54 @@ class TreeProcessor(lark.visitors.Interpreter):
         if sampler not in ("~", "@"):
             self.warn_or_stop(f"Unsupported sampler '{escape_single_quotes(sampler)}' at {msg_where} options!")
             sampler = "~"
-        expanded_choice_values = self.__get_choices_internal_get(choice_values, filter_specifier, wildcard_key)
-        available_choices: list[dict] = []
-        weights = []
-        included_choices = 0
-        excluded_choices = 0
-        excluded_weights_sum = 0
-        for i, c in enumerate(expanded_choice_values):
-            c["choice_index"] = i  # we index them to later sort the results
-            weight = float(c.get("weight", 1.0))
-            condition = c.get("if", None)
-            if weight > 0 and (condition is None or self.__eval_condition(condition)):
-                available_choices.append(c)
-                weights.append(weight)
-                included_choices += 1
-            else:
-                weights.append(-1)
-                excluded_choices += 1
-                excluded_weights_sum += weight
-        if excluded_choices > 0:  # we need to redistribute the excluded weights
-            weights = [weight + excluded_weights_sum / included_choices for weight in weights if weight >= 0]
-        weights = np.array(weights)
-        weights /= weights.sum()  # normalize weights
+        table: Optional[TreeProcessor.SamplingTable] = None
+        if lines_wildcard is not None:
+            # all the lines have the same weight, so the table is the same as if they were parsed (and the results
+            # too), but only the chosen ones are read and parsed
+            rng_state = self.__rng.bit_generator.state
+            lines: PPPWildcardLines = lines_wildcard.unprocessed_choices
+            if len(lines) > 0:
+                table = self.__new_sampling_table(lines, np.ones(len(lines)))
+        elif (
+            source_wildcard is not None
+            and filter_specifier is None
+            and source_wildcard.sampling
+            and not source_wildcard.sampling.conditional
+        ):
+            # nothing can be excluded, so the table of the wildcard is used as is
+            table = source_wildcard.sampling
+        else:
+            expanded_choice_values = self.__get_choices_internal_get(
+                choice_values, filter_specifier, wildcard_key, source_wildcard
+            )
+            available_choices: list[dict] = []
+            weights = []
+            included_choices = 0
+            excluded_choices = 0
+            excluded_weights_sum = 0
+            for c in expanded_choice_values:
+                weight = float(c.get("weight", 1.0))
+                condition = c.get("if", None)
+                if weight > 0 and (condition is None or self.__eval_condition(condition)):
+                    available_choices.append(c)
+                    weights.append(weight)
+                    included_choices += 1
+                else:
+                    weights.append(-1)
+                    excluded_choices += 1
+                    excluded_weights_sum += weight
+            if (
+                excluded_choices == 0
+                and source_wildcard is not None
+                and filter_specifier is None
+                and source_wildcard.sampling
+            ):
+                table = source_wildcard.sampling  # the conditions did not exclude any choice
+            elif available_choices:
+                if excluded_choices > 0:  # we need to redistribute the excluded weights
+                    weights = [weight + excluded_weights_sum / included_choices for weight in weights if weight >= 0]
+                table = self.__new_sampling_table(available_choices, np.array(weights))
+        available_choices = table.choices if table is not None else []
         if available_choices:
             if from_value < 0:
                 from_value = 1
@@ -1916,27 +2053,22 @@ class TreeProcessor(lark.visitors.Interpreter):
                 to_value = 1
             elif (to_value > len(available_choices) and not repeating) or from_value > to_value:
                 to_value = len(available_choices)
-            comb_chosen_selection: Optional[list[dict]] = None
+            comb_chosen_selection: Optional[list[int]] = None
             if self.state.options.do_combinatorial or sampler == "@":
-                # Enumerate every distinct selection of choices, accounting for count range and repetition.
-                all_selections: list[tuple] = []
+                # Number every distinct selection of choices, accounting for count range and repetition.
                 # When keep_choices_order is False the output depends on the selection order,
-                # so we must enumerate ordered sequences (permutations / product).
+                # so we must count ordered sequences (permutations / product).
                 # When keep_choices_order is True selections are sorted afterward, so all
                 # orderings of the same items produce identical output and we only need
-                # unordered iterators (combinations / combinations_with_replacement).
-                for k in range(from_value, to_value + 1):
-                    if repeating:
-                        if self.state.options.keep_choices_order:
-                            all_selections.extend(combinations_with_replacement(available_choices, k))
-                        else:
-                            all_selections.extend(product(available_choices, repeat=k))
-                    else:
-                        if self.state.options.keep_choices_order:
-                            all_selections.extend(combinations(available_choices, k))
-                        else:
-                            all_selections.extend(permutations(available_choices, k))
-                num_selections = len(all_selections)
+                # unordered ones (combinations / combinations_with_replacement).
+                # The selections are numbered in the order of itertools for each count, and only the chosen one is
+                # built, so the work does not grow with the number of selections.
+                ordered = not self.state.options.keep_choices_order
+                counts = [
+                    count_selections(len(available_choices), k, repeating, ordered)
+                    for k in range(from_value, to_value + 1)
+                ]
+                num_selections = sum(counts)
                 if self.state.options.do_combinatorial:
                     decision_idx = len(self.__comb_trace)
                     self.__comb_trace.append(num_selections)
@@ -1953,7 +2085,13 @@ class TreeProcessor(lark.visitors.Interpreter):
                         if cycl_decision_idx < len(self.__cycl_forced_path)
                         else 0
                     )
-                comb_chosen_selection = list(all_selections[chosen_idx])
+                k = from_value
+                for count in counts:
+                    if chosen_idx < count:
+                        break
+                    chosen_idx -= count
+                    k += 1
+                comb_chosen_selection = unrank_selection(len(available_choices), k, repeating, ordered, chosen_idx)
                 num_choices = len(comb_chosen_selection)
             else:
                 num_choices = (
@@ -1967,21 +2105,34 @@ class TreeProcessor(lark.visitors.Interpreter):
             repeating = False
         self.log(
             logging.DEBUG,
-            f"Selecting {'optional ' if optional else ''}{'repeating ' if repeating else ''}{num_choices} choice"
+            lambda: f"Selecting {'optional ' if optional else ''}{'repeating ' if repeating else ''}{num_choices} choice"
             + ("s" if num_choices != 1 else "")
             + (f" and separating with '{escape_single_quotes(separator)}'" if num_choices > 1 else ""),
         )
         if num_choices > 0:
             if comb_chosen_selection is not None:
-                selected_choices: list[dict] = comb_chosen_selection
+                chosen_indexes: list[int] = comb_chosen_selection
+            elif repeating or num_choices == 1:
+                # same random numbers and results as self.__rng.choice(), without rebuilding the table
+                chosen_indexes = table.cdf.searchsorted(self.__rng.random(num_choices), side="right").tolist()
             else:
-                selected_choices: list[dict] = (
-                    list(self.__rng.choice(available_choices, size=num_choices, p=weights, replace=repeating))
-                    if available_choices
-                    else []
-                )
+                chosen_indexes = self.__rng.choice(
+                    len(available_choices), size=num_choices, p=table.p, replace=False
+                ).tolist()
             if self.state.options.keep_choices_order:
-                selected_choices = sorted(selected_choices, key=lambda x: x["choice_index"])
+                chosen_indexes = sorted(chosen_indexes)
+            if lines_wildcard is not None:
+                selected_choices = [self.__get_line_choice(lines_wildcard, i) for i in chosen_indexes]
+                if any(c is None for c in selected_choices):
+                    # the invalid lines are not choices of the wildcard, so it is initialized (reporting them) and the
+                    # choices are selected again with the same random numbers
+                    self.__rng.bit_generator.state = rng_state
+                    _, choice_values = self.__check_wildcard_initialization(lines_wildcard)
+                    return self.__get_choices_select(
+                        options, choice_values, filter_specifier, wildcard_key, None, lines_wildcard
+                    )
+            else:
+                selected_choices: list[dict] = [available_choices[i] for i in chosen_indexes]
             selected_choices_text = []
             for i, c in enumerate(selected_choices):
                 t1 = time.monotonic_ns()
@@ -1993,7 +2144,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                 t2 = time.monotonic_ns()
                 self.log(
                     logging.DEBUG,
-                    f"Adding choice {i+1} ({(t2-t1) / 1_000_000_000:.3f} seconds):\n"
+                    lambda: f"Adding choice {i+1} ({(t2-t1) / 1_000_000_000:.3f} seconds):\n"
                     + textwrap.indent(re.sub(r"\n$", "", choice_content), "    "),
                 )
                 selected_choices_text.append(choice_content)
@@ -2032,12 +2183,92 @@ class TreeProcessor(lark.visitors.Interpreter):
             )
         self.log(
             logging.DEBUG,
-            "Unseen wildcards: "
+            lambda: "Unseen wildcards: "
             + ", ".join([f"'{escape_single_quotes(x)}'" for x in self.__seen_wildcards[seen_wildcards_len:]]),
         )
         self.__seen_wildcards = self.__seen_wildcards[:seen_wildcards_len]
         return container, results
 
+    def __get_line_choice(self, wildcard: PPPWildcard, i: int) -> Optional[dict]:
+        """
+        Read and parse a line of a large text wildcard file.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            i (int): The index of the line.
+
+        Returns:
+            Optional[dict]: The choice object, or None if it is not valid (the error is reported when the wildcard is
+                initialized).
+        """
+        try:
+            return self.__get_wildcard_choice(wildcard, wildcard.unprocessed_choices[i])
+        except lark.exceptions.UnexpectedInput:
+            return None
+
+    def __new_sampling_table(
+        self, choices: list[dict] | PPPWildcardLines, weights: np.ndarray, conditional: bool = False
+    ) -> "TreeProcessor.SamplingTable":
+        """
+        Create the table to sample some choices.
+
+        Args:
+            choices (list[dict] | PPPWildcardLines): The choices, at least one, or the lines of a large text file.
+            weights (np.ndarray): The weights of the choices.
+            conditional (bool): Whether some choices can be excluded when selecting them.
+
+        Returns:
+            TreeProcessor.SamplingTable: The choices with their normalized weights and cumulative distribution.
+        """
+        p = weights / weights.sum()
+        cdf = p.cumsum()
+        cdf /= cdf[-1]
+        return self.SamplingTable(choices, p, cdf, conditional)
+
+    def __get_wildcard_sampling_table(self, choice_values: list[dict]) -> "TreeProcessor.SamplingTable | bool":
+        """
+        Create the sampling table of the processed choices of a wildcard.
+
+        Args:
+            choice_values (list[dict]): The processed choices.
+
+        Returns:
+            TreeProcessor.SamplingTable | bool: The table, or False if the choices can't be sampled with it.
+        """
+        if not choice_values or any(c.get("command", False) for c in choice_values):
+            return False  # the included choices are obtained for each selection
+        weights = np.array([float(c.get("weight", 1.0)) for c in choice_values])
+        if not (weights > 0).all():
+            return False  # some choices are always excluded
+        conditional = any(c.get("if", None) is not None for c in choice_values)
+        return self.__new_sampling_table(choice_values, weights, conditional)
+
+    def __get_wildcard_labels_index(self, choice_values: list[dict]) -> "TreeProcessor.LabelsIndex":
+        """
+        Create the index of the labels of the processed choices of a wildcard.
+
+        Args:
+            choice_values (list[dict]): The processed choices.
+
+        Returns:
+            TreeProcessor.LabelsIndex: The positions of the choices with each label, and the choices that have a text
+                as labels.
+        """
+        labels_index: dict[str, list[int]] = {}
+        texts: list[tuple[int, str]] = []
+        for i, c in enumerate(choice_values):
+            labels = c.get("labels", [])
+            if isinstance(labels, str):
+                texts.append((i, labels))
+                continue
+            for label in labels:
+                if not isinstance(label, str):
+                    continue  # it can't match a filter
+                positions = labels_index.setdefault(label, [])
+                if not positions or positions[-1] != i:  # repeated label
+                    positions.append(i)
+        return self.LabelsIndex({label: tuple(positions) for label, positions in labels_index.items()}, tuple(texts))
+
     def __apply_container(self, container: lark.Tree, choices: list[str]) -> str:
         # we save the choices variable in case there are nested choices
         old_choices = self.state.variables.get_system("_choices[]", None)
@@ -2118,6 +2349,42 @@ class TreeProcessor(lark.visitors.Interpreter):
         choice_dict["content"] = choice.children[-1]
         return choice_dict
 
+    def __get_wildcard_choice(self, wildcard: PPPWildcard, text: str) -> dict:
+        """
+        Convert a choice of a wildcard in string format to a dictionary. Plain text is not parsed.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            text (str): The choice text.
+
+        Returns:
+            dict: The converted choice.
+        """
+        if is_plain_choice_text(text):
+            return {"command": False, "labels": [], "weight": 1.0, "if": None, "content": text}
+        return self.__convert_choice(self.__parse_wildcard_text(wildcard, "choice", text, "choice"))
+
+    def __parse_wildcard_text(self, wildcard: PPPWildcard, description: str, text: str, parser_name: str):
+        """
+        Parses a text of a wildcard, reusing the parsed text stored in the wildcards cache if available.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            description (str): The description of the text.
+            text (str): The text to parse.
+            parser_name (str): The name of the parser to use.
+
+        Returns:
+            Tree: The parsed text.
+        """
+        key = (self.state.parsers.grammar_hash, parser_name, text)
+        parsed = self.state.wildcards_obj.get_parsed_choice(wildcard, key)
+        if parsed is None:
+            # they are memoized by the wildcards object, so they don't need the cache of parsed prompts
+            parsed = parse_prompt(self.state, description, text, self.state.parsers[parser_name], True, False)
+            self.state.wildcards_obj.add_parsed_choice(wildcard, key, parsed)
+        return parsed
+
     def __check_wildcard_initialization(self, wildcard: PPPWildcard) -> tuple[dict | None, list[dict] | None]:
         """
         Initializes a wildcard if it hasn't been yet.
@@ -2137,12 +2404,11 @@ class TreeProcessor(lark.visitors.Interpreter):
             for cv in wildcard.unprocessed_choices[n:]:
                 if isinstance(cv, dict):
                     if self.state.wildcards_obj.is_dict_choice_options(cv):
+                        cv = dict(cv)  # the unprocessed choices can be read by the warm-up threads
                         condition = cv.get("if", None)
                         if condition is not None and isinstance(condition, str):
                             try:
-                                cv["if"] = parse_prompt(
-                                    self.state, "condition", condition, self.state.parsers["condition"], True
-                                )
+                                cv["if"] = self.__parse_wildcard_text(wildcard, "condition", condition, "condition")
                             except lark.exceptions.UnexpectedInput as e:
                                 self.warn_or_stop(
                                     f"Error parsing condition '{escape_single_quotes(condition)}' in wildcard '{escape_single_quotes(wildcard.key)}'! : {e.__class__.__name__}",
@@ -2153,10 +2419,10 @@ class TreeProcessor(lark.visitors.Interpreter):
                         cv["content"] = content
                         if "text" in cv:
                             del cv["text"]
-                        if content is not None and isinstance(content, str):
+                        if isinstance(content, str) and (cv.get("command", False) or not is_plain_choice_text(content)):
                             try:
-                                cv["content"] = parse_prompt(
-                                    self.state, "choicevalue", content, self.state.parsers["choicevalue"], True
+                                cv["content"] = self.__parse_wildcard_text(
+                                    wildcard, "choicevalue", content, "choicevalue"
                                 )
                             except lark.exceptions.UnexpectedInput as e:
                                 self.warn_or_stop(
@@ -2165,7 +2431,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                                 )
                                 cv["content"] = None
                         if cv["content"] is not None:
-                            self.log(logging.DEBUG, f"Processed choice {cv}")
+                            self.log(logging.DEBUG, lambda: f"Processed choice {cv}")
                             choice_values.append(cv)
                         else:
                             self.warn_or_stop(
@@ -2175,31 +2441,43 @@ class TreeProcessor(lark.visitors.Interpreter):
                         self.warn_or_stop(f"Invalid choice {cv} in wildcard '{escape_single_quotes(wildcard.key)}'!")
                 else:
                     try:
-                        choice_values.append(
-                            self.__convert_choice(
-                                parse_prompt(self.state, "choice", cv, self.state.parsers["choice"], True)
-                            )
-                        )
+                        choice_values.append(self.__get_wildcard_choice(wildcard, cv))
                     except lark.exceptions.UnexpectedInput as e:
                         self.warn_or_stop(
                             f"Error parsing choice '{escape_single_quotes(cv)}' in wildcard '{escape_single_quotes(wildcard.key)}'! : {e.__class__.__name__}",
                             e,
                         )
             wildcard.choices = choice_values
+            wildcard.sampling = self.__get_wildcard_sampling_table(choice_values)
+            wildcard.labels = self.__get_wildcard_labels_index(choice_values)
+            wildcard.filters = {}
+            wildcard.included = None
+            self.state.wildcards_obj.release_unprocessed_choices(wildcard)
             t2 = time.monotonic_ns()
             self.log(
                 logging.DEBUG,
-                f"Processed choices for wildcard '{escape_single_quotes(wildcard.key)}' ({(t2-t1) / 1_000_000_000:.3f} seconds)",
+                lambda: f"Processed choices for wildcard '{escape_single_quotes(wildcard.key)}' ({(t2-t1) / 1_000_000_000:.3f} seconds)",
             )
         return (self.__clean_wildcard_options(options), choice_values)
 
+    def initialize_wildcard(self, wildcard: PPPWildcard):
+        """
+        Initializes a wildcard if it hasn't been yet, processing its options and choices.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+        """
+        self.__check_wildcard_initialization(wildcard)
+
     def get_wildcard_options(self, wildcard: PPPWildcard) -> tuple[dict | None, int]:
         options = wildcard.options
         n = 0
+        if wildcard.unprocessed_choices is None:
+            return options, n  # it is already initialized
         # we check the first choice to see if it is actually options
         if isinstance(wildcard.unprocessed_choices[0], dict):
             if self.state.wildcards_obj.is_dict_wcdef_options(wildcard.unprocessed_choices[0]):
-                options = wildcard.unprocessed_choices[0]
+                options = dict(wildcard.unprocessed_choices[0])
                 container = options.get("container", None)
                 container_kind = "specified"
                 if container is None:
@@ -2226,8 +2504,8 @@ class TreeProcessor(lark.visitors.Interpreter):
                     options.pop("container", None)
                 if container is not None and isinstance(container, str):
                     try:
-                        options["container"] = parse_prompt(
-                            self.state, "choicevalue", container, self.state.parsers["choicevalue"], True
+                        options["container"] = self.__parse_wildcard_text(
+                            wildcard, "choicevalue", container, "choicevalue"
                         )
                     except lark.exceptions.UnexpectedInput as e:
                         self.warn_or_stop(
@@ -2239,12 +2517,11 @@ class TreeProcessor(lark.visitors.Interpreter):
             if wildcard.unprocessed_choices[0].endswith("$$"):
                 try:
                     options = self.__convert_choices_options(
-                        parse_prompt(
-                            self.state,
+                        self.__parse_wildcard_text(
+                            wildcard,
                             "as wildcard options",
                             wildcard.unprocessed_choices[0][:-2].strip(),
-                            self.state.parsers["wcdefoptions"],
-                            True,
+                            "wcdefoptions",
                         ),
                         True,
                     )
@@ -2258,9 +2535,8 @@ class TreeProcessor(lark.visitors.Interpreter):
 
     def __clean_wildcard_options(self, options: dict) -> dict:
         if options is not None:
-            options.pop("description", None)  # description is only for wildcard definitions, not for usage
-            if not options:
-                options = None
+            # description is only for wildcard definitions, not for usage
+            options = {k: v for k, v in options.items() if k != "description"} or None
         return options
 
     def __process_wildcard(self, tree: lark.Tree) -> list:
@@ -2278,7 +2554,7 @@ class TreeProcessor(lark.visitors.Interpreter):
         wildcard_key: str = self.__visit(tree.children[1], False, True)
         wc = self.__get_original_node_content(tree, f"?__{wildcard_key}__")
         if self.state.options.process_wildcards:
-            self.log(logging.DEBUG, f"Processing wildcard: {wildcard_key}")
+            self.log(logging.DEBUG, lambda: f"Processing wildcard: {wildcard_key}")
             selected_wildcards = self.state.wildcards_obj.get_wildcards(wildcard_key)
             if not selected_wildcards:
                 self.__detectedWildcards.append((wc, self.__is_negative))
@@ -2332,6 +2608,8 @@ class TreeProcessor(lark.visitors.Interpreter):
                 # self.state.variables.set_user(variablename, variablevalue)
                 self.__varset("wildcard", variablename, vardescriptor_specifier, None, var_object.children[1])
             choice_values_all = []
+            lines_wildcard = None
+            source_wildcard = None
             for wildcard in selected_wildcards:
                 if wildcard is None:
                     self.__detectedWildcards.append((wc, self.__is_negative))
@@ -2345,18 +2623,31 @@ class TreeProcessor(lark.visitors.Interpreter):
                     )
                     continue
                 self.__seen_wildcards.append(wildcard.key)
-                self.log(logging.DEBUG, f"Seen wildcard '{escape_single_quotes(wildcard.key)}'")
+                self.log(logging.DEBUG, lambda: f"Seen wildcard '{escape_single_quotes(wildcard.key)}'")
+                if (
+                    len(selected_wildcards) == 1
+                    and isinstance(wildcard.unprocessed_choices, PPPWildcardLines)
+                    and wildcard.choices is None
+                    and filter_specifier is None
+                    and not self.state.options.do_combinatorial
+                    and (applied_options or {}).get("sampler", "~") == "~"
+                ):
+                    # plain lines with a uniform random selection, so the whole file does not have to be parsed
+                    lines_wildcard = wildcard
+                    continue
                 options, choice_values = self.__check_wildcard_initialization(wildcard)
                 if options is not None:
                     if applied_options is None:
                         applied_options = options
                     else:
                         self.log(
-                            logging.DEBUG, f"Options for wildcard '{escape_single_quotes(wildcard.key)}' are ignored!"
+                            logging.DEBUG, lambda: f"Options for wildcard '{escape_single_quotes(wildcard.key)}' are ignored!"
                         )
                 choice_values_all += choice_values
+                if len(selected_wildcards) == 1:
+                    source_wildcard = wildcard
             container, chosen_choices = self.__get_choices_select(
-                applied_options, choice_values_all, filter_specifier, wildcard_key
+                applied_options, choice_values_all, filter_specifier, wildcard_key, lines_wildcard, source_wildcard
             )
             if chosen_choices:
                 self.__result += self.__apply_container(container, chosen_choices)
@@ -2371,7 +2662,7 @@ class TreeProcessor(lark.visitors.Interpreter):
             self.__result += wc
         if self.__debug_level == DEBUG_LEVEL.full:
             list_unseen = [f"'{escape_single_quotes(x)}'" for x in self.__seen_wildcards[seen_wildcards_len:]]
-            self.log(logging.DEBUG, f"Unseen wildcards: {', '.join(list_unseen)}")
+            self.log(logging.DEBUG, lambda: f"Unseen wildcards: {', '.join(list_unseen)}")
         self.__seen_wildcards = self.__seen_wildcards[:seen_wildcards_len]
         t2 = time.monotonic_ns()
         self.__debug_end("wildcard", start_result, t2 - t1, f"'{escape_single_quotes(wc)}'")
@@ -2504,7 +2795,7 @@ class TreeProcessor(lark.visitors.Interpreter):
                 if content not in self.__already_processed:
                     if self.state.options.stn_ignore_repeats:
                         self.__already_processed.append(content)
-                    self.log(logging.DEBUG, f"Adding content at position {position}: {content}")
+                    self.log(logging.DEBUG, lambda: f"Adding content at position {position}: {content}")
                     if position == "e":
                         self.__add_at["end"].append(content)
                     elif position.startswith("p"):
@@ -2524,8 +2815,8 @@ class TreeProcessor(lark.visitors.Interpreter):
         pos, neg = self.__result.split(self.NEGATIVE_SEP, 1)
         neg_start = len(pos) + len(self.NEGATIVE_SEP)
         stn_sep = self.state.options.stn_separator
-        self.log(logging.DEBUG, f"Applying STN additions to negative: {self.__add_at}")
-        self.log(logging.DEBUG, f"Applying STN indexes: {self.__insertion_at}")
+        self.log(logging.DEBUG, lambda: f"Applying STN additions to negative: {self.__add_at}")
+        self.log(logging.DEBUG, lambda: f"Applying STN indexes: {self.__insertion_at}")
         ordered_range = sorted(
             range(10),
             key=lambda x: self.__insertion_at[x][0] if self.__insertion_at[x] is not None else float("-inf"),
@@ -1,6 +1,19 @@
+import json
 import logging
+import math
+import os
 from pathlib import Path
-from typing import Any
+import stat
+import sys
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Optional
+from ruamel.yaml import YAML as _YAML
+
+# Folder for the persistent caches (compiled parsers, parsed wildcards...), it can be safely deleted at any time
+CACHE_FOLDER = Path(__file__).resolve().parent / "cache"
 
 
 def get_version_from_pyproject() -> str:
@@ -23,6 +36,209 @@ def get_version_from_pyproject() -> str:
     return version_str
 
 
+def write_file_atomically(path: Path, data: bytes):
+    """
+    Writes a file through a temporary file, so other processes never see a partial file.
+
+    Args:
+        path (Path): The path of the file (the folder is created if needed).
+        data (bytes): The content of the file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile("wb", dir=path.parent, suffix=".tmp", delete=False) as f:
+            temp_path = Path(f.name)
+            f.write(data)
+        temp_path.replace(path)
+    except BaseException:
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        raise
+
+
+_yaml_loaders = threading.local()
+
+
+def decode_text(data: bytes) -> tuple[str, bool]:
+    """
+    Decodes the content of a text file, as utf-8 or else as windows-1252.
+
+    Args:
+        data (bytes): The content of the file.
+
+    Returns:
+        tuple[str, bool]: The text and whether it was not utf-8.
+    """
+    try:
+        return data.decode("utf-8"), False
+    except UnicodeDecodeError:
+        return data.decode("windows-1252"), True
+
+
+def load_structured_text(text: str, is_json: bool = False) -> Any:
+    """
+    Loads the content of a YAML or JSON file.
+
+    JSON is loaded with the json module, which is much faster. Anything it rejects that YAML could accept (like
+    duplicated keys) is loaded as YAML, so the result is the same. YAML is loaded with a safe loader that is reused by
+    each thread. It uses the C parser of ruamel.yaml.clib when it is installed (several times faster), but the objects
+    are still built in Python, since the C based loaders of other libraries follow YAML 1.1 and would change the
+    content of some files.
+
+    Args:
+        text (str): The content of the file.
+        is_json (bool): Whether the file is a JSON file.
+
+    Returns:
+        Any: The loaded content.
+    """
+    if is_json:
+
+        def no_duplicates(pairs):
+            d = dict(pairs)
+            if len(d) != len(pairs):
+                raise ValueError("duplicated keys")
+            return d
+
+        try:
+            return json.loads(text, object_pairs_hook=no_duplicates)
+        except ValueError:
+            pass
+    yaml = getattr(_yaml_loaders, "yaml", None)
+    if yaml is None:
+        yaml = _yaml_loaders.yaml = _YAML(typ="safe", pure=False)
+    return yaml.load(text)
+
+
+class PPPFolderScanner:
+    """
+    Lists the files in some folders and their subfolders, with their modification times.
+
+    The contents of each folder are remembered with its modification time, so the folders that have not changed since
+    the previous scan are not read again. A folder modified shortly before a scan is read again in the next one, since
+    another change in the same timestamp tick would not change its modification time. The files are still checked with
+    one stat call each, since modifying a file does not change the modification time of its folder. Hidden files and
+    folders (starting with a dot) are ignored.
+    """
+
+    # the coarsest timestamp granularity of the usual filesystems (FAT), in nanoseconds
+    TIMESTAMP_GRANULARITY_NS = 2_000_000_000
+
+    def __init__(self):
+        self.__folders: dict[Path, tuple[int | None, list[tuple[Path, bool]]]] = {}
+
+    def scan(self, paths: list[Path]) -> list[tuple[Path, dict[Path, float] | None]]:
+        """
+        Scan some paths.
+
+        Args:
+            paths (list[Path]): The paths to scan (folders or files).
+
+        Returns:
+            list[tuple[Path, dict[Path, float] | None]]: For each path, the files found with their modification time,
+                or None if the path does not exist.
+        """
+        previous_folders = self.__folders
+        self.__folders = {}
+        # the listings of the folders modified after this are not reused
+        reliable_mtime = time.time_ns() - self.TIMESTAMP_GRANULARITY_NS
+        results = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                results.append((path, None))
+                continue
+            files = {}
+            if stat.S_ISDIR(st.st_mode):
+                self.__scan_folder(path, st.st_mtime_ns, files, previous_folders, reliable_mtime)
+            else:
+                files[path] = st.st_mtime
+            results.append((path, files))
+        return results
+
+    def scan_changes(
+        self, paths: list[Path], changed_files: set[Path]
+    ) -> list[tuple[Path, dict[Path, float] | None]]:
+        """
+        Check only some changed files of the scanned paths, as reported by a folder watcher.
+
+        Args:
+            paths (list[Path]): The scanned paths (folders or files).
+            changed_files (set[Path]): The changed files.
+
+        Returns:
+            list[tuple[Path, dict[Path, float] | None]]: For each path, the changed files that still exist in it with
+                their modification time, or None if the path does not exist.
+        """
+        results = []
+        claimed = set()
+        for path in paths:
+            if not path.exists():
+                results.append((path, None))
+                continue
+            files = {}
+            for file_path in sorted(changed_files - claimed):
+                if file_path != path and (
+                    not file_path.is_relative_to(path)
+                    or any(part.startswith(".") for part in file_path.relative_to(path).parts)
+                ):
+                    continue
+                claimed.add(file_path)  # like in a full scan, a file is found from the first path
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    files[file_path] = st.st_mtime
+            results.append((path, files))
+        return results
+
+    def __scan_folder(
+        self,
+        path: Path,
+        mtime: int,
+        files: dict[Path, float],
+        previous_folders: dict[Path, tuple[int | None, list[tuple[Path, bool]]]],
+        reliable_mtime: int,
+    ):
+        if path in self.__folders:
+            return  # already scanned from another path
+        previous = previous_folders.get(path)
+        entries: list[tuple[Path, bool]] = []
+        stats: list[os.stat_result | None] = []
+        if previous is not None and previous[0] == mtime:
+            entries = previous[1]
+            stats = [None] * len(entries)
+        else:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        if is_dir or entry.is_file():
+                            # the stat of the entry does not need another system call in Windows
+                            stats.append(entry.stat())
+                            entries.append((Path(entry.path), is_dir))
+                    except OSError:
+                        pass
+        # a listing is not remembered if the folder could still change without changing its modification time
+        self.__folders[path] = (mtime if mtime < reliable_mtime else None, entries)
+        # the files and subfolders are visited in the order they are listed
+        for (entry_path, is_dir), st in zip(entries, stats):
+            if st is None:
+                try:
+                    st = os.stat(entry_path)
+                except OSError:
+                    continue
+            if is_dir:
+                self.__scan_folder(entry_path, st.st_mtime_ns, files, previous_folders, reliable_mtime)
+            else:
+                files[entry_path] = st.st_mtime
+
+
 def deep_freeze(obj):
     """
     Deep freeze an object.
@@ -42,6 +258,116 @@ def deep_freeze(obj):
     return obj
 
 
+def count_selections(n: int, k: int, repeating: bool, ordered: bool) -> int:
+    """
+    Count the selections of k elements out of n.
+
+    Args:
+        n (int): The number of elements.
+        k (int): The number of elements in each selection.
+        repeating (bool): Whether an element can be selected more than once.
+        ordered (bool): Whether the order of the elements makes a selection different.
+
+    Returns:
+        int: The number of selections.
+    """
+    if repeating:
+        return n**k if ordered else math.comb(n + k - 1, k)
+    return math.perm(n, k) if ordered else math.comb(n, k)
+
+
+def unrank_selection(n: int, k: int, repeating: bool, ordered: bool, rank: int) -> list[int]:
+    """
+    Get a selection of k elements out of n by its position in the order of itertools (product, permutations,
+    combinations_with_replacement or combinations), without generating the previous ones.
+
+    Args:
+        n (int): The number of elements.
+        k (int): The number of elements in each selection.
+        repeating (bool): Whether an element can be selected more than once.
+        ordered (bool): Whether the order of the elements makes a selection different.
+        rank (int): The position of the selection.
+
+    Returns:
+        list[int]: The indexes of the selected elements.
+    """
+    indexes = []
+    if ordered and repeating:
+        for j in range(k):
+            index, rank = divmod(rank, n ** (k - j - 1))
+            indexes.append(index)
+    elif ordered:
+        pool = list(range(n))
+        for j in range(k):
+            index, rank = divmod(rank, math.perm(n - j - 1, k - j - 1))
+            indexes.append(pool.pop(index))
+    else:
+        # the indexes are increasing (or non-decreasing when repeating), so each one is found by skipping the blocks
+        # of selections that start with a lower index
+        index = 0
+        for j in range(k):
+            remaining = k - j - 1
+            while True:
+                if repeating:
+                    block = math.comb(n - index + remaining - 1, remaining)
+                else:
+                    block = math.comb(n - index - 1, remaining)
+                if rank < block:
+                    break
+                rank -= block
+                index += 1
+            indexes.append(index)
+            if not repeating:
+                index += 1
+    return indexes
+
+
+# objects that are shared with the rest of the application, so they are not counted
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_sizeof(obj: object, seen: Optional[set[int]] = None) -> int:
+    """
+    Calculate the memory used by an object and the objects it references. Each object is counted only once.
+
+    Args:
+        obj (object): The object.
+        seen (Optional[set[int]]): The ids of the objects already counted, updated with the new ones.
+
+    Returns:
+        int: The size in bytes.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, _SHARED_TYPES):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, (str, bytes, int, float)):
+            continue
+        if isinstance(o, dict):
+            pending.extend(o.keys())
+            pending.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            pending.extend(o)
+        if hasattr(o, "__dict__"):
+            pending.append(o.__dict__)
+        for cls in type(o).__mro__:
+            slots = cls.__dict__.get("__slots__", ())
+            for slot in (slots,) if isinstance(slots, str) else slots:
+                if slot in ("__dict__", "__weakref__"):
+                    continue
+                if slot.startswith("__") and not slot.endswith("__"):
+                    slot = f"_{cls.__name__.lstrip('_')}{slot}"  # private names are mangled
+                if hasattr(o, slot):
+                    pending.append(getattr(o, slot))
+    return size
+
+
 def escape_single_quotes(s: str):
     """
     Escape single quotes in a string.
@@ -0,0 +1,264 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+from pathlib import Path
+import select
+import struct
+import sys
+import threading
+from typing import Callable, Optional
+
+from ppp_utils import PPPFolderScanner
+
+
+class PPPFolderWatcher:
+    """
+    Watches some folders (and their subfolders) for changes in a background thread.
+
+    It uses inotify where available (Linux) and polls the folders otherwise. If the inotify watches can't be kept (for
+    example, when the limit of watches is reached), it falls back to polling. The changed files are accumulated until
+    they are taken with take_changes(), and they are also reported to a callback as they happen, so the owner can
+    prepare them in the background.
+
+    Attributes:
+        paths (list[Path]): The watched paths.
+        backend (str): "inotify" or "polling".
+    """
+
+    POLL_INTERVAL = 2.0
+
+    # inotify constants (from sys/inotify.h)
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_MASK = (
+        IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+        | IN_ONLYDIR
+    )
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(
+        self,
+        paths: list[Path],
+        on_changes: Optional[Callable[[Optional[set[Path]]], None]] = None,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        """
+        Initializes and starts the watcher.
+
+        Args:
+            paths (list[Path]): The paths to watch.
+            on_changes (Optional[Callable[[Optional[set[Path]]], None]]): Function called from the watcher thread with
+                the changed files, or None if any file could have changed.
+            poll_interval (float): The interval in seconds between scans when polling.
+        """
+        self.paths = list(paths)
+        self.__on_changes = on_changes
+        self.__poll_interval = poll_interval
+        self.__lock = threading.Lock()
+        self.__changes: Optional[set[Path]] = set()
+        self.__stop = threading.Event()
+        self.__inotify_fd: int | None = None
+        self.__watches: dict[int, Path] = {}
+        self.__libc = None
+        self.backend = "polling"
+        if sys.platform.startswith("linux") and all(p.is_dir() for p in self.paths):
+            try:
+                self.__start_inotify()
+                self.backend = "inotify"
+            except OSError:
+                self.__close_inotify()
+        if self.backend == "polling":
+            # the initial state is taken now, so the changes made after returning are detected
+            self.__start_polling()
+        self.__thread = threading.Thread(
+            target=self.__run_inotify if self.backend == "inotify" else self.__run_polling,
+            name="ppp_watcher",
+            daemon=True,
+        )
+        self.__thread.start()
+
+    def is_watching(self, paths: list[Path]) -> bool:
+        """
+        Check if the watcher is running for some paths.
+
+        Args:
+            paths (list[Path]): The paths.
+
+        Returns:
+            bool: Whether the watcher is running for exactly those paths.
+        """
+        return self.paths == paths and self.__thread.is_alive()
+
+    def take_changes(self) -> Optional[set[Path]]:
+        """
+        Take the changes since the previous call.
+
+        Returns:
+            Optional[set[Path]]: The changed files (created, modified or removed), or None if any file could have
+                changed.
+        """
+        with self.__lock:
+            changes = self.__changes
+            self.__changes = set()
+        return changes
+
+    def stop(self):
+        """
+        Stop the watcher.
+        """
+        self.__stop.set()
+        if self.__thread is not threading.current_thread():
+            self.__thread.join(max(self.__poll_interval, 1.0) * 2)
+
+    def __notify(self, changed_files: Optional[set[Path]]):
+        with self.__lock:
+            if changed_files is None or self.__changes is None:
+                self.__changes = None
+            else:
+                self.__changes.update(changed_files)
+        if self.__on_changes is not None:
+            self.__on_changes(changed_files)
+
+    # polling
+
+    def __start_polling(self):
+        self.__scanner = PPPFolderScanner()
+        self.__scanned_paths = self.__scanner.scan(self.paths)
+
+    def __run_polling(self):
+        previous = self.__scanned_paths
+        while not self.__stop.wait(self.__poll_interval):
+            current = self.__scanner.scan(self.paths)
+            if current != previous:
+                changed_files = set()
+                for (_, old_files), (_, new_files) in zip(previous, current):
+                    old_files = old_files or {}
+                    new_files = new_files or {}
+                    changed_files.update(
+                        f for f in old_files.keys() | new_files.keys() if old_files.get(f) != new_files.get(f)
+                    )
+                previous = current
+                self.__notify(changed_files)
+
+    # inotify
+
+    def __start_inotify(self):
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.__libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.__libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.__inotify_fd = fd
+        for path in self.paths:
+            self.__add_watches(path)
+
+    def __add_watches(self, path: Path) -> set[Path]:
+        """
+        Watch a folder and its subfolders.
+
+        Returns:
+            set[Path]: The files found in the folders.
+        """
+        files = set()
+        seen = {os.path.realpath(p) for p in self.__watches.values()}
+        for folder, folder_names, file_names in os.walk(path, followlinks=True):
+            folder_names[:] = [d for d in folder_names if not d.startswith(".")]
+            real_folder = os.path.realpath(folder)
+            if real_folder in seen:
+                folder_names[:] = []  # symbolic link loop
+                continue
+            seen.add(real_folder)
+            wd = self.__libc.inotify_add_watch(self.__inotify_fd, os.fsencode(folder), self.IN_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # removed in the meantime
+                raise OSError(e, os.strerror(e))
+            self.__watches[wd] = Path(folder)
+            files.update(Path(folder) / f for f in file_names if not f.startswith("."))
+        return files
+
+    def __close_inotify(self):
+        if self.__inotify_fd is not None:
+            os.close(self.__inotify_fd)
+            self.__inotify_fd = None
+        self.__watches = {}
+
+    def __run_inotify(self):
+        try:
+            while not self.__stop.is_set():
+                self.__read_inotify_events()
+        except OSError:
+            # the watches can't be kept (for example, the limit was reached), so it continues polling
+            self.__close_inotify()
+            self.__start_polling()
+            self.backend = "polling"
+            # the changes before the initial state of the polling are not known
+            self.__notify(None)
+            self.__run_polling()
+        finally:
+            self.__close_inotify()
+
+    def __read_inotify_events(self):
+        """
+        Wait for the next inotify events and notify the changes.
+        """
+        readable, _, _ = select.select([self.__inotify_fd], [], [], 1.0)
+        if not readable:
+            return
+        changed_files = set()
+        try:
+            data = os.read(self.__inotify_fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            if mask & self.IN_Q_OVERFLOW:
+                changed_files = None  # events were lost
+                continue
+            if mask & self.IN_IGNORED:
+                self.__watches.pop(wd, None)
+                continue
+            folder = self.__watches.get(wd)
+            if folder is None or name.startswith("."):
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                changed_files = None
+                if folder in self.paths:
+                    self.__stop.set()  # the watched folder is gone, a new watcher will be needed
+                continue
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    new_files = self.__add_watches(folder / name)
+                    if changed_files is not None:
+                        changed_files.update(new_files)
+                elif changed_files is not None and mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    changed_files = None  # the files that were inside are not known here
+            elif name and changed_files is not None:
+                changed_files.add(folder / name)
+        if changed_files is None or changed_files:
+            self.__notify(changed_files)
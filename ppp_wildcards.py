@@ -1,12 +1,265 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures
 import fnmatch
+import hashlib
+from itertools import chain, islice
+import os
 from pathlib import Path
-from typing import Any, Optional
+import pickle
+import re
+import struct
+import sys
+import threading
+from typing import Any, Callable, Iterable, Optional
 import logging
-from ruamel.yaml import YAML as _YAML
+import multiprocessing
+import lark
 from ruamel.yaml.error import YAMLError as _YAMLError
 
+from ppp_cache import PPPLRUCache
 from ppp_logging import DEBUG_LEVEL, log
-from ppp_utils import deep_freeze, escape_single_quotes
+from ppp_utils import (
+    CACHE_FOLDER,
+    PPPFolderScanner,
+    decode_text,
+    deep_freeze,
+    deep_sizeof,
+    escape_single_quotes,
+    load_structured_text,
+    write_file_atomically,
+)
+from ppp_watcher import PPPFolderWatcher
+
+# Persistent cache of the parsed choices of the wildcard files, so restarts do not need to parse them again
+WILDCARDS_CACHE_FOLDER = CACHE_FOLDER / "wildcards"
+
+WILDCARDS_FILE_EXTENSIONS = (".txt", ".json", ".yaml", ".yml")
+
+# text that the choice parsers would return as a single plain token: no constructs, choice options or escapes
+PLAIN_CHOICE_TEXT = re.compile(r"(?:(?!__|\bAND\b)[^\\()\[\]:<>${|}~@])+")
+
+
+def is_plain_choice_text(text: str) -> bool:
+    """
+    Check if the text of a choice can be used as is, without parsing it.
+
+    Args:
+        text (str): The text of the choice or its content.
+
+    Returns:
+        bool: Whether it is plain text.
+    """
+    return PLAIN_CHOICE_TEXT.fullmatch(text) is not None
+
+
+def _read_wildcards_file(full_path: Path) -> tuple[object, str, bool]:
+    """
+    Read and decode a wildcards file. It can run in other threads or processes, so it does not log anything.
+
+    Args:
+        full_path (Path): The path to the file.
+
+    Returns:
+        tuple[object, str, bool]: The content of the file, the hash of the file and whether it was not utf-8.
+    """
+    data = full_path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    text, not_utf8 = decode_text(data)
+    if full_path.suffix != ".txt":
+        return load_structured_text(text, full_path.suffix == ".json"), digest, not_utf8
+    text_content = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    # First pass: drop blank lines and full-line comments.
+    text_content = list(filter(lambda x: x.strip() != "" and not x.strip().startswith("#"), text_content))
+    # Second pass: strip inline comments from lines that passed the first filter.
+    text_content = [x.split("#")[0].rstrip() if len(x.split("#")) > 1 else x for x in text_content]
+    return text_content, digest, not_utf8
+
+
+def _clean_wildcards_line(raw_line: bytes, encoding: str) -> Optional[str]:
+    """
+    Decode a line of a text wildcards file and clean it like when the whole file is read.
+
+    Args:
+        raw_line (bytes): The line, with its line break.
+        encoding (str): The encoding of the file.
+
+    Returns:
+        Optional[str]: The choice, or None if it is a blank line or a comment.
+    """
+    line = raw_line.decode(encoding)
+    if line.endswith("\n"):
+        line = line[:-1]
+    if line.endswith("\r"):
+        line = line[:-1]
+    stripped = line.strip()
+    if stripped == "" or stripped.startswith("#"):
+        return None
+    return line.split("#")[0].rstrip() if "#" in line else line
+
+
+def _index_wildcards_lines(full_path: Path) -> Optional[tuple[array, str, bool]]:
+    """
+    Index the offsets of the choices of a plain text wildcards file, reading it line by line.
+
+    Args:
+        full_path (Path): The path to the file.
+
+    Returns:
+        Optional[tuple[array, str, bool]]: The offsets, the hash of the file and whether it was not utf-8, or None if
+            the file has choice options, wildcard options or old Mac line breaks.
+    """
+    for encoding in ("utf-8", "windows-1252"):
+        offsets = array("Q")
+        sha256 = hashlib.sha256()
+        offset = 0
+        try:
+            with open(full_path, "rb") as file:
+                for raw_line in file:
+                    sha256.update(raw_line)
+                    line = _clean_wildcards_line(raw_line, encoding)
+                    if line is not None:
+                        if "::" in line or "\r" in line or (not offsets and line.endswith("$$")):
+                            return None
+                        offsets.append(offset)
+                    offset += len(raw_line)
+        except UnicodeDecodeError:
+            continue
+        return offsets, sha256.hexdigest(), encoding != "utf-8"
+    return None
+
+
+class PPPWildcardLines:
+    """
+    The choices of a large plain text wildcards file, which are read from the file when needed.
+
+    It behaves as a read-only list of the choices. The offsets of the lines are stored in a file in the cache folder, or
+    kept in memory if there is none (4 bytes per line for files under 4 GB), so only the requested lines are read.
+    The files are opened on the first read and kept open until the lines are closed.
+
+    Attributes:
+        file (Path): The path to the wildcards file.
+        digest (str): The hash of the wildcards file.
+        encoding (str): The encoding of the wildcards file.
+    """
+
+    __slots__ = ("file", "digest", "encoding", "__count", "__offsets", "__index_file", "__handles", "__lock")
+
+    # magic, size, modification time, hash, not utf-8, number of lines
+    INDEX_HEADER = struct.Struct("<8sqq64s?q")
+    INDEX_MAGIC = b"PPPLINES"
+
+    def __init__(self, full_path: Path, digest: str, not_utf8: bool, offsets: array | Path):
+        """
+        Initializes the lines.
+
+        Args:
+            full_path (Path): The path to the wildcards file.
+            digest (str): The hash of the wildcards file.
+            not_utf8 (bool): Whether the file is not utf-8.
+            offsets (array | Path): The offsets of the lines, or the file where they are stored.
+        """
+        self.file = full_path
+        self.digest = digest
+        self.encoding = "windows-1252" if not_utf8 else "utf-8"
+        if isinstance(offsets, array):
+            self.__offsets = offsets
+            self.__index_file = None
+            self.__count = len(offsets)
+        else:
+            self.__offsets = None
+            self.__index_file = offsets
+            self.__count = (offsets.stat().st_size - self.INDEX_HEADER.size) // 8
+        # the open wildcards and index files, shared by the threads that read the lines
+        self.__handles: Optional[tuple[Any, Any]] = None
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls, full_path: Path, index_file: Optional[Path]) -> Optional["PPPWildcardLines"]:
+        """
+        Get the lines of a file, from the stored index if it is still valid or else indexing the file.
+
+        Args:
+            full_path (Path): The path to the wildcards file.
+            index_file (Optional[Path]): The file where the index is stored, or None to keep it in memory.
+
+        Returns:
+            Optional[PPPWildcardLines]: The lines, or None if the file is not a plain list of choices.
+        """
+        st = full_path.stat()
+        if index_file is not None and index_file.is_file():
+            with open(index_file, "rb") as f:
+                header = f.read(cls.INDEX_HEADER.size)
+            if len(header) == cls.INDEX_HEADER.size:
+                magic, size, mtime_ns, digest, not_utf8, count = cls.INDEX_HEADER.unpack(header)
+                if magic == cls.INDEX_MAGIC and size == st.st_size and mtime_ns == st.st_mtime_ns:
+                    if count < 0:
+                        return None  # not a plain list
+                    return cls(full_path, digest.decode("ascii"), not_utf8, index_file)
+        indexed = _index_wildcards_lines(full_path)
+        if index_file is not None:
+            if indexed is None:
+                header = cls.INDEX_HEADER.pack(cls.INDEX_MAGIC, st.st_size, st.st_mtime_ns, b"", False, -1)
+                write_file_atomically(index_file, header)
+                return None
+            offsets, digest, not_utf8 = indexed
+            header = cls.INDEX_HEADER.pack(
+                cls.INDEX_MAGIC, st.st_size, st.st_mtime_ns, digest.encode("ascii"), not_utf8, len(offsets)
+            )
+            write_file_atomically(index_file, header + offsets.tobytes())
+            return cls(full_path, digest, not_utf8, index_file)
+        if indexed is None:
+            return None
+        offsets, digest, not_utf8 = indexed
+        if st.st_size < 2**32:
+            offsets = array("I", offsets)  # half the memory, since it is kept there
+        return cls(full_path, digest, not_utf8, offsets)
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __getitem__(self, i: int | slice) -> str | list[str]:
+        if isinstance(i, slice):
+            return list(islice(self, *i.indices(self.__count)))
+        if i < 0:
+            i += self.__count
+        if not 0 <= i < self.__count:
+            raise IndexError("line index out of range")
+        with self.__lock:
+            if self.__handles is None:
+                index_handle = open(self.__index_file, "rb") if self.__index_file is not None else None
+                self.__handles = (open(self.file, "rb"), index_handle)
+            file_handle, index_handle = self.__handles
+            if self.__offsets is not None:
+                offset = self.__offsets[i]
+            else:
+                index_handle.seek(self.INDEX_HEADER.size + 8 * i)
+                offset = array("Q", index_handle.read(8))[0]
+            file_handle.seek(offset)
+            raw_line = file_handle.readline()
+        return _clean_wildcards_line(raw_line, self.encoding)
+
+    def __iter__(self):
+        with open(self.file, "rb") as f:
+            for raw_line in f:
+                line = _clean_wildcards_line(raw_line, self.encoding)
+                if line is not None:
+                    yield line
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def close(self):
+        """
+        Close the files opened to read the lines. They are opened again if more lines are read.
+        """
+        with self.__lock:
+            if self.__handles is not None:
+                for handle in self.__handles:
+                    if handle is not None:
+                        handle.close()
+                self.__handles = None
 
 
 class PPPWildcard:
@@ -16,21 +269,45 @@ class PPPWildcard:
     Attributes:
         key (str): The key of the wildcard.
         file (Path | None): The path to the file where the wildcard is defined, or None if from inline input.
-        unprocessed_choices (list[str]): The unprocessed choices of the wildcard.
+        unprocessed_choices (list[str]): The unprocessed choices of the wildcard, or None once they are processed.
+        digest (int): The hash of the key and the unprocessed choices.
         options (dict): The options of the wildcard.
         choices (list[dict]): The processed choices of the wildcard.
+        sampling (Any): The table to sample the choices, False if they can't be sampled with it, or None if not built.
+        labels (dict[str, tuple[int, ...]]): The positions of the processed choices with each label.
+        filters (dict[tuple, tuple[int, ...]]): The positions of the processed choices that pass each used filter.
+        included (tuple): The processed choices with the included choices, with the keys of the included wildcards and
+            the content digest of the wildcards when they were obtained.
     """
 
+    __slots__ = (
+        "key",
+        "file",
+        "unprocessed_choices",
+        "digest",
+        "choices",
+        "options",
+        "sampling",
+        "labels",
+        "filters",
+        "included",
+    )
+
     def __init__(self, fullpath: Path | None, key: str, choices: list[str]):
-        self.key: str = key
+        self.key: str = sys.intern(key)
         self.file: Path | None = fullpath
         self.unprocessed_choices: list[str] = choices
+        # computed now, since the unprocessed choices are released when they are processed
+        self.digest: int = hash((self.key, deep_freeze(choices)))
         self.choices: list[dict] = None
         self.options: dict = None
+        self.sampling: Any = None
+        self.labels: Any = None
+        self.filters: dict[tuple, tuple[int, ...]] = None
+        self.included: tuple = None
 
     def __hash__(self) -> int:
-        t = (self.key, deep_freeze(self.unprocessed_choices))
-        return hash(t)
+        return self.digest
 
     def __sizeof__(self):
         return (
@@ -39,6 +316,10 @@ class PPPWildcard:
             + self.unprocessed_choices.__sizeof__()
             + self.choices.__sizeof__()
             + self.options.__sizeof__()
+            + self.sampling.__sizeof__()
+            + self.labels.__sizeof__()
+            + self.filters.__sizeof__()
+            + self.included.__sizeof__()
         )
 
 
@@ -51,22 +332,89 @@ class PPPWildcards:
     """
 
     DEFAULT_WILDCARDS_FOLDER = "wildcards"
+    KEYS_MATCHES_CACHE_SIZE = 1024
+    PARALLEL_LOAD_MIN_FILES = 16
+    MAX_LOAD_WORKERS = 16
+    GLOB_CHARS = re.compile(r"[*?[]")
+    # text files from this size are read only when their choices are needed
+    LINES_INDEX_MIN_SIZE = 1024 * 1024
 
-    def __init__(self, logger=None):
+    def __init__(
+        self,
+        logger=None,
+        cache_folder: Optional[Path] = WILDCARDS_CACHE_FOLDER,
+        watch_folders: bool = False,
+        load_processes: int = 0,
+        max_parsed_files: int = 0,
+        lazy_load: bool = False,
+        lines_index: bool = False,
+        warmup_threads: int = 0,
+    ):
         self.__logger: logging.Logger = logger
         self.__debug_level = DEBUG_LEVEL.none
+        self.__cache_folder = cache_folder
         self.__wildcards_folders: list[Path] = []
         self.__wildcard_files: dict[Path, float] = {}
+        self.__wildcard_files_bases: dict[Path, Path] = {}
+        self.__folder_scanner = PPPFolderScanner()
+        self.__watch_folders = watch_folders
+        self.__folder_watcher: Optional[PPPFolderWatcher] = None
+        self.__prefetched_files: dict[Path, tuple[float, object, str]] = {}
+        self.__load_processes = load_processes
+        self.__prefetched_files_lock = threading.Lock()
+        self.__wildcard_files_hashes: dict[Path, str] = {}
+        self.__parsed_choices: dict[Path | None, dict[tuple[str, str, str], Any]] = {}
+        self.__parsed_choices_changed: set[Path] = set()
+        self.__parsed_choices_lock = threading.Lock()
+        # files whose parsed choices can be in the cache folder but are not loaded yet
+        self.__parsed_choices_not_loaded: set[Path] = set()
+        self.__max_parsed_files = max_parsed_files
+        self.__used_files: OrderedDict[Path, None] = OrderedDict()
+        # files whose wildcards were released without their unprocessed choices, read again when they are used
+        self.__released_files: set[Path] = set()
+        self.__warmup: Optional[PPPWildcardsWarmup] = None
+        self.__warmup_pending = False
+        # the warm-up started by the refresh, with the function that initializes a copy of a wildcard
+        self.__warmup_threads = warmup_threads
+        self.__warmup_initializer: Optional[Callable[[PPPWildcard], Optional[PPPWildcard]]] = None
+        # the warm-up threads replace the wildcards with their initialized copies
+        self.__wildcards_lock = threading.Lock()
         self.__local_input_hash: int | None = None
         self.__wildcard_default_filters: dict[str, list[list[str]]] = {}
+        self.__keys_by_file: dict[Path | None, set[str]] = {}
+        # with lazy loading, the files that have only been indexed (base path, modification time and keys) and the
+        # file of each of those keys
+        self.__lazy_load = lazy_load
+        self.__lazy_files: dict[Path, tuple[Path, float, list[str]]] = {}
+        self.__lazy_keys: dict[str, Path] = {}
+        self.__indexed_keys: Optional[dict[Path, tuple[float, list[str]]]] = None
+        self.__indexed_keys_changed = False
+        # whether the large text files are indexed by lines instead of loaded
+        self.__lines_index = lines_index
+        self.__keys_index: Optional[tuple[list[str], list[str]]] = None
+        self.__keys_matches = PPPLRUCache(self.KEYS_MATCHES_CACHE_SIZE)
+        # sum (modulo 2**64) of the hashes of the loaded wildcards, updated as they are added or removed
+        self.__content_digest = 0
         self.wildcards: dict[str, PPPWildcard] = {}
 
     def __hash__(self) -> int:
-        return hash(deep_freeze(self.wildcards))
+        return self.__content_digest
 
     def __sizeof__(self):
         return self.wildcards.__sizeof__() + self.__wildcards_folders.__sizeof__() + self.__wildcard_files.__sizeof__()
 
+    def get_memory_usage(self) -> dict[str, int]:
+        """
+        Calculate the memory used by the wildcards, including everything they reference.
+
+        Returns:
+            dict[str, int]: The size in bytes of the parsed choices and of the rest of the wildcards.
+        """
+        seen = set()
+        with self.__parsed_choices_lock:
+            parsed_size = deep_sizeof(self.__parsed_choices, seen)
+        return {"parsed_choices": parsed_size, "wildcards": deep_sizeof(self.wildcards, seen)}
+
     def refresh_wildcards(
         self,
         debug_level: DEBUG_LEVEL,
@@ -81,26 +429,109 @@ class PPPWildcards:
         self.__wildcards_folders = [Path(f) for f in (wildcards_folders or [])]
         # log(self.__logger, self.__debug_level, logging.INFO, "Refreshing wildcards...")
         # t1 = time.monotonic_ns()
-        for fullpath in list(self.__wildcard_files.keys()):
-            if not fullpath.exists() or not any(
-                fullpath.parent.is_relative_to(folder) for folder in self.__wildcards_folders
-            ):
-                self.__remove_wildcards_from_path(fullpath)
+        scanned_paths = None
+        changed_files = self.__check_folder_watcher()
+        if changed_files is None or changed_files:
+            if changed_files is None:
+                scanned_paths = self.__folder_scanner.scan(self.__wildcards_folders)
+                checked_files = list(chain(self.__wildcard_files.keys(), self.__lazy_files.keys()))
+            else:
+                # only the files changed since the previous refresh are checked
+                scanned_paths = self.__folder_scanner.scan_changes(self.__wildcards_folders, changed_files)
+                checked_files = changed_files
+            found_files = set()
+            for _, files in scanned_paths:
+                found_files.update(files or ())
+            for fullpath in checked_files:
+                if fullpath not in found_files and (fullpath in self.__wildcard_files or fullpath in self.__lazy_files):
+                    self.__remove_wildcards_from_path(fullpath)
         if wildcards_input is None and self.__local_input_hash is not None:
             self.__remove_wildcards_from_input()
         if wildcards_folders is not None or wildcards_input is not None:
-            if wildcards_folders is not None:
-                for f in self.__wildcards_folders:
-                    self.__get_wildcards_in_path(f if f.is_dir() else f.parent, f)
+            if scanned_paths is not None:
+                self.__read_files_in_parallel({f: m for _, files in scanned_paths for f, m in (files or {}).items()})
+                for path, files in scanned_paths:
+                    self.__get_wildcards_in_path(path, files)
+                with self.__prefetched_files_lock:
+                    self.__prefetched_files.clear()
+                self.__save_indexed_keys()
             if wildcards_input is not None:
                 self.__get_wildcards_in_input(wildcards_input)
         else:
             self.wildcards = {}
-            self.__wildcard_files = {}
+            self.__content_digest = 0
+            self.__keys_by_file = {}
+            self.__lazy_files = {}
+            self.__lazy_keys = {}
+            self.__wildcards_changed()
+            self.__wildcard_files_bases = {}
+            with self.__parsed_choices_lock:
+                self.__wildcard_files = {}
+                self.__wildcard_files_hashes = {}
+                self.__parsed_choices = {}
+                self.__parsed_choices_changed = set()
+                self.__parsed_choices_not_loaded = set()
+            self.__used_files.clear()
+            self.__released_files = set()
             self.__local_input_hash = None
+        if self.__warmup_threads > 0 and self.__warmup_initializer is not None:
+            # the new or changed wildcards are initialized in the background
+            self.start_warmup(self.__warmup_initializer, self.__warmup_threads)
         # t2 = time.monotonic_ns()
         # log(self.__logger, self.__debug_level, logging.INFO, f"Wildcards refresh time: {(t2 - t1) / 1_000_000_000:.3f} seconds")
 
+    def __check_folder_watcher(self) -> Optional[set[Path]]:
+        """
+        Start, restart or stop the folder watcher as needed, and check what must be scanned.
+
+        Returns:
+            Optional[set[Path]]: The files changed since the previous refresh, or None if the folders must be scanned.
+        """
+        if not self.__watch_folders or not self.__wildcards_folders:
+            if self.__folder_watcher is not None:
+                self.__folder_watcher.stop()
+                self.__folder_watcher = None
+            return None
+        if self.__folder_watcher is not None and self.__folder_watcher.is_watching(self.__wildcards_folders):
+            return self.__folder_watcher.take_changes()
+        if self.__folder_watcher is not None:
+            self.__folder_watcher.stop()
+        self.__folder_watcher = PPPFolderWatcher(self.__wildcards_folders, self.__prefetch_files)
+        log(
+            self.__logger,
+            self.__debug_level,
+            logging.DEBUG,
+            lambda: f"Watching wildcard folders with {self.__folder_watcher.backend}",
+        )
+        return None
+
+    def __prefetch_files(self, changed_files: Optional[set[Path]]):
+        """
+        Read the changed wildcard files in the background, so the next refresh does not have to.
+
+        Args:
+            changed_files (Optional[set[Path]]): The changed files, or None if they are not known.
+        """
+        for full_path in changed_files or ():
+            if full_path.suffix not in WILDCARDS_FILE_EXTENSIONS or self.__is_large_text_file(full_path):
+                continue
+            try:
+                last_modified = full_path.stat().st_mtime
+                content, digest = self.__read_wildcards_file(full_path)
+            except Exception:  # pylint: disable=broad-except
+                continue  # the error will be reported by the refresh
+            with self.__prefetched_files_lock:
+                self.__prefetched_files[full_path] = (last_modified, content, digest)
+
+    def stop_watching(self):
+        """
+        Stop watching the wildcard folders.
+        """
+        self.__watch_folders = False
+        if self.__folder_watcher is not None:
+            self.__folder_watcher.stop()
+            self.__folder_watcher = None
+
     def get_wildcards(self, key: str) -> list[PPPWildcard]:
         """
         Get all wildcards that match a key.
@@ -111,8 +542,83 @@ class PPPWildcards:
         Returns:
             list: A list of all wildcards that match the key.
         """
-        keys = sorted(fnmatch.filter(self.wildcards.keys(), key))
-        return [self.wildcards[k] for k in keys]
+        keys = self.__keys_matches.get(key)
+        if keys is None:
+            keys = self.__match_keys(key)
+            self.__keys_matches.put(key, keys)
+        if self.__lazy_keys:
+            lazy_files = {self.__lazy_keys[k] for k in keys if k in self.__lazy_keys}
+            if lazy_files:
+                for full_path in sorted(lazy_files):
+                    base, last_modified, _ = self.__lazy_files[full_path]
+                    log(
+                        self.__logger,
+                        self.__debug_level,
+                        logging.DEBUG,
+                        lambda: f"Loading wildcards from file on first use: {full_path}",
+                    )
+                    self.__get_wildcards_in_file(base, full_path, last_modified)
+                self.__save_indexed_keys()
+                keys = self.__match_keys(key)
+                self.__keys_matches.put(key, keys)
+        wildcards = [self.wildcards[k] for k in keys if k in self.wildcards]
+        if self.__released_files:
+            released_files = {wc.file for wc in wildcards if wc.file in self.__released_files}
+            if released_files:
+                for full_path in sorted(released_files):
+                    log(
+                        self.__logger,
+                        self.__debug_level,
+                        logging.DEBUG,
+                        lambda: f"Reloading released wildcards from file: {full_path}",
+                    )
+                    with self.__parsed_choices_lock:
+                        last_modified = self.__wildcard_files.pop(full_path)
+                    self.__get_wildcards_in_file(self.__wildcard_files_bases[full_path], full_path, last_modified)
+                wildcards = [self.wildcards[k] for k in keys if k in self.wildcards]
+        if self.__max_parsed_files > 0:
+            for wc in wildcards:
+                if wc.file is not None:
+                    self.__used_files[wc.file] = None
+                    self.__used_files.move_to_end(wc.file)
+        return wildcards
+
+    def __match_keys(self, key: str) -> list[str]:
+        """
+        Get the sorted keys of the wildcards that match a key, with the same rules as fnmatch.
+
+        The keys are looked up in a sorted index, so only those that start with the text before the first glob
+        character of the key are compared.
+
+        Args:
+            key (str): The key to match.
+
+        Returns:
+            list[str]: The matching keys.
+        """
+        if self.__keys_index is None:
+            index = sorted((os.path.normcase(k), k) for k in chain(self.wildcards, self.__lazy_keys))
+            self.__keys_index = ([k for k, _ in index], [k for _, k in index])
+        norm_keys, keys = self.__keys_index
+        norm_key = os.path.normcase(key)
+        m = self.GLOB_CHARS.search(norm_key)
+        prefix = norm_key if m is None else norm_key[: m.start()]
+        matcher = None if m is None else re.compile(fnmatch.translate(norm_key)).match
+        matches = []
+        for i in range(bisect_left(norm_keys, prefix), len(norm_keys)):
+            nk = norm_keys[i]
+            if not nk.startswith(prefix) or (matcher is None and nk != norm_key):
+                break
+            if matcher is None or matcher(nk):
+                matches.append(keys[i])
+        return sorted(matches)
+
+    def __wildcards_changed(self):
+        """
+        Invalidate the keys index and the matches cache after adding or removing wildcards.
+        """
+        self.__keys_index = None
+        self.__keys_matches = PPPLRUCache(self.KEYS_MATCHES_CACHE_SIZE)
 
     def __get_wc_in_dict(self, dictionary: dict, prefix="") -> list[tuple[str, Any]]:
         """
@@ -146,13 +652,26 @@ class PPPWildcards:
                 self.__logger,
                 self.__debug_level,
                 logging.DEBUG,
-                f"Removing from memory wildcards from file: {full_path}",
+                lambda: f"Removing from memory wildcards from file: {full_path}",
             )
-        if full_path in self.__wildcard_files:
-            del self.__wildcard_files[full_path]
-        for key in list(self.wildcards.keys()):
-            if self.wildcards[key].file == full_path:
-                del self.wildcards[key]
+        self.__wildcard_files_bases.pop(full_path, None)
+        self.__released_files.discard(full_path)
+        with self.__parsed_choices_lock:
+            self.__wildcard_files.pop(full_path, None)
+            self.__wildcard_files_hashes.pop(full_path, None)
+            self.__parsed_choices.pop(full_path, None)
+            self.__parsed_choices_changed.discard(full_path)
+            self.__parsed_choices_not_loaded.discard(full_path)
+        self.__used_files.pop(full_path, None)
+        for key in self.__keys_by_file.pop(full_path, ()):
+            self.__discard_wildcard(key)
+        lazy_file = self.__lazy_files.pop(full_path, None)
+        if lazy_file is not None:
+            self.__update_content_digest(hash((full_path, lazy_file[1])), False)
+            for key in lazy_file[2]:
+                if self.__lazy_keys.get(key) == full_path:
+                    del self.__lazy_keys[key]
+        self.__wildcards_changed()
 
     def __remove_wildcards_from_input(self, debug=True):
         """
@@ -164,34 +683,67 @@ class PPPWildcards:
         if debug and self.__local_input_hash is not None:
             log(self.__logger, self.__debug_level, logging.DEBUG, "Removing from memory wildcards from input")
         self.__local_input_hash = None
-        for key in list(self.wildcards.keys()):
-            if self.wildcards[key].file is None:
-                del self.wildcards[key]
+        with self.__parsed_choices_lock:
+            self.__parsed_choices.pop(None, None)
+        for key in self.__keys_by_file.pop(None, ()):
+            self.__discard_wildcard(key)
+        self.__wildcards_changed()
 
-    def __get_wildcards_in_file(self, base: Path, full_path: Path):
+    def __get_wildcards_in_file(self, base: Path, full_path: Path, last_modified: float, lazy: bool = False):
         """
         Get all wildcards in a file.
 
         Args:
             base (Path): The base path for the wildcards.
             full_path (Path): The path to the file.
+            last_modified (float): The modification time of the file.
+            lazy (bool): Whether to only index the keys of the file if possible, and load it when they are used.
         """
         try:
-            last_modified = full_path.stat().st_mtime
             last_modified_cached = self.__wildcard_files.get(full_path, None)
             if last_modified_cached is not None and last_modified == self.__wildcard_files[full_path]:
                 return
+            lazy_file = self.__lazy_files.get(full_path, None)
+            if lazy and lazy_file is not None and last_modified == lazy_file[1]:
+                return
             extension = full_path.suffix
-            if extension not in (".txt", ".json", ".yaml", ".yml"):
+            if extension not in WILDCARDS_FILE_EXTENSIONS:
                 return
             self.__remove_wildcards_from_path(full_path, False)
-            if last_modified_cached is not None:
-                log(self.__logger, self.__debug_level, logging.DEBUG, f"Updating wildcards from file: {full_path}")
-            if extension == ".txt":
-                self.__get_wildcards_in_text_file(full_path, base)
-            elif extension in (".json", ".yaml", ".yml"):
-                self.__get_wildcards_in_structured_file(full_path, base)
-            self.__wildcard_files[full_path] = last_modified
+            if last_modified_cached is not None or (lazy_file is not None and last_modified != lazy_file[1]):
+                log(
+                    self.__logger,
+                    self.__debug_level,
+                    logging.DEBUG,
+                    lambda: f"Updating wildcards from file: {full_path}",
+                )
+            if lazy and self.__index_wildcards_in_file(base, full_path, last_modified):
+                return
+            with self.__prefetched_files_lock:
+                prefetched = self.__prefetched_files.pop(full_path, None)
+            content = None
+            if self.__is_large_text_file(full_path):
+                content = PPPWildcardLines.load(full_path, self.__get_lines_index_file(full_path))
+            if content is not None:
+                digest = content.digest
+                if content.encoding != "utf-8":
+                    self.__log_not_utf8(full_path)
+            elif prefetched is not None and prefetched[0] == last_modified:
+                _, content, digest = prefetched
+            else:
+                content, digest = self.__read_wildcards_file(full_path)
+            external_key_parts = list(full_path.with_suffix("").relative_to(base).parts)
+            self.__add_wildcard(content, full_path, external_key_parts)
+            self.__wildcard_files_bases[full_path] = base
+            if self.__lazy_load and self.__cache_folder is not None and extension != ".txt":
+                self.__get_indexed_keys()[full_path] = (last_modified, sorted(self.__keys_by_file.get(full_path, ())))
+                self.__indexed_keys_changed = True
+            with self.__parsed_choices_lock:
+                self.__wildcard_files[full_path] = last_modified
+                if self.__cache_folder is not None:
+                    self.__wildcard_files_hashes[full_path] = digest
+                    # they are loaded when the file is used
+                    self.__parsed_choices_not_loaded.add(full_path)
         except Exception as e:  # pylint: disable=broad-except
             log(
                 self.__logger,
@@ -200,6 +752,100 @@ class PPPWildcards:
                 f"Error reading wildcard file '{escape_single_quotes(str(full_path))}': {e}",
             )
 
+    def __is_large_text_file(self, full_path: Path) -> bool:
+        """
+        Check if a file is a text file big enough to read its choices only when they are needed, if enabled.
+
+        Args:
+            full_path (Path): The path to the file.
+
+        Returns:
+            bool: Whether it is a large text file.
+        """
+        if not self.__lines_index:
+            return False
+        try:
+            return full_path.suffix == ".txt" and full_path.stat().st_size >= self.LINES_INDEX_MIN_SIZE
+        except OSError:
+            return False
+
+    def __get_lines_index_file(self, full_path: Path) -> Optional[Path]:
+        if self.__cache_folder is None:
+            return None
+        return self.__cache_folder / f"{hashlib.sha256(str(full_path).encode('utf-8')).hexdigest()[:32]}.lines"
+
+    def __index_wildcards_in_file(self, base: Path, full_path: Path, last_modified: float) -> bool:
+        """
+        Index the keys of a file without loading it, if they are known. The key of a text file comes from its path,
+        and the keys of a structured file are known if it was loaded before without changes.
+
+        Args:
+            base (Path): The base path for the wildcards.
+            full_path (Path): The path to the file.
+            last_modified (float): The modification time of the file.
+
+        Returns:
+            bool: Whether the file has been indexed.
+        """
+        if not self.__can_index_wildcards_in_file(full_path, last_modified):
+            return False
+        if full_path.suffix == ".txt":
+            keys = ["/".join(full_path.with_suffix("").relative_to(base).parts)]
+        else:
+            keys = self.__get_indexed_keys()[full_path][1]
+        # the keys already defined in other files are ignored, as when loading the file
+        keys = [k for k in keys if k not in self.wildcards and k not in self.__lazy_keys]
+        self.__lazy_files[full_path] = (base, last_modified, keys)
+        # the content is not known yet, so the file is identified by its modification time
+        self.__update_content_digest(hash((full_path, last_modified)), True)
+        for k in keys:
+            self.__lazy_keys[k] = full_path
+        self.__wildcards_changed()
+        return True
+
+    def __get_indexed_keys(self) -> dict[Path, tuple[float, list[str]]]:
+        """
+        Get the keys of the structured files loaded before, reading them from the cache folder the first time.
+
+        Returns:
+            dict[Path, tuple[float, list[str]]]: The modification time and the keys of each file.
+        """
+        if self.__indexed_keys is None:
+            self.__indexed_keys = {}
+            cache_file = self.__cache_folder / "keys.pickle"
+            if cache_file.is_file():
+                try:
+                    with open(cache_file, "rb") as f:
+                        self.__indexed_keys = pickle.load(f)
+                except Exception as e:  # pylint: disable=broad-except
+                    log(
+                        self.__logger,
+                        self.__debug_level,
+                        logging.WARNING,
+                        f"Failed to load cached wildcard keys: {e}",
+                    )
+        return self.__indexed_keys
+
+    def __save_indexed_keys(self):
+        """
+        Store in the cache folder the keys of the structured files, if they have changed.
+        """
+        if not self.__indexed_keys_changed:
+            return
+        self.__indexed_keys_changed = False
+        try:
+            known_files = set(chain(self.__wildcard_files.keys(), self.__lazy_files.keys()))
+            indexed_keys = {f: v for f, v in self.__indexed_keys.items() if f in known_files}
+            data = pickle.dumps(indexed_keys, protocol=pickle.HIGHEST_PROTOCOL)
+            write_file_atomically(self.__cache_folder / "keys.pickle", data)
+        except Exception as e:  # pylint: disable=broad-except
+            log(
+                self.__logger,
+                self.__debug_level,
+                logging.WARNING,
+                f"Failed to save cached wildcard keys: {e}",
+            )
+
     def __get_wildcards_in_input(self, wildcards_input: str):
         """
         Get all wildcards in the string.
@@ -218,7 +864,7 @@ class PPPWildcards:
             wildcards_input = wildcards_input.strip()
             if wildcards_input != "":
                 try:
-                    content = _YAML(typ='safe').load(wildcards_input)
+                    content = load_structured_text(wildcards_input)
                 except _YAMLError as e:
                     log(self.__logger, self.__debug_level, logging.WARNING, f"Invalid format for input wildcards: {e}")
                     return
@@ -284,10 +930,14 @@ class PPPWildcards:
         """
         if obj is None:
             return None
-        if isinstance(obj, (str, dict)):
+        if isinstance(obj, PPPWildcardLines):
+            return obj if len(obj) > 0 else None
+        if isinstance(obj, str):
+            return [sys.intern(obj)]
+        if isinstance(obj, dict):
             return [obj]
         if isinstance(obj, (int, float, bool)):
-            return [str(obj)]
+            return [sys.intern(str(obj))]
         file_str = str(full_path) if full_path is not None else "input"
         if not isinstance(obj, list) or len(obj) == 0:
             log(
@@ -300,7 +950,8 @@ class PPPWildcards:
         choices = []
         for i, c in enumerate(obj):
             if isinstance(c, (str, int, float, bool)):
-                choices.append(str(c))
+                # the same texts are usually repeated in many wildcards
+                choices.append(sys.intern(str(c)))
             elif isinstance(c, list):
                 # we create an anonymous wildcard
                 choices.append(self.__create_anonymous_wildcard(full_path, key_parts, i, c))
@@ -383,11 +1034,9 @@ class PPPWildcards:
             full_path (Path | None): The path to the file that contains it, or None if from inline input.
             external_key_parts (list[str]): The parts of the key.
         """
+        self.__warmup_pending = True
+        self.__wildcards_changed()
         file_str = str(full_path) if full_path is not None else "input"
-
-        def existing_file_str(wc):
-            return str(wc.file) if wc.file is not None else "input"
-
         key_parts = external_key_parts.copy()
         if isinstance(content, dict):
             key_parts.pop()
@@ -396,12 +1045,13 @@ class PPPWildcards:
                 tmp_key_parts = key_parts.copy()
                 tmp_key_parts.extend(key.split("/"))
                 fullkey = "/".join(tmp_key_parts)
-                if self.wildcards.get(fullkey, None) is not None:
+                existing_file_str = self.__get_defining_file(fullkey, full_path)
+                if existing_file_str is not None:
                     log(
                         self.__logger,
                         self.__debug_level,
                         logging.WARNING,
-                        f"Duplicate wildcard '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}' and '{escape_single_quotes(existing_file_str(self.wildcards[fullkey]))}'!",
+                        f"Duplicate wildcard '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}' and '{escape_single_quotes(existing_file_str)}'!",
                     )
                 else:
                     choices = self.__get_choices(obj, full_path, tmp_key_parts)
@@ -420,13 +1070,13 @@ class PPPWildcards:
                             f"Invalid wildcard name '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}'! (cannot start with underscore)",
                         )
                     else:
-                        self.wildcards[fullkey] = PPPWildcard(full_path, fullkey, choices)
+                        self.__store_wildcard(PPPWildcard(full_path, fullkey, choices))
             return
         if isinstance(content, str):
             content = [content]
         elif isinstance(content, (int, float, bool)):
             content = [str(content)]
-        if not isinstance(content, list):
+        if not isinstance(content, (list, PPPWildcardLines)):
             log(
                 self.__logger,
                 self.__debug_level,
@@ -435,12 +1085,13 @@ class PPPWildcards:
             )
             return
         fullkey = "/".join(key_parts)
-        if self.wildcards.get(fullkey, None) is not None:
+        existing_file_str = self.__get_defining_file(fullkey, full_path)
+        if existing_file_str is not None:
             log(
                 self.__logger,
                 self.__debug_level,
                 logging.WARNING,
-                f"Duplicate wildcard '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}' and '{escape_single_quotes(existing_file_str(self.wildcards[fullkey]))}'!",
+                f"Duplicate wildcard '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}' and '{escape_single_quotes(existing_file_str)}'!",
             )
         else:
             choices = self.__get_choices(content, full_path, key_parts)
@@ -459,81 +1110,476 @@ class PPPWildcards:
                     f"Invalid wildcard name '{escape_single_quotes(fullkey)}' in file '{escape_single_quotes(file_str)}'! (cannot start with underscore)",
                 )
             else:
-                self.wildcards[fullkey] = PPPWildcard(full_path, fullkey, choices)
+                self.__store_wildcard(PPPWildcard(full_path, fullkey, choices))
+
+    def __get_defining_file(self, key: str, full_path: Path | None) -> Optional[str]:
+        """
+        Get the file that already defines a key, so it is ignored in the file being loaded.
+
+        With lazy loading, a file indexed before the one being loaded keeps its keys even if it has not been loaded
+        yet, so the wildcards are the same as when all the files are loaded in order.
+
+        Args:
+            key (str): The key.
+            full_path (Path | None): The file being loaded, or None if from inline input.
+
+        Returns:
+            Optional[str]: The file that defines the key ("input" if from inline input), or None if there is none.
+        """
+        wildcard = self.wildcards.get(key, None)
+        if wildcard is not None:
+            return str(wildcard.file) if wildcard.file is not None else "input"
+        lazy_file = self.__lazy_keys.get(key, None)
+        if lazy_file is not None and lazy_file != full_path:
+            return str(lazy_file)
+        return None
 
-    def __get_wildcards_in_structured_file(self, full_path: Path, base: Path):
+    def __store_wildcard(self, wildcard: PPPWildcard):
         """
-        Get all wildcards in a structured file.
+        Store a new wildcard.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+        """
+        with self.__wildcards_lock:
+            self.wildcards[wildcard.key] = wildcard
+        self.__keys_by_file.setdefault(wildcard.file, set()).add(wildcard.key)
+        # it was indexed in its own file, which is now loaded
+        self.__lazy_keys.pop(wildcard.key, None)
+        self.__update_content_digest(hash(wildcard), True)
+
+    def __update_content_digest(self, value: int, added: bool):
+        """
+        Update the digest of the content with an added or removed hash.
+
+        A sum is used instead of a XOR, so equal hashes do not cancel each other.
+
+        Args:
+            value (int): The hash.
+            added (bool): Whether it is added or removed.
+        """
+        self.__content_digest = (self.__content_digest + (value if added else -value)) % (1 << 64)
+
+    def __discard_wildcard(self, key: str):
+        """
+        Remove a wildcard if it exists.
+
+        Args:
+            key (str): The key of the wildcard.
+        """
+        with self.__wildcards_lock:
+            wildcard = self.wildcards.pop(key, None)
+        if wildcard is not None:
+            self.__update_content_digest(hash(wildcard), False)
+            if isinstance(wildcard.unprocessed_choices, PPPWildcardLines):
+                wildcard.unprocessed_choices.close()
+
+    def __read_wildcards_file(self, full_path: Path) -> tuple[object, str]:
+        """
+        Read the content of a wildcards file.
 
         Args:
             full_path (Path): The path to the file.
-            base (Path): The base path for the wildcards.
+
+        Returns:
+            tuple[object, str]: The content of the file and its hash.
         """
-        external_key_parts = list(full_path.with_suffix("").relative_to(base).parts)
-        try:
-            with open(full_path, "r", encoding="utf-8") as file:
-                content = _YAML(typ='safe').load(file)
-        except:  # pylint: disable=bare-except
+        content, digest, not_utf8 = _read_wildcards_file(full_path)
+        if not_utf8:
+            self.__log_not_utf8(full_path)
+        return content, digest
+
+    def __log_not_utf8(self, full_path: Path):
+        log(
+            self.__logger,
+            self.__debug_level,
+            logging.WARNING,
+            f"Could not read file '{escape_single_quotes(str(full_path))}' with utf-8 encoding, trying windows-1252...",
+        )
+
+    def __read_files_in_parallel(self, files: dict[Path, float]):
+        """
+        Read in parallel the wildcard files that have to be loaded, and leave them as prefetched files.
+
+        Text files are read in threads, and structured files in processes if enabled, since parsing them is mostly
+        Python code. The wildcards are then added in the usual order, so the result does not depend on the timing.
+
+        Args:
+            files (dict[Path, float]): The files found in the folders with their modification time.
+        """
+        with self.__prefetched_files_lock:
+            pending = [
+                f
+                for f, last_modified in files.items()
+                if f.suffix in WILDCARDS_FILE_EXTENSIONS
+                and self.__wildcard_files.get(f) != last_modified
+                and self.__prefetched_files.get(f, (None,))[0] != last_modified
+                and not (self.__lazy_load and self.__can_index_wildcards_in_file(f, last_modified))
+                and not self.__is_large_text_file(f)
+            ]
+        max_workers = min(os.cpu_count() or 1, self.MAX_LOAD_WORKERS)
+        if len(pending) < self.PARALLEL_LOAD_MIN_FILES or max_workers < 2:
+            return
+        structured_files = [f for f in pending if f.suffix != ".txt"]
+        futures: dict[Path, Future] = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ppp_load") as threads:
+            if self.__load_processes > 1 and len(structured_files) >= self.PARALLEL_LOAD_MIN_FILES:
+                try:
+                    # spawned processes, since forking a process with other threads running is not safe
+                    with ProcessPoolExecutor(
+                        max_workers=self.__load_processes, mp_context=multiprocessing.get_context("spawn")
+                    ) as processes:
+                        for f in structured_files:
+                            futures[f] = processes.submit(_read_wildcards_file, f)
+                        for f in pending:
+                            if f not in futures:
+                                futures[f] = threads.submit(_read_wildcards_file, f)
+                        wait_futures(futures.values())
+                    errors = [v.exception() for v in futures.values() if isinstance(v.exception(), BrokenExecutor)]
+                    error = errors[0] if errors else None
+                except Exception as e:  # pylint: disable=broad-except
+                    error = e
+                if error is not None:
+                    log(
+                        self.__logger,
+                        self.__debug_level,
+                        logging.WARNING,
+                        f"Could not read the wildcard files in other processes, using threads: {error}",
+                    )
+                    futures = {f: v for f, v in futures.items() if v.done() and v.exception() is None}
+            for f in pending:
+                if f not in futures:
+                    futures[f] = threads.submit(_read_wildcards_file, f)
+        prefetched_files = {}
+        for f, future in futures.items():
+            if future.exception() is not None:
+                continue  # the error will be reported when the file is loaded
+            content, digest, not_utf8 = future.result()
+            if not_utf8:
+                self.__log_not_utf8(f)
+            prefetched_files[f] = (files[f], content, digest)
+        with self.__prefetched_files_lock:
+            self.__prefetched_files.update(prefetched_files)
+
+    def __can_index_wildcards_in_file(self, full_path: Path, last_modified: float) -> bool:
+        """
+        Check if the keys of a file can be indexed without reading it.
+
+        Args:
+            full_path (Path): The path to the file.
+            last_modified (float): The modification time of the file.
+
+        Returns:
+            bool: Whether the file can be indexed.
+        """
+        if full_path.suffix == ".txt":
+            return True
+        if self.__cache_folder is None:
+            return False
+        indexed = self.__get_indexed_keys().get(full_path, None)
+        return indexed is not None and indexed[0] == last_modified
+
+    def __get_wildcards_in_path(self, path: Path, files: dict[Path, float] | None):
+        """
+        Get all wildcards in a path.
+
+        Args:
+            path (Path): The path (folder or file).
+            files (dict[Path, float] | None): The files found in the path with their modification time, or None if
+                the path does not exist.
+        """
+        if files is None:
             log(
                 self.__logger,
                 self.__debug_level,
                 logging.WARNING,
-                f"Could not read file '{escape_single_quotes(str(full_path))}' with utf-8 encoding, trying windows-1252...",
+                f"Wildcard path '{escape_single_quotes(str(path))}' does not exist!",
             )
-            with open(full_path, "r", encoding="windows-1252") as file:
-                content = _YAML(typ='safe').load(file)
-        self.__add_wildcard(content, full_path, external_key_parts)
+            return
+        base = path.parent if path in files else path
+        for full_path, last_modified in files.items():
+            self.__get_wildcards_in_file(base, full_path, last_modified, self.__lazy_load)
 
-    def __get_wildcards_in_text_file(self, full_path: Path, base: Path):
+    def __get_parsed_choices_cache_file(self, full_path: Path) -> Path:
+        return self.__cache_folder / f"{hashlib.sha256(str(full_path).encode('utf-8')).hexdigest()[:32]}.pickle"
+
+    def __get_parsed_choices_cache_info(self, full_path: Path) -> Optional[dict]:
         """
-        Get all wildcards in a text file.
+        Get the information that identifies the parsed choices of a file in the cache. It must be called with the
+        parsed choices lock held, since the warm-up threads call it too.
 
         Args:
             full_path (Path): The path to the file.
-            base (Path): The base path for the wildcards.
+
+        Returns:
+            Optional[dict]: The information, or None if the file is not loaded.
         """
-        external_key_parts = list(full_path.with_suffix("").relative_to(base).parts)
+        last_modified = self.__wildcard_files.get(full_path, None)
+        digest = self.__wildcard_files_hashes.get(full_path, None)
+        if last_modified is None or digest is None:
+            return None
+        return {
+            "file": str(full_path),
+            "mtime": last_modified,
+            "hash": digest,
+            "lark": lark.__version__,
+            "python": f"{sys.version_info[0]}.{sys.version_info[1]}",
+        }
+
+    def __load_parsed_choices(self, full_path: Path, info: dict):
+        """
+        Load the parsed choices of a file from the cache, if they are still valid.
+
+        Args:
+            full_path (Path): The path to the file.
+            info (dict): The information of the file when the loading was requested.
+        """
+        cache_file = self.__get_parsed_choices_cache_file(full_path)
+        if not cache_file.is_file():
+            return
         try:
-            with open(full_path, "r", encoding="utf-8") as file:
-                text_content = map(lambda x: x.strip("\n\r"), file.readlines())
-        except:  # pylint: disable=bare-except
+            with open(cache_file, "rb") as f:
+                data = pickle.load(f)
+            if data["info"] == info:
+                with self.__parsed_choices_lock:
+                    if self.__get_parsed_choices_cache_info(full_path) != info:
+                        return  # the file has been removed or changed in the meantime
+                    # the texts parsed in the meantime are kept
+                    data["parsed"].update(self.__parsed_choices.get(full_path, {}))
+                    self.__parsed_choices[full_path] = data["parsed"]
+        except Exception as e:  # pylint: disable=broad-except
             log(
                 self.__logger,
                 self.__debug_level,
                 logging.WARNING,
-                f"Could not read file '{escape_single_quotes(str(full_path))}' with utf-8 encoding, trying windows-1252...",
+                f"Failed to load cached choices for wildcard file '{escape_single_quotes(str(full_path))}': {e}",
             )
-            with open(full_path, "r", encoding="windows-1252") as file:
-                text_content = map(lambda x: x.strip("\n\r"), file.readlines())
-        # First pass: drop blank lines and full-line comments.
-        text_content = list(filter(lambda x: x.strip() != "" and not x.strip().startswith("#"), text_content))
-        # Second pass: strip inline comments from lines that passed the first filter.
-        text_content = [x.split("#")[0].rstrip() if len(x.split("#")) > 1 else x for x in text_content]
-        self.__add_wildcard(text_content, full_path, external_key_parts)
 
-    def __get_wildcards_in_path(self, base: Path, path: Path):
+    def __check_parsed_choices_loaded(self, full_path: Path | None):
         """
-        Get all wildcards in a path.
+        Load the parsed choices of a file from the cache if they have not been loaded yet.
 
         Args:
-            base (Path): The base path for the wildcards.
-            path (Path): The path (folder or file).
+            full_path (Path | None): The path to the file.
+        """
+        with self.__parsed_choices_lock:
+            if full_path not in self.__parsed_choices_not_loaded:
+                return
+            self.__parsed_choices_not_loaded.discard(full_path)
+            info = self.__get_parsed_choices_cache_info(full_path)
+        if info is not None:
+            self.__load_parsed_choices(full_path, info)
+
+    def release_parsed_choices(self, full_paths: Optional[Iterable[Path]] = None):
         """
-        if not path.exists():
+        Release from memory the parsed choices of some files. The wildcards of those files are initialized again when
+        they are used, with the parsed choices stored in the cache if available. If their unprocessed choices were
+        released too, the files are read again then.
+
+        Args:
+            full_paths (Optional[Iterable[Path]]): The files, or None for all of them.
+        """
+        self.save_parsed_choices()
+        with self.__parsed_choices_lock:
+            if full_paths is None:
+                full_paths = [f for f in self.__parsed_choices.keys() if f is not None]
+            full_paths = [f for f in full_paths if f in self.__wildcard_files]
+            for full_path in full_paths:
+                self.__parsed_choices.pop(full_path, None)
+                if self.__cache_folder is not None:
+                    self.__parsed_choices_not_loaded.add(full_path)
+        for full_path in full_paths:
+            keys = self.__keys_by_file.get(full_path, ())
+            if any(self.wildcards[key].unprocessed_choices is None for key in keys):
+                # only the processed choices were kept, so the file is read again on its next use
+                self.__released_files.add(full_path)
+            for key in keys:
+                wildcard = self.wildcards[key]
+                wildcard.choices = None
+                wildcard.options = None
+                wildcard.sampling = None
+                wildcard.labels = None
+                wildcard.filters = None
+                wildcard.included = None
+        if full_paths:
             log(
                 self.__logger,
                 self.__debug_level,
-                logging.WARNING,
-                f"Wildcard path '{escape_single_quotes(str(path))}' does not exist!",
+                logging.DEBUG,
+                lambda: f"Released the parsed choices of {len(full_paths)} wildcard files",
             )
+
+    def release_unprocessed_choices(self, wildcard: PPPWildcard):
+        """
+        Release from memory the unprocessed choices of a wildcard that has been initialized, if they can be read again.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+        """
+        if wildcard.choices is None or not isinstance(wildcard.unprocessed_choices, list):
+            return
+        if wildcard.file is None or wildcard.file in self.__wildcard_files_bases:
+            wildcard.unprocessed_choices = None
+
+    def trim_parsed_choices(self):
+        """
+        Release the parsed choices of the least recently used files over the configured limit, if any.
+        """
+        if self.__max_parsed_files <= 0:
             return
-        if path.is_file():
-            self.__get_wildcards_in_file(base, path)
+        with self.__parsed_choices_lock:
+            parsed_files = [f for f in self.__parsed_choices.keys() if f is not None]
+        if len(parsed_files) <= self.__max_parsed_files:
             return
-        for child in path.iterdir():
-            if child.name.startswith("."):
-                continue
-            self.__get_wildcards_in_path(base, child)
+        # the files that have not been used go first
+        order = {f: i for i, f in enumerate(self.__used_files.keys())}
+        parsed_files.sort(key=lambda f: order.get(f, -1))
+        self.release_parsed_choices(parsed_files[: len(parsed_files) - self.__max_parsed_files])
+
+    def save_parsed_choices(self):
+        """
+        Store in the cache the parsed choices of the files that have new ones.
+        """
+        with self.__parsed_choices_lock:
+            changed = {
+                full_path: (self.__get_parsed_choices_cache_info(full_path), self.__parsed_choices[full_path].copy())
+                for full_path in self.__parsed_choices_changed
+                if full_path in self.__wildcard_files_hashes and full_path in self.__parsed_choices
+            }
+            self.__parsed_choices_changed.clear()
+        for full_path, (info, parsed) in changed.items():
+            cache_file = self.__get_parsed_choices_cache_file(full_path)
+            try:
+                data = {
+                    "info": info,
+                    "parsed": parsed,
+                }
+                write_file_atomically(cache_file, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+                log(
+                    self.__logger,
+                    self.__debug_level,
+                    logging.DEBUG,
+                    lambda: f"Saved cached choices for wildcard file: {full_path}",
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                log(
+                    self.__logger,
+                    self.__debug_level,
+                    logging.WARNING,
+                    f"Failed to save cached choices for wildcard file '{escape_single_quotes(str(full_path))}': {e}",
+                )
+
+    def get_parsed_choice(self, wildcard: PPPWildcard, key: tuple[str, str, str]) -> Any:
+        """
+        Get a parsed text of a wildcard.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            key (tuple[str, str, str]): The grammar hash, the parser name and the text.
+
+        Returns:
+            Any: The parsed text, or None if it has not been parsed yet.
+        """
+        self.__check_parsed_choices_loaded(wildcard.file)
+        with self.__parsed_choices_lock:
+            parsed = self.__parsed_choices.get(wildcard.file)
+            return parsed.get(key) if parsed is not None else None
+
+    def add_parsed_choice(self, wildcard: PPPWildcard, key: tuple[str, str, str], value: Any):
+        """
+        Add a parsed text of a wildcard, so it can be stored in the cache.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            key (tuple[str, str, str]): The grammar hash, the parser name and the text.
+            value (Any): The parsed text.
+        """
+        self.__check_parsed_choices_loaded(wildcard.file)
+        with self.__parsed_choices_lock:
+            if wildcard.file is not None:
+                if wildcard.file not in self.__wildcard_files:
+                    return  # the file is not loaded anymore
+                self.__parsed_choices_changed.add(wildcard.file)
+            self.__parsed_choices.setdefault(wildcard.file, {})[key] = value
+
+    def set_warmup_initializer(self, initialize: Optional[Callable[[PPPWildcard], Optional[PPPWildcard]]]):
+        """
+        Set the function to initialize the wildcards in the warm-up that is started after each refresh, if enabled.
+        If there are wildcards to warm up, it is started now.
+
+        Args:
+            initialize (Optional[Callable[[PPPWildcard], Optional[PPPWildcard]]]): Function that returns an
+                initialized copy of a wildcard, or None if it can't be initialized.
+        """
+        self.__warmup_initializer = initialize
+        if self.__warmup_threads > 0 and initialize is not None:
+            self.start_warmup(initialize, self.__warmup_threads)
+
+    def start_warmup(
+        self,
+        initialize: Callable[[PPPWildcard], Optional[PPPWildcard]],
+        max_workers: int = 2,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> Optional["PPPWildcardsWarmup"]:
+        """
+        Start initializing in background threads the wildcards that have not been used yet.
+
+        If the wildcards have not changed since the last warm-up, it is not started again.
+
+        Args:
+            initialize (Callable[[PPPWildcard], Optional[PPPWildcard]]): Function that returns an initialized copy of
+                a wildcard, or None if it can't be initialized.
+            max_workers (int): The number of threads.
+            progress_callback (Optional[Callable[[int, int], None]]): Function called with the number of processed
+                wildcards and the total after each one.
+
+        Returns:
+            Optional[PPPWildcardsWarmup]: The current warm-up, if any.
+        """
+        if self.__warmup_pending:
+            self.__warmup_pending = False
+            self.cancel_warmup()
+            # the choices of large text files are only parsed when chosen
+            pending = [
+                wc
+                for wc in self.wildcards.values()
+                if wc.choices is None
+                and wc.unprocessed_choices is not None
+                and not isinstance(wc.unprocessed_choices, PPPWildcardLines)
+            ]
+            if pending:
+                self.__warmup = PPPWildcardsWarmup(self, pending, initialize, max_workers, progress_callback)
+                log(
+                    self.__logger,
+                    self.__debug_level,
+                    logging.DEBUG,
+                    lambda: f"Warming up {len(pending)} wildcards with {max_workers} threads",
+                )
+        return self.__warmup
+
+    def cancel_warmup(self):
+        """
+        Cancel the current warm-up, if any.
+        """
+        if self.__warmup is not None:
+            self.__warmup.cancel()
+            self.__warmup = None
+
+    @property
+    def warmup(self) -> Optional["PPPWildcardsWarmup"]:
+        return self.__warmup
+
+    def set_warmed_wildcard(self, wildcard: PPPWildcard, warmed: PPPWildcard):
+        """
+        Replace a wildcard with its initialized copy, unless it has been removed or initialized in the meantime.
+
+        Args:
+            wildcard (PPPWildcard): The wildcard.
+            warmed (PPPWildcard): The initialized copy.
+        """
+        with self.__wildcards_lock:
+            if self.wildcards.get(wildcard.key, None) is wildcard and wildcard.choices is None:
+                self.wildcards[wildcard.key] = warmed
 
     def set_wildcard_default_filter(self, wildcard_key: str, filter_options: Optional[list[list[str]]]):
         """
@@ -565,3 +1611,90 @@ class PPPWildcards:
         Reset all default filters.
         """
         self.__wildcard_default_filters = {}
+
+
+class PPPWildcardsWarmup:
+    """
+    Initializes in background threads some wildcards (parsing and converting their options and choices), so their
+    first use does not have to do it.
+
+    Each wildcard is initialized in a copy, which replaces it in the wildcards object once it is complete, so a prompt
+    sees either the wildcard as it was or fully initialized, never partially built.
+    """
+
+    def __init__(
+        self,
+        wildcards_obj: PPPWildcards,
+        wildcards: list[PPPWildcard],
+        initialize: Callable[[PPPWildcard], Optional[PPPWildcard]],
+        max_workers: int,
+        progress_callback: Optional[Callable[[int, int], None]],
+    ):
+        """
+        Initializes and starts the warm-up.
+
+        Args:
+            wildcards_obj (PPPWildcards): The wildcards object.
+            wildcards (list[PPPWildcard]): The wildcards to warm up.
+            initialize (Callable[[PPPWildcard], Optional[PPPWildcard]]): Function that returns an initialized copy of
+                a wildcard, or None if it can't be initialized.
+            max_workers (int): The number of threads.
+            progress_callback (Optional[Callable[[int, int], None]]): Function called with the number of processed
+                wildcards and the total after each one.
+        """
+        self.__wildcards_obj = wildcards_obj
+        self.__initialize = initialize
+        self.__progress_callback = progress_callback
+        self.__cancelled = threading.Event()
+        self.__lock = threading.Lock()
+        self.total = len(wildcards)
+        self.completed = 0
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ppp_warmup")
+        self.__futures = [executor.submit(self.__warm_up, wc) for wc in wildcards]
+        executor.shutdown(wait=False)
+
+    def __warm_up(self, wildcard: PPPWildcard):
+        try:
+            if self.__cancelled.is_set():
+                return
+            try:
+                warmed = self.__initialize(wildcard)
+            except Exception:  # pylint: disable=broad-except
+                warmed = None  # the error will be reported when the wildcard is used
+            if warmed is not None and not self.__cancelled.is_set():
+                self.__wildcards_obj.set_warmed_wildcard(wildcard, warmed)
+        finally:
+            with self.__lock:
+                self.completed += 1
+                completed = self.completed
+            if self.__progress_callback is not None and not self.__cancelled.is_set():
+                self.__progress_callback(completed, self.total)
+
+    def cancel(self):
+        """
+        Cancel the pending work of the warm-up.
+        """
+        self.__cancelled.set()
+        for f in self.__futures:
+            f.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__cancelled.is_set()
+
+    @property
+    def done(self) -> bool:
+        return all(f.done() for f in self.__futures)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the warm-up to finish.
+
+        Args:
+            timeout (Optional[float]): The maximum time to wait in seconds, or None to wait until it finishes.
+
+        Returns:
+            bool: Whether the warm-up has finished.
+        """
+        wait_futures(self.__futures, timeout)
+        return self.done
@@ -276,8 +276,20 @@ class PromptPostProcessorA1111Script(scripts.Script):
             self.ppp_init = True
             self.ppp_debug_level = options.debug_level
             self.lru_cache = PPPLRUCache(1000, logger=self.ppp_logger, debug_level=self.ppp_debug_level)
-            self.wildcards_obj = PPPWildcards(self.ppp_logger)
-            self.extranetwork_mappings_obj = PPPExtraNetworkMappings(self.ppp_logger)
+            watch_folders = os.getenv("PPP_WATCH_FOLDERS", "") == "1"
+            load_processes = os.getenv("PPP_WILDCARDS_LOAD_PROCESSES", "")
+            max_parsed_files = os.getenv("PPP_WILDCARDS_MAX_PARSED_FILES", "")
+            warmup_threads = os.getenv("PPP_WILDCARDS_WARMUP", "")
+            self.wildcards_obj = PPPWildcards(
+                self.ppp_logger,
+                watch_folders=watch_folders,
+                load_processes=int(load_processes) if load_processes.isdigit() else 0,
+                max_parsed_files=int(max_parsed_files) if max_parsed_files.isdigit() else 0,
+                lazy_load=os.getenv("PPP_WILDCARDS_LAZY_LOAD", "") == "1",
+                lines_index=os.getenv("PPP_WILDCARDS_LINES_INDEX", "") == "1",
+                warmup_threads=int(warmup_threads) if warmup_threads.isdigit() else 0,
+            )
+            self.extranetwork_mappings_obj = PPPExtraNetworkMappings(self.ppp_logger, watch_folders=watch_folders)
             log(
                 self.ppp_logger,
                 DEBUG_LEVEL.minimal,
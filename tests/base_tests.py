@@ -1,7 +1,10 @@
 from dataclasses import replace
 import difflib
 import logging
+import os
 from pathlib import Path
+import shutil
+import tempfile
 from typing import Any, NamedTuple, Optional
 import unittest
 import datetime
@@ -116,6 +119,56 @@ class TestPromptPostProcessorBase(unittest.TestCase):
     def interrupt(self):
         self.interrupted = True
 
+    def create_wildcards_folder(self, files: dict[str, str | bytes]) -> Path:
+        """
+        Create a temporary wildcards folder that is removed when the test ends.
+
+        Args:
+            files (dict[str, str | bytes]): The content of the files, by their path relative to the folder.
+
+        Returns:
+            Path: The wildcards folder. Its parent folder can be used for other temporary files.
+        """
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        folder = root / "wildcards"
+        folder.mkdir()
+        for name, content in files.items():
+            (folder / name).parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, bytes):
+                (folder / name).write_bytes(content)
+            else:
+                (folder / name).write_text(content, encoding="utf-8")
+        return folder
+
+    def update_wildcards_file(self, file: Path, content: str, last_modified: int = 1000):
+        """
+        Change the content of a wildcards file, making sure the change is detected with coarse timestamps.
+
+        Args:
+            file (Path): The file.
+            content (str): The new content.
+            last_modified (int, optional): The new modification time. Defaults to 1000.
+        """
+        file.write_text(content, encoding="utf-8")
+        os.utime(file, (last_modified, last_modified))
+
+    def load_wildcards(self, folder: Path, cache: bool = False, **kwargs) -> PPPWildcards:
+        """
+        Replace the wildcards object with a new one with only the wildcards in a folder.
+
+        Args:
+            folder (Path): The wildcards folder.
+            cache (bool, optional): Whether to use a cache folder next to the wildcards folder. Defaults to False.
+            **kwargs: Other arguments for the wildcards object.
+
+        Returns:
+            PPPWildcards: The new wildcards object.
+        """
+        self.wildcards_obj = PPPWildcards(self.lf.log, folder.parent / "cache" if cache else None, **kwargs)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        return self.wildcards_obj
+
     def init_ppp(
         self,
         ppp: Optional[str | PromptPostProcessor] = None,
@@ -1,6 +1,8 @@
 from dataclasses import replace
+from itertools import combinations, combinations_with_replacement, permutations, product
 
 from ppp import PromptPostProcessor  # type: ignore
+from ppp_utils import count_selections, unrank_selection  # type: ignore
 from .base_tests import OutputTuple, InputTuple, TestPromptPostProcessorBase
 
 if __name__ == "__main__":
@@ -167,3 +169,27 @@ class TestChoices(TestPromptPostProcessorBase):
             ],
             combinatorial=True,
         )
+
+    def test_ch_combinatorial_unranking(self):  # the selections are the same and in the same order as with itertools
+        for n in range(1, 6):
+            for k in range(0, 5):
+                for repeating, ordered, iterator in (
+                    (False, False, combinations(range(n), k)),
+                    (False, True, permutations(range(n), k)),
+                    (True, False, combinations_with_replacement(range(n), k)),
+                    (True, True, product(range(n), repeat=k)),
+                ):
+                    expected = [list(x) for x in iterator]
+                    self.assertEqual(count_selections(n, k, repeating, ordered), len(expected))
+                    self.assertEqual(
+                        [unrank_selection(n, k, repeating, ordered, i) for i in range(len(expected))], expected
+                    )
+        # a decision with millions of selections
+        choices = "|".join(chr(ord("a") + i) for i in range(20))
+        self.process(
+            InputTuple("{2-6$$" + choices + "}", ""),
+            [OutputTuple("a, b", ""), OutputTuple("a, c", ""), OutputTuple("a, d", "")],
+            combinatorial=True,
+            combinatorial_limit=3,
+        )
+        self.process(InputTuple("{@2-6$$" + choices + "}", ""), OutputTuple("a, b", ""))
@@ -1,9 +1,42 @@
-from .base_tests import InputTuple, TestPromptPostProcessorBase
+import ast
+import copy
+import json
+import logging
+from pathlib import Path
+import pickle
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+import lark
+
+import ppp_common
+from ppp_common import PARSERS_DEFINITIONS, PPPParserWithFallback, get_parser, load_grammar
+from ppp_logging import DEBUG_LEVEL, log
+from .base_tests import InputTuple, OutputTuple, TestPromptPostProcessorBase
 
 if __name__ == "__main__":
     raise SystemExit("This script must not be run directly")
 
 
+# Gets a parser in a new process, as after a restart
+RESTART_SCRIPT = """
+import json, logging, sys
+from pathlib import Path
+from unittest import mock
+import ppp_common
+from ppp_logging import DEBUG_LEVEL
+
+cache_folder, grammar_file, flags, start, prompt = sys.argv[1:]
+with mock.patch("ppp_common.preprocess_grammar", wraps=ppp_common.preprocess_grammar) as preprocess:
+    grammar = Path(grammar_file).read_text(encoding="utf-8")
+    logger = logging.getLogger()
+    parser = ppp_common.get_parser(grammar, json.loads(flags), start, logger, DEBUG_LEVEL.none, Path(cache_folder))
+print(json.dumps([preprocess.called, parser.parse(prompt).pretty()]))
+"""
+
+
 class TestPerformance(TestPromptPostProcessorBase):
 
     def setUp(self):  # pylint: disable=arguments-differ
@@ -73,3 +106,176 @@ class TestPerformance(TestPromptPostProcessorBase):
             InputTuple(large_prompt, ""),
             ppp="nocup",
         )
+
+    def test_parser_registry_shared(self):  # compiled parsers are shared between instances
+        ppp1 = self.init_ppp()
+        ppp2 = self.init_ppp("nocup")
+        self.assertEqual(ppp1.state.parsers.keys(), ppp2.state.parsers.keys(), "Different parsers")
+        for name, parser in ppp1.state.parsers.items():
+            self.assertIs(parser, ppp2.state.parsers[name], f"Parser '{name}' was compiled again")
+
+    def test_parsers_lazy(self):  # parsers are only obtained when they are first needed
+        the_ppp = self.init_ppp()
+        self.assertEqual(the_ppp.state.parsers.get_loaded(), [], "Parsers were obtained before they were needed")
+        self.process(InputTuple("(simple:1.5) prompt", ""), OutputTuple("(simple:1.5) prompt", ""), ppp=the_ppp)
+        self.assertEqual(the_ppp.state.parsers.get_loaded(), ["only_old"], "Wrong parsers for a simple prompt")
+        parser = the_ppp.state.parsers["wc"]
+        self.assertIs(parser, the_ppp.state.parsers["wc"], "Parser was obtained again")
+        self.assertEqual(the_ppp.state.parsers.get_loaded(), ["only_old", "wc"], "Wrong obtained parsers")
+
+    def test_parse_cache(self):  # parsed prompts are reused and not modified by the processing
+        the_ppp = self.init_ppp()
+        prompt = InputTuple("${v=!value}${v?=!other}(cached:1.5) <ppp:if v eq 'value'>OK<ppp:else>not OK<ppp:/if>", "")
+        with mock.patch.object(lark.Lark, "parse", autospec=True, side_effect=lark.Lark.parse) as lark_parse:
+            self.process(prompt, OutputTuple("(cached:1.5) OK", ""), ppp=the_ppp)
+            self.assertTrue(lark_parse.called, "Prompt was not parsed")
+            lark_parse.reset_mock()
+            for _ in range(2):
+                self.process(prompt, OutputTuple("(cached:1.5) OK", ""), ppp=the_ppp)
+            self.assertFalse(lark_parse.called, "Prompt was parsed again")
+        # the shared trees are not modified when processing them with other options, variables and seeds
+        prompt = "${v=!{a|b|c}}(shared:1.5) <ppp:if v eq 'a'>A<ppp:else>${w=!{x|y}}not A ${w}<ppp:/if>"
+        prompt += " {d|e}, __yaml/wildcard1__"
+        parsed = []
+
+        def parse_prompt(*args, **kwargs):
+            tree = ppp_common.parse_prompt(*args, **kwargs)
+            parsed.append((args[2], tree))
+            return tree
+
+        with (
+            mock.patch("ppp.parse_prompt", side_effect=parse_prompt),
+            mock.patch("ppp_tree.parse_prompt", side_effect=parse_prompt),
+        ):
+            self.process(InputTuple(prompt, "[neg] ${v}"), None, seed=1)
+            trees = {text: (tree, copy.deepcopy(tree)) for text, tree in parsed if isinstance(tree, lark.Tree)}
+            self.assertTrue(trees, "Nothing was parsed")
+            parsed.clear()
+            for seed, ppp in ((2, "nocup"), (3, None), (4, "nostrict")):
+                self.process(InputTuple(prompt, "[neg] ${v}"), None, seed=seed, ppp=ppp)
+        for text, tree in parsed:
+            if text in trees:
+                self.assertIs(tree, trees[text][0], f"Parsed tree of {text!r} was not reused")
+        for text, (tree, original) in trees.items():
+            self.assertEqual(tree, original, f"Parsed tree of {text!r} was modified")
+            self.assertTrue(all(t.meta.source == text for t in tree.iter_subtrees()), f"Wrong source of {text!r}")
+
+    def test_plain_text_not_parsed(self):  # prompts without constructs are not parsed
+        with mock.patch("ppp.parse_prompt", side_effect=AssertionError("Prompt was parsed")):
+            self.process(
+                InputTuple("a plain prompt,  with: some_text > other |  text ", "bad,, quality"),
+                OutputTuple("a plain prompt, with: some_text > other | text", "bad, quality"),
+            )
+        self.process(  # while the ones with constructs are
+            InputTuple("a plain prompt with (some:1.5) [text]", "BREAK"),
+            OutputTuple("a plain prompt with (some:1.5) [text]", ""),
+        )
+
+    def test_deferred_log_messages(self):  # log messages are only built when they are logged
+        factory = mock.Mock(return_value="message")
+        log(self.ppp_logger, DEBUG_LEVEL.none, logging.DEBUG, factory)
+        log(self.ppp_logger, DEBUG_LEVEL.minimal, logging.DEBUG, factory)
+        self.assertFalse(factory.called, "Message was built without being logged")
+        log(self.ppp_logger, DEBUG_LEVEL.minimal, logging.DEBUG, factory, DEBUG_LEVEL.minimal)
+        log(self.ppp_logger, DEBUG_LEVEL.full, logging.DEBUG, factory)
+        self.assertEqual(factory.call_count, 2, "Messages were not built when logged")
+
+    def test_parser_disk_cache(self):  # compiled parsers are stored and loaded from the cache folder after a restart
+        flags, start = PARSERS_DEFINITIONS["choice"]
+        prompt = "5::one {two|three}"
+        # another grammar content, so the parser has not been compiled yet in this process
+        grammar = self.grammar_content + "\n// parser cache test\n"
+        with tempfile.TemporaryDirectory() as temp_folder:
+            cache_folder = Path(temp_folder) / "parsers"
+            grammar_file = Path(temp_folder) / "grammar.lark"
+            grammar_file.write_text(grammar, encoding="utf-8")
+
+            def get_parser_after_restart() -> tuple[bool, str]:
+                # a new process gets the parser, returning whether it was compiled and the tree of the prompt
+                arguments = [str(cache_folder), str(grammar_file), json.dumps(flags), start, prompt]
+                result = subprocess.run(
+                    [sys.executable, "-c", RESTART_SCRIPT, *arguments],
+                    cwd=Path(__file__).parent.parent,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                return tuple(json.loads(result.stdout))
+
+            compiled = get_parser(grammar, flags, start, self.ppp_logger, DEBUG_LEVEL.full, cache_folder)
+            expected_tree = compiled.parse(prompt).pretty()
+            self.assertEqual(len(list(cache_folder.glob("*.pickle"))), 1, "Parser was not stored in the cache")
+            self.assertEqual(get_parser_after_restart(), (False, expected_tree), "Parser was not loaded from the cache")
+            # a stored parser that was built for something else is compiled again
+            [cache_file] = cache_folder.glob("*.pickle")
+            for changed in ({"lark": "0.0.0"}, {"options": ""}, {"grammar": "other"}):
+                data = pickle.loads(cache_file.read_bytes())
+                cache_file.write_bytes(pickle.dumps({"info": {**data["info"], **changed}, "grammar": data["grammar"]}))
+                self.assertEqual(
+                    get_parser_after_restart(), (True, expected_tree), f"Parser was not compiled with {changed}"
+                )
+
+    def test_parser_lalr_matches_earley(self):  # the LALR parser returns the same trees as the Earley parser
+        flags, start = PARSERS_DEFINITIONS["only_old"]
+        earley_parser = get_parser(self.grammar_content, flags, start, self.ppp_logger, DEBUG_LEVEL.full)
+        lalr_parser = get_parser(
+            load_grammar("grammar_lalr.lark"), {}, "start", self.ppp_logger, DEBUG_LEVEL.full, parser_type="lalr"
+        )
+        parser = PPPParserWithFallback(lalr_parser, earley_parser)
+
+        def signature(node):
+            if isinstance(node, lark.Tree):
+                m = node.meta
+                positions = None if m.empty else (m.start_pos, m.end_pos, m.line, m.column, m.end_line, m.end_column)
+                return (str(node.data), positions, [signature(c) for c in node.children])
+            if isinstance(node, lark.Token):
+                positions = (node.start_pos, node.end_pos, node.line, node.column, node.end_line, node.end_column)
+                return (node.type, node.value, positions)
+            return node
+
+        accepted_prompts = [
+            "(this:1.2) is a [test] using a [simple|low complexity] prompt with <lora:test:1>",
+            "masterpiece, 1girl, (blue eyes:1.2), [a:b:0.5], [[x]], ((y)), <lora:x:0.8>, \\(escaped\\)",
+            "a | b, (c|d), [e|(f:1.1)|], [], (), [g:[h|i]:-2]",
+            "multi\nline (prompt:\n0.9\n)\n[j|k\n]\n",
+            "<hypernet:name:1> $x, 10:30 <lyco:a$b|c:0.5:0.2>",
+        ]
+        rejected_prompts = [
+            "[a:0.5] <ppp:set x>1<ppp:/set> __wildcard__ {b|c} d AND e",
+            "_f a > b <lyco:a(b)[c]:0.5>",
+        ]
+        for prompt in accepted_prompts + rejected_prompts:
+            for text in (prompt + "\x1d", "\x1d" + prompt, prompt + "\x1d" + prompt):
+                if prompt in accepted_prompts:
+                    lalr_parser.parse(text)
+                else:
+                    with self.assertRaises(lark.exceptions.LarkError, msg=f"LALR parser accepted {text!r}"):
+                        lalr_parser.parse(text)
+                self.assertEqual(
+                    signature(parser.parse(text)), signature(earley_parser.parse(text)), f"Different tree for {text!r}"
+                )
+        # the same with the prompts of all the tests, as they are sent to the parser
+        corpus = set()
+        for test_file in Path(__file__).parent.glob("tests_*.py"):
+            for node in ast.walk(ast.parse(test_file.read_text(encoding="utf-8"))):
+                if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "InputTuple":
+                    try:
+                        values = [ast.literal_eval(arg) for arg in node.args + [k.value for k in node.keywords]]
+                    except ValueError:
+                        continue  # built at runtime
+                    corpus.add("\x1d".join(values + [""] * (2 - len(values))))
+        accepted = 0
+        for text in sorted(corpus):
+            try:
+                expected = signature(earley_parser.parse(text))
+            except lark.exceptions.LarkError as e:
+                with self.assertRaises(type(e), msg=f"Tree for {text!r}"):
+                    parser.parse(text)
+                continue
+            self.assertEqual(signature(parser.parse(text)), expected, f"Different tree for {text!r}")
+            try:
+                lalr_parser.parse(text)
+                accepted += 1
+            except lark.exceptions.LarkError:
+                pass
+        self.assertGreater(accepted, 0, "No prompt was parsed with the LALR grammar")
@@ -1,7 +1,10 @@
 from dataclasses import replace
+from pathlib import Path
 
 from ppp import PromptPostProcessor  # type: ignore
 from ppp_classes import ONWARNING_CHOICES  # type: ignore
+from ppp_enmappings import PPPExtraNetworkMappings  # type: ignore
+from ppp_logging import DEBUG_LEVEL  # type: ignore
 from .base_tests import OutputTuple, InputTuple, TestPromptPostProcessorBase
 
 if __name__ == "__main__":
@@ -1109,6 +1112,18 @@ class TestVarCommands(TestPromptPostProcessorBase):
             ),
         )
 
+    def test_cmd_ext_map_fingerprint(self):  # ext mappings with the same content have the same hash
+        enmappings_folder = Path(__file__).parent / "enmappings"
+        other_maps_obj = PPPExtraNetworkMappings(self.ppp_logger)
+        other_maps_obj.refresh_extranetwork_mappings(DEBUG_LEVEL.full, [enmappings_folder])
+        self.extranetwork_maps_obj.refresh_extranetwork_mappings(DEBUG_LEVEL.full, [enmappings_folder])
+        self.assertNotEqual(hash(other_maps_obj), 0, "Loaded mappings have no hash")
+        self.assertEqual(
+            hash(other_maps_obj), hash(self.extranetwork_maps_obj), "Same mappings have different hashes"
+        )
+        other_maps_obj.refresh_extranetwork_mappings(DEBUG_LEVEL.full, None)
+        self.assertEqual(hash(other_maps_obj), 0, "Hash was not reset with no mappings")
+
     def test_var_attention_merge(self):  # attention merge at variable boundary
         self.process(
             InputTuple("${v!=[content]}(${v}:1.5)", ""),
@@ -1,7 +1,20 @@
 from dataclasses import replace
-
+import fnmatch
+import os
+from pathlib import Path
+import sys
+import time
+from unittest import mock
+
+import ppp_common
 from ppp import PromptPostProcessor
-from ppp_classes import IFWILDCARDS_CHOICES
+from ppp_cache import PPPLRUCache
+from ppp_classes import IFWILDCARDS_CHOICES, ONWARNING_CHOICES
+from ppp_logging import DEBUG_LEVEL
+from ppp_tree import TreeProcessor
+from ppp_utils import PPPFolderScanner, decode_text, load_structured_text
+from ppp_watcher import PPPFolderWatcher
+from ppp_wildcards import PPPWildcardLines, PPPWildcards
 from .base_tests import OutputTuple, InputTuple, TestPromptPostProcessorBase
 
 if __name__ == "__main__":
@@ -629,3 +642,540 @@ class TestWildcards(TestPromptPostProcessorBase):
             ppp="nocup",
             combinatorial=True,
         )
+
+    # Wildcards library
+
+    def test_wc_choices_cache(self):  # parsed wildcard choices are stored and loaded from the cache folder
+        folder = self.create_wildcards_folder({"cached.txt": "one (two:1.5)\n"})
+        self.load_wildcards(folder, cache=True)
+        self.process(InputTuple("__cached__", ""), OutputTuple("one (two:1.5)", ""))
+        cache_folder = folder.parent / "cache"
+        self.assertEqual(len(list(cache_folder.glob("*.pickle"))), 1, "Choices were not stored in the cache")
+        self.load_wildcards(folder, cache=True)
+        with mock.patch("ppp_tree.parse_prompt", side_effect=AssertionError("Choice was parsed")):
+            self.process(InputTuple("__cached__", ""), OutputTuple("one (two:1.5)", ""))
+
+    def test_wc_release_parsed_choices(self):  # parsed choices over the limit are released and reloaded
+        files = {f"{name}.txt": f"{name} (two:1.5)\n" for name in ("first", "second", "third")}
+        folder = self.create_wildcards_folder(files)
+        self.load_wildcards(folder, cache=True, max_parsed_files=2)
+        initial = hash(self.wildcards_obj)
+        self.process(InputTuple("__first__", ""), OutputTuple("first (two:1.5)", ""))
+        # only the processed choices are kept
+        self.assertIsNone(self.wildcards_obj.wildcards["first"].unprocessed_choices)
+        self.assertEqual(hash(self.wildcards_obj), initial)
+        # the released file is not read again until it is used
+        with mock.patch("ppp_wildcards._read_wildcards_file", side_effect=AssertionError("File was read")):
+            self.process(InputTuple("__second__ __third__", ""), OutputTuple("second (two:1.5) third (two:1.5)", ""))
+        self.assertIsNone(self.wildcards_obj.wildcards["first"].choices, "Parsed choices were not released")
+        self.assertIsNone(self.wildcards_obj.wildcards["first"].unprocessed_choices, "File was read again")
+        self.assertEqual(hash(self.wildcards_obj), initial)
+        self.assertIsNotNone(self.wildcards_obj.wildcards["third"].choices)
+        usage = self.wildcards_obj.get_memory_usage()
+        self.assertGreater(usage["parsed_choices"], 0)
+        self.assertGreater(usage["wildcards"], 0)
+        with mock.patch("ppp_tree.parse_prompt", side_effect=AssertionError("Choice was parsed")):
+            self.process(InputTuple("__first__", ""), OutputTuple("first (two:1.5)", ""))
+        self.wildcards_obj.release_parsed_choices()
+        self.assertTrue(all(wc.choices is None for wc in self.wildcards_obj.wildcards.values()))
+        self.assertLess(self.wildcards_obj.get_memory_usage()["parsed_choices"], usage["parsed_choices"])
+
+    def test_wc_lazy_load(self):  # with lazy loading, the files are only indexed until they are used
+        folder = self.create_wildcards_folder(
+            {"text.txt": "one\n", "sub/structured.yaml": "group:\n  a: [two]\n  b: [three, [four]]\n"}
+        )
+        self.load_wildcards(folder, cache=True, lazy_load=True)
+        self.assertEqual(sorted(self.wildcards_obj.wildcards), ["sub/group/a", "sub/group/b", "sub/group/b/#ANON_1"])
+        self.process(InputTuple("__text__", ""), OutputTuple("one", ""))
+        self.assertIn("text", self.wildcards_obj.wildcards)
+        # the keys of the structured file are now known, so no file is read when refreshing
+        with mock.patch("ppp_wildcards._read_wildcards_file", side_effect=AssertionError("File was read")):
+            self.load_wildcards(folder, cache=True, lazy_load=True)
+        self.assertEqual(self.wildcards_obj.wildcards, {})
+        self.assertEqual([wc.key for wc in self.wildcards_obj.get_wildcards("sub/group/a")], ["sub/group/a"])
+        self.assertNotIn("text", self.wildcards_obj.wildcards)
+        self.process(InputTuple("__sub/group/a__ __text__", ""), OutputTuple("two one", ""))
+        self.update_wildcards_file(folder / "sub" / "structured.yaml", "group:\n  c: [five]\n")
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertEqual([wc.key for wc in self.wildcards_obj.get_wildcards("sub/group/*")], ["sub/group/c"])
+        (folder / "text.txt").unlink()
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertEqual(self.wildcards_obj.get_wildcards("text"), [])
+
+    def test_wc_lazy_load_duplicates(self):  # the first file defines the duplicated keys, as when loading them all
+        folder = self.create_wildcards_folder(
+            {"a.yaml": "key: [from_a]\nkey_a: [a]\n", "b.yaml": "key: [from_b]\nkey_b: [b]\n"}
+        )
+        self.load_wildcards(folder, cache=True, lazy_load=True)  # the keys are not known yet, so the files are loaded
+        first_file = self.wildcards_obj.wildcards["key"].file
+        other_key = "key_b" if first_file.stem == "a" else "key_a"
+        expected = f"{other_key[-1]} from_{first_file.stem}"
+        self.process(InputTuple(f"__{other_key}__ __key__", ""), OutputTuple(expected, ""))
+        # the keys of both files are indexed now, and the other file is loaded first
+        self.load_wildcards(folder, cache=True, lazy_load=True)
+        self.assertEqual(self.wildcards_obj.wildcards, {}, "Files were loaded when indexing them")
+        self.process(InputTuple(f"__{other_key}__ __key__", ""), OutputTuple(expected, ""))
+        self.assertEqual(self.wildcards_obj.wildcards["key"].file, first_file, "Key defined in the wrong file")
+
+    def test_wc_large_text_file(self):  # the lines of large text files are read only when chosen
+        lines = ["# names", ""]
+        lines += [f"name{i} {{red|blue}}" if i % 7 == 0 else f"name{i} # comment {i}" for i in range(300)]
+        lines += ["", "last\u00e9 (weight:1.2)"]
+        folder = self.create_wildcards_folder(
+            {
+                "big.txt": "\r\n".join(lines).encode("utf-8"),
+                "weighted.txt": "\n".join(["3::heavy", "light", "if _is_sd1::sd1", "'tag'::tagged", "plain"]),
+                "options.txt": "\n".join(["2$$ / $$", "one", "two", "three"]),
+            }
+        )
+        prompts = ["__big__", "__2-4$$big__", "__r3$$big__", "__~2$$, $$big__", "__big'2-5'__", "__weighted__"]
+        prompts += ["__2$$weighted__", "__options__"]
+
+        def outputs():
+            results = []
+            ppp = self.init_ppp()
+            ppp.process_prompts_group_start()
+            for seed in range(5):
+                for prompt in prompts:
+                    results.append(ppp.process_prompt(prompt, "", seed)[0][:2])
+            ppp.process_prompts_group_end()
+            return results
+
+        with mock.patch.object(PPPWildcards, "LINES_INDEX_MIN_SIZE", 0):
+            self.load_wildcards(folder)
+            expected_choices = self.wildcards_obj.wildcards["big"].unprocessed_choices
+            self.assertIsInstance(expected_choices, list, "Large text file was indexed without enabling it")
+            expected = outputs()
+            for cache in (False, True, True):
+                self.load_wildcards(folder, cache=cache, lines_index=True)
+                wildcard = self.wildcards_obj.wildcards["big"]
+                self.assertIsInstance(wildcard.unprocessed_choices, PPPWildcardLines, "Large text file was not indexed")
+                self.assertEqual(list(wildcard.unprocessed_choices), expected_choices, "Indexed lines are different")
+                with mock.patch("builtins.open", wraps=open) as open_mock:
+                    for i in range(0, len(expected_choices), 10):
+                        self.assertEqual(wildcard.unprocessed_choices[i], expected_choices[i], f"Line {i} is different")
+                    self.assertEqual(wildcard.unprocessed_choices[-1], expected_choices[-1], "Last line is different")
+                # the wildcards file, and the index file if it is not in memory
+                self.assertEqual(open_mock.call_count, 2 if cache else 1, "Files were opened for each line")
+                for key in ("weighted", "options"):  # only plain lists of choices are indexed
+                    self.assertIsInstance(
+                        self.wildcards_obj.wildcards[key].unprocessed_choices, list, f"File '{key}' was indexed"
+                    )
+                self.assertEqual(outputs(), expected, "Results are different from those of the loaded file")
+            cache_folder = folder.parent / "cache"
+            self.assertEqual(len(list(cache_folder.glob("*.lines"))), 3, "Indexes were not stored in the cache")
+            # a uniform selection does not parse all the lines or keep a sampling table
+            self.load_wildcards(folder, lines_index=True)
+            self.process(InputTuple("__big__", ""), OutputTuple(expected[0][0], ""), seed=0)
+            self.assertIsNone(self.wildcards_obj.wildcards["big"].choices, "Lines were parsed")
+            self.assertIsNone(self.wildcards_obj.wildcards["big"].sampling, "Sampling table was kept")
+
+    def test_wc_large_text_file_invalid_line(self):  # invalid lines are not chosen, as when the file is loaded
+        folder = self.create_wildcards_folder({"big.txt": "\n".join(["one", "two ${broken", "three", "four"])})
+
+        def outputs():
+            ppp = PromptPostProcessor(
+                self.ppp_logger,
+                self.def_env_info,
+                replace(self.defopts, on_warning=ONWARNING_CHOICES.warn),
+                self.grammar_content,
+                self.interrupt,
+                self.wildcards_obj,
+                self.extranetwork_maps_obj,
+            )
+            prompts = ("__big__", "__3$$big__", "__4$$big__")  # all the lines are chosen with the last one
+            return [ppp.process_prompt(prompt, "", seed)[0][0] for seed in range(5) for prompt in prompts]
+
+        with mock.patch.object(PPPWildcards, "LINES_INDEX_MIN_SIZE", 0):
+            self.load_wildcards(folder)
+            expected = outputs()
+            self.load_wildcards(folder, lines_index=True)
+            self.assertEqual(outputs(), expected, "Results are different from those of the loaded file")
+            for prompt in expected[1::3] + expected[2::3]:
+                self.assertEqual(len(prompt.split(", ")), 3, f"Wrong number of choices in '{prompt}'")
+            self.load_wildcards(folder, lines_index=True)
+            self.process(InputTuple("__4$$big__", ""), None, interrupted=True)
+
+    def test_wc_warmup(self):  # unused wildcards are initialized in the background
+        folder = self.create_wildcards_folder(
+            {"warm.txt": "one (two:1.5)\n", "warm2.yaml": "warm2:\n  - { if: 'not _is_sd1', content: 'three' }\n"}
+        )
+        self.load_wildcards(folder, cache=True)
+        progress = []
+        warmup = self.init_ppp().warm_up_wildcards(2, lambda completed, total: progress.append((completed, total)))
+        self.assertIsNotNone(warmup, "Warm-up was not started")
+        self.assertTrue(warmup.wait(60), "Warm-up did not finish")
+        self.assertEqual(sorted(progress), [(1, 2), (2, 2)], "Wrong warm-up progress")
+        for key in ("warm", "warm2"):
+            self.assertIsNotNone(self.wildcards_obj.wildcards[key].choices, f"Wildcard '{key}' was not initialized")
+        self.assertIs(self.init_ppp().warm_up_wildcards(2), warmup, "Warm-up was restarted without changes")
+        with mock.patch("ppp_tree.parse_prompt", side_effect=AssertionError("Choice was parsed")):
+            self.process(InputTuple("__warm__ __warm2__", ""), OutputTuple("one (two:1.5) three", ""))
+        # the warm-up is started by the refresh when it is enabled
+        self.load_wildcards(folder, cache=True, warmup_threads=2)
+        self.assertIsNone(self.wildcards_obj.warmup, "Warm-up was started without an initializer")
+        self.init_ppp()
+        warmup = self.wildcards_obj.warmup
+        self.assertIsNotNone(warmup, "Warm-up was not started with the initializer")
+        self.assertTrue(warmup.wait(60), "Warm-up did not finish")
+        self.update_wildcards_file(folder / "warm.txt", "four\n", 2000)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertIsNot(self.wildcards_obj.warmup, warmup, "Warm-up was not started by the refresh")
+        self.assertTrue(self.wildcards_obj.warmup.wait(60), "Warm-up did not finish")
+        self.assertIsNotNone(self.wildcards_obj.wildcards["warm"].choices, "Changed wildcard was not initialized")
+
+    def test_wc_keys_index(self):  # indexed key lookup returns the same wildcards as matching every key
+        keys = list(self.wildcards_obj.wildcards.keys())
+        patterns = ["yaml/wildcard1", "YAML/wildcard1", "testwc/test?", "yaml/*", "*/wildcard1", "yaml/wildcard[1-3]"]
+        patterns += ["*", "[j-t]*/*", "yaml/anonwildcards*", "missing", "yaml/wildcard[", "yaml/", ""]
+        for pattern in patterns:
+            expected = sorted(fnmatch.filter(keys, pattern))
+            self.assertEqual([wc.key for wc in self.wildcards_obj.get_wildcards(pattern)], expected, pattern)
+            self.assertEqual([wc.key for wc in self.wildcards_obj.get_wildcards(pattern)], expected, pattern)
+        folder = self.create_wildcards_folder({"test1.txt": "one\n"})
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertEqual([wc.key for wc in self.wildcards_obj.get_wildcards("test*")], ["test1"])
+
+    def test_wc_removal_by_file(self):  # removing a file only removes its own wildcards
+        folder = self.create_wildcards_folder(
+            {"kept.txt": "one\n", "removed.yaml": "removed:\n  a: [two]\n  b: [three]\n"}
+        )
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder], "input: [four]")
+        self.assertEqual(sorted(self.wildcards_obj.wildcards), ["input", "kept", "removed/a", "removed/b"])
+        (folder / "removed.yaml").unlink()
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertEqual(sorted(self.wildcards_obj.wildcards), ["kept"])
+
+    def test_wc_fingerprint(self):  # the hash follows the content without going through the library
+        folder = self.create_wildcards_folder({"one.txt": "one\n", "two.yaml": "two:\n  a: [two]\n  b: [three]\n"})
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder], "input: [four]")
+        initial = hash(self.wildcards_obj)
+        expected = sum(hash(wildcard) for wildcard in self.wildcards_obj.wildcards.values()) % (1 << 64)
+        # hash() would reduce the expected value again
+        self.assertEqual(
+            self.wildcards_obj.__hash__(), expected, "Hash is not the sum of the hashes of the wildcards"
+        )
+        with mock.patch("ppp_wildcards.deep_freeze", side_effect=AssertionError("Library was frozen")):
+            self.assertEqual(hash(self.wildcards_obj), initial)
+        self.update_wildcards_file(folder / "one.txt", "changed\n", 1000)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder], "input: [four]")
+        self.assertNotEqual(hash(self.wildcards_obj), initial)
+        self.update_wildcards_file(folder / "one.txt", "one\n", 2000)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder], "input: [four]")
+        self.assertEqual(hash(self.wildcards_obj), initial)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertNotEqual(hash(self.wildcards_obj), initial)
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, None)
+        self.assertEqual(hash(self.wildcards_obj), 0)
+
+    def test_wc_fingerprint_lazy_load(self):  # the files that are only indexed are part of the hash too
+        folder = self.create_wildcards_folder({"lazy.txt": "one\n"})
+        self.load_wildcards(folder, lazy_load=True)
+        indexed = hash(self.wildcards_obj)
+        self.assertNotEqual(indexed, 0)
+        self.wildcards_obj.get_wildcards("lazy")
+        loaded = hash(self.wildcards_obj)
+        self.assertNotEqual(loaded, indexed)
+        self.update_wildcards_file(folder / "lazy.txt", "changed\n")
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.assertNotIn(hash(self.wildcards_obj), (0, indexed, loaded))
+
+    def test_wc_labels_index(self):  # filters are evaluated with the labels index and stored per wildcard
+        labels = [[f"l{j}" for j in range(4) if i % (j + 2) == 0] for i in range(60)]
+        content = "".join(f"  - {{ labels: {x}, text: c{i} }}\n" for i, x in enumerate(labels))
+        folder = self.create_wildcards_folder({"labeled.yaml": "labeled:\n" + content})
+        self.load_wildcards(folder)
+        filters = ["l0+l1", "3,l3", "5-9+l0,L2", "l0+l1+l2+l3", "50-70,2"]
+        for f in filters:
+            self.process(InputTuple(f"__labeled'{f}'__", ""), None)
+        wildcard = self.wildcards_obj.wildcards["labeled"]
+
+        def passes(i: int, term: str) -> bool:
+            if term.isdecimal():
+                return int(term) == i
+            if "-" in term:
+                start, end = term.split("-")
+                return int(start) <= i <= int(end)
+            return term.lower() in labels[i]
+
+        for f in filters:
+            expected = tuple(
+                i for i in range(len(labels)) if any(all(passes(i, t) for t in or_.split("+")) for or_ in f.split(","))
+            )
+            key = tuple(tuple(x.split("+")) for x in f.split(","))
+            self.assertEqual(wildcard.filters[key], expected, f"Wrong choices for filter '{f}'")
+        # the stored result is used the next time
+        wildcard.filters[(("l3",),)] = (1,)
+        self.process(InputTuple("__labeled'l3'__", ""), OutputTuple("c1", ""))
+        # a text as labels matches any part of it, while the labels in a list must be the same
+        content = "  - { labels: 'red, blue', text: t0 }\n  - { labels: [blue, Green, 5], text: t1 }\n  - t2\n"
+        folder = self.create_wildcards_folder({"texts.yaml": "texts:\n" + content})
+        self.load_wildcards(folder)
+        for f, expected in (("blue", (0, 1)), ("ED", (0,)), ("d,b+blue", (0,)), ("green,5-9", ()), ("2,red", (0, 2))):
+            self.process(InputTuple(f"__texts'{f}'__", ""), None, interrupted=not expected)
+            self.interrupted = False
+            key = tuple(tuple(x.split("+")) for x in f.split(","))
+            self.assertEqual(self.wildcards_obj.wildcards["texts"].filters[key], expected, f"Wrong choices for '{f}'")
+
+    def test_wc_flattened_includes(self):  # the included choices are obtained once for each content
+        files = {}
+        for i in range(4):
+            lines = [f"level{i} {j}" for j in range(3)]
+            if i < 3:
+                lines.append(f"%{i + 2}::include level{i + 1}")
+            files[f"level{i}.txt"] = "\n".join(lines)
+        files["diamond.txt"] = "%::include level2\n%::include level3"
+        folder = self.create_wildcards_folder(files)
+        self.load_wildcards(folder)
+        prompt = "__level0__, __r3$$level0__, __level1__"
+
+        def outputs():
+            ppp = self.init_ppp()
+            ppp.process_prompts_group_start()
+            results = [ppp.process_prompt(prompt, "", seed)[0][0] for seed in range(5)]
+            ppp.process_prompts_group_end()
+            return results
+
+        with mock.patch.object(TreeProcessor, "_TreeProcessor__get_flattened_choices", return_value=None):
+            expected = outputs()
+        self.assertEqual(outputs(), expected)
+        wildcard = self.wildcards_obj.wildcards["level0"]
+        self.assertEqual(wildcard.included[1], ["level1", "level2", "level3"])
+        self.assertEqual(len(wildcard.included[2]), 12)
+        self.assertEqual(wildcard.included[2][-1]["weight"], 2 * 3 * 4)
+        # the includes are not resolved again
+        with mock.patch.object(self.wildcards_obj, "get_wildcards", wraps=self.wildcards_obj.get_wildcards) as gw:
+            self.process(InputTuple("__level0__", ""), None)
+            self.assertEqual(gw.call_count, 1)
+        # changing an included file obtains them again
+        self.update_wildcards_file(folder / "level3.txt", "changed")
+        self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+        self.process(InputTuple("__level0__", ""), None)
+        self.assertEqual(len(self.wildcards_obj.wildcards["level0"].included[2]), 10)
+        # an included wildcard that is already seen is still reported
+        self.process(InputTuple("__diamond__", ""), None, interrupted=True)
+
+    def test_wc_plain_choices(self):  # plain text choices are not parsed and give the same results
+        plain = ["  red hat, blue_shirt! ", "%50 off", "it's \"quoted\"", "a/b=c;d*e?f", "café AN", "_x_ # c"]
+        syntax = ["(red:1.2)", "[a:b:0.5]", "{a|b}", "'lbl'::labeled", "3::heavy", "x\\, y", "a <lora:x:1>"]
+        folder = self.create_wildcards_folder(
+            {
+                "mixed.txt": "\n".join(plain + syntax),
+                "mixed.yaml": "objects:\n"
+                + "".join(f"  - {{ weight: 2, text: '{x}' }}\n" for x in ("plain text", "(syntax:1.1)"))
+                + "  - { command: true, content: 'include mixed' }\n",
+            }
+        )
+        prompts = ["__mixed__", "__3-5$$mixed__", "__objects__", "__2$$objects__"]
+
+        def outputs():
+            self.load_wildcards(folder)
+            ppp = self.init_ppp()
+            results = [ppp.process_prompt(p, "", seed)[0][0] for seed in range(6) for p in prompts]
+            return results
+
+        with mock.patch("ppp_tree.is_plain_choice_text", return_value=False):
+            expected = outputs()
+        with mock.patch("ppp_tree.parse_prompt", wraps=ppp_common.parse_prompt) as parse:
+            self.assertEqual(outputs(), expected)
+            parsed_texts = {c.args[2] for c in parse.call_args_list}
+        self.assertFalse(parsed_texts.intersection(plain + ["plain text"]), "Plain text was parsed")
+        # they are not parsed by the warm-up either
+        self.load_wildcards(folder)
+        with mock.patch("ppp_tree.parse_prompt", wraps=ppp_common.parse_prompt) as parse:
+            warmup = self.init_ppp().warm_up_wildcards(2)
+            self.assertTrue(warmup.wait(60), "Warm-up did not finish")
+            parsed_texts = {c.args[2] for c in parse.call_args_list}
+        self.assertFalse(parsed_texts.intersection(plain + ["plain text"]), "Plain text was parsed by the warm-up")
+        self.assertIn("(syntax:1.1)", parsed_texts, "Choices were not parsed by the warm-up")
+
+    def test_wc_choices_not_in_parse_cache(self):  # parsed choices do not take the place of the parsed prompts
+        folder = self.create_wildcards_folder({"parsed.txt": "(one:1.2)\n[two:three:0.5]\n"})
+        self.load_wildcards(folder)
+        put = PPPLRUCache.put
+        with mock.patch.object(PPPLRUCache, "put", autospec=True, side_effect=put) as cache_put:
+            self.process(InputTuple("__2$$parsed__", ""), None)
+            cached_texts = [c.args[1][1] for c in cache_put.call_args_list if isinstance(c.args[1], tuple)]
+        self.assertTrue(any(t.startswith("__2$$parsed__") for t in cached_texts), "Prompt was not cached")
+        self.assertFalse({"(one:1.2)", "[two:three:0.5]"}.intersection(cached_texts), "Choices were cached")
+
+    def test_wc_sampling_tables(self):  # the choices are sampled with tables built once per wildcard
+        folder = self.create_wildcards_folder(
+            {
+                "sampled.yaml": "weighted:\n"
+                + "".join(f"  - {{ weight: {1 + i % 4}, text: w{i} }}\n" for i in range(40))
+                + "conditional:\n"
+                + "".join(f"  - {{ weight: {1 + i % 3}, if: mode eq 'b', text: b{i} }}\n" for i in range(5))
+                + "".join(f"  - {{ weight: {1 + i % 2}, text: a{i} }}\n" for i in range(5))
+            }
+        )
+        self.load_wildcards(folder)
+        prompt = (
+            "${mode=a}__weighted__, __r3$$weighted__, __2-4$$weighted__, "
+            + "__conditional__, ${mode=b}__2$$conditional__"
+        )
+        ppp = self.init_ppp()
+        ppp.process_prompts_group_start()
+        results = [ppp.process_prompt(prompt, "", seed)[0][0] for seed in range(4)]
+        ppp.process_prompts_group_end()
+        # the same results as sampling with the generator from the weights each time
+        self.assertEqual(
+            results,
+            [
+                "w26, w11, w2, w1, w37, w24, a3, b4, a3",
+                "w21, w38, w6, w38, w17, w33, a1, b4, b0",
+                "w11, w11, w33, w3, w29, w7, w2, a1, a1, b4",
+                "w3, w10, w32, w23, w18, w19, a0, a1, b1",
+            ],
+        )
+        weighted = self.wildcards_obj.wildcards["weighted"].sampling
+        conditional = self.wildcards_obj.wildcards["conditional"].sampling
+        self.assertFalse(weighted.conditional)
+        self.assertTrue(conditional.conditional)
+        # the tables are only built again when the conditions exclude some choices
+        new_sampling_table = TreeProcessor._TreeProcessor__new_sampling_table  # pylint: disable=no-member
+        with mock.patch.object(
+            TreeProcessor, "_TreeProcessor__new_sampling_table", autospec=True, side_effect=new_sampling_table
+        ) as new_table:
+            self.process(InputTuple("${mode=b}__weighted__, __3$$weighted__, __conditional__", ""), None)
+            new_table.assert_not_called()
+            self.process(InputTuple("${mode=a}__conditional__", ""), None)
+            new_table.assert_called_once()
+        self.assertIs(self.wildcards_obj.wildcards["weighted"].sampling, weighted)
+        self.assertIs(self.wildcards_obj.wildcards["conditional"].sampling, conditional)
+
+    def test_wc_folder_scanner(self):  # unchanged folders are not read again, but changed files are detected
+        folder = self.create_wildcards_folder(
+            {"a.txt": "a\n", "sub/one.txt": "one\n", "z.txt": "z\n", ".hidden.txt": "hidden\n"}
+        )
+        scanner = PPPFolderScanner()
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            [(_, files)] = scanner.scan([folder])
+            self.assertEqual(scandir.call_count, 2, "Folders were not read")
+            # the folders were just modified, so they are read again
+            [(_, files)] = scanner.scan([folder])
+            self.assertEqual(scandir.call_count, 4, "Recently modified folders were not read again")
+        # the files are listed in the order of the folder, with the subfolders where they are found
+        order = [p for p in os.listdir(folder) if not p.startswith(".")]
+        expected = [folder / p if p != "sub" else folder / "sub" / "one.txt" for p in order]
+        self.assertEqual(list(files), expected, "Wrong order of the files")
+        os.utime(folder, (1000, 1000))
+        os.utime(folder / "sub", (1000, 1000))
+        os.utime(folder / "sub" / "one.txt", (1000, 1000))
+        scanner.scan([folder])
+        with mock.patch("os.scandir", side_effect=AssertionError("Folder was read")):
+            [(_, files)] = scanner.scan([folder])
+        self.assertEqual(files[folder / "sub" / "one.txt"], 1000, "Changed file was not detected")
+        # a new file changes the modification time of its folder
+        (folder / "sub" / "two.txt").write_text("two\n", encoding="utf-8")
+        [(_, files)] = scanner.scan([folder])
+        self.assertIn(folder / "sub" / "two.txt", files, "New file was not detected")
+        # a new file in the same timestamp tick as the previous scan is detected
+        mtime = time.time_ns()
+        os.utime(folder / "sub", ns=(mtime, mtime))
+        scanner.scan([folder])
+        (folder / "sub" / "three.txt").write_text("three\n", encoding="utf-8")
+        os.utime(folder / "sub", ns=(mtime, mtime))
+        [(_, files)] = scanner.scan([folder])
+        self.assertIn(folder / "sub" / "three.txt", files, "New file in the same timestamp tick was not detected")
+        self.assertEqual(scanner.scan([folder / "missing"]), [(folder / "missing", None)])
+
+    def test_wc_folder_watcher(self):  # with the watcher, refreshing does not scan the folders unless they change
+        def wait_for(condition):
+            deadline = time.monotonic() + 10
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            return condition()
+
+        folder = self.create_wildcards_folder({"watched.txt": "one\n"})
+        self.wildcards_obj = PPPWildcards(self.ppp_logger, None, watch_folders=True)
+        try:
+            self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+            with mock.patch.object(PPPFolderScanner, "scan", side_effect=AssertionError("Folders were scanned")):
+                self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+            (folder / "watched.txt").write_text("two\n", encoding="utf-8")
+            (folder / "new.txt").write_text("three\n", encoding="utf-8")
+
+            def refreshed(expected_keys):
+                self.wildcards_obj.refresh_wildcards(DEBUG_LEVEL.full, [folder])
+                wildcards = self.wildcards_obj.wildcards
+                return wildcards["watched"].unprocessed_choices == ["two"] and sorted(wildcards) == expected_keys
+
+            # only the changed files are checked
+            with mock.patch.object(PPPFolderScanner, "scan", side_effect=AssertionError("Folders were scanned")):
+                self.assertTrue(wait_for(lambda: refreshed(["new", "watched"])), "Changes were not detected")
+                (folder / "new.txt").unlink()
+                self.assertTrue(wait_for(lambda: refreshed(["watched"])), "Removal was not detected")
+        finally:
+            self.wildcards_obj.stop_watching()
+        # polling is used when a folder does not exist yet
+        changes = []
+        watcher = PPPFolderWatcher([folder / "later"], changes.append, poll_interval=0.05)
+        try:
+            self.assertEqual(watcher.backend, "polling")
+            (folder / "later").mkdir()
+            (folder / "later" / "new.txt").write_text("three\n", encoding="utf-8")
+            self.assertTrue(
+                wait_for(lambda: any(c and folder / "later" / "new.txt" in c for c in changes)), "File was not detected"
+            )
+            self.assertIn(folder / "later" / "new.txt", watcher.take_changes(), "Changes were not accumulated")
+            self.assertEqual(watcher.take_changes(), set(), "Changes were not cleared")
+        finally:
+            watcher.stop()
+        # polling is used when the inotify watches can't be kept
+        if not sys.platform.startswith("linux"):
+            return  # inotify is only used in Linux
+        with mock.patch.object(PPPFolderWatcher, "_PPPFolderWatcher__read_inotify_events", side_effect=OSError):
+            changes = []
+            watcher = PPPFolderWatcher([folder], changes.append, poll_interval=0.05)
+            self.assertTrue(wait_for(lambda: watcher.backend == "polling"), "Watcher did not fall back to polling")
+        try:
+            self.assertTrue(wait_for(lambda: None in changes), "Unknown changes were not reported")
+            (folder / "polled.txt").write_text("four\n", encoding="utf-8")
+            self.assertTrue(
+                wait_for(lambda: any(c and folder / "polled.txt" in c for c in changes)), "Change was not detected"
+            )
+            self.assertTrue(watcher.is_watching([folder]), "Watcher stopped after falling back to polling")
+        finally:
+            watcher.stop()
+
+    def test_wc_parallel_load(self):  # loading files in parallel gives the same wildcards in the same order
+        folders = [Path(__file__).parent / "wildcards", Path(__file__).parent / "wildcards2"]
+        sequential = PPPWildcards(self.ppp_logger, None)
+        sequential.refresh_wildcards(DEBUG_LEVEL.full, folders)
+        expected = [(k, wc.file, wc.unprocessed_choices) for k, wc in sequential.wildcards.items()]
+        for load_processes in (0, 2):
+            with (
+                mock.patch.object(PPPWildcards, "PARALLEL_LOAD_MIN_FILES", 2),
+                mock.patch("os.cpu_count", return_value=4),
+            ):
+                parallel = PPPWildcards(self.ppp_logger, None, load_processes=load_processes)
+                parallel.refresh_wildcards(DEBUG_LEVEL.full, folders)
+            result = [(k, wc.file, wc.unprocessed_choices) for k, wc in parallel.wildcards.items()]
+            self.assertEqual(result, expected, f"Different result with {load_processes} processes")
+
+    def test_wc_structured_loaders(self):  # the fast loaders return the same content as the YAML loader
+        from ruamel.yaml import YAML  # pylint: disable=import-outside-toplevel
+
+        for text in (
+            '{"a": ["one", "two (three:1.5)"], "b": {"c": [1, 2.5, true, null, "\\u00e9"]}}',
+            '{"a": ["one"], "a": ["two"]}',  # duplicated keys are rejected by YAML
+            '{"a": ["one",], "b": "two"}',  # not valid JSON but valid YAML
+            "a:\n  - one\n  - 'two: three'\nb: yes\n",
+        ):
+            try:
+                expected = YAML(typ="safe").load(text)
+            except Exception as e:  # pylint: disable=broad-except
+                with self.assertRaises(type(e)):
+                    load_structured_text(text, True)
+                continue
+            self.assertEqual(load_structured_text(text, True), expected, text)
+            self.assertEqual(load_structured_text(text), expected, text)
+        # YAML is parsed with the C parser when it is installed
+        from ruamel.yaml.cyaml import CParser  # pylint: disable=import-outside-toplevel
+
+        if CParser is not None:
+            with mock.patch("ruamel.yaml.parser.Parser.check_event", side_effect=AssertionError("Pure parser")):
+                self.assertEqual(load_structured_text("a: [b]\n"), {"a": ["b"]}, "Wrong YAML content")
+        self.assertEqual(decode_text("caf\u00e9".encode("utf-8")), ("caf\u00e9", False))
+        self.assertEqual(decode_text("caf\u00e9".encode("windows-1252")), ("caf\u00e9", True))